@@ -0,0 +1,81 @@
+"""
+Cheap, version-based ETags for the read endpoints the mobile app polls.
+
+ETags are derived from the change counters on Group and Wallet (bumped by
+signals in chema.signals / wallet.signals), so they are computed from one
+indexed lookup without serializing the payload. A matching If-None-Match
+short-circuits the view before any of its queries run.
+"""
+import hashlib
+from functools import wraps
+
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from chema.models import Group, GroupMembership
+from wallet.models import Wallet
+
+
+def make_etag(namespace, request, *parts):
+    raw = repr((namespace, request.user.pk, request.GET.urlencode(), parts))
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+
+def conditional_etag(etag_func):
+    """
+    Decorate a viewset method. `etag_func(request, *args, **kwargs)` returns
+    an ETag, or None to skip conditional handling.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            etag = etag_func(request, *args, **kwargs)
+            if etag is None:
+                return view_method(self, request, *args, **kwargs)
+
+            if etag in parse_etags(request.headers.get('If-None-Match', '')):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+            response['ETag'] = etag
+            # Clients may keep the body but must revalidate every time
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def my_groups_etag(request, *args, **kwargs):
+    """groups/mine/: the caller's memberships plus each group's version."""
+    rows = list(
+        GroupMembership.objects.filter(member__user=request.user, status='active')
+        .order_by('group_id')
+        .values_list('group_id', 'group__version', 'group__updated_at', 'is_active',
+                     'is_admin', 'role', 'last_viewed_at')
+    )
+    return make_etag('groups.mine', request, rows)
+
+
+def group_etag(namespace):
+    """Per-group endpoints such as groups/{id}/members/."""
+    def etag_func(request, pk=None, *args, **kwargs):
+        row = Group.objects.filter(pk=pk, is_active=True).values_list('version', 'updated_at').first()
+        if row is None:
+            # Let the view produce its 404
+            return None
+        return make_etag(namespace, request, pk, row)
+    return etag_func
+
+
+def wallet_etag(namespace):
+    """The caller's wallet: balance and transaction history."""
+    def etag_func(request, *args, **kwargs):
+        version = Wallet.objects.filter(user=request.user).values_list('version', flat=True).first()
+        if version is None:
+            return None
+        return make_etag(namespace, request, version)
+    return etag_func
@@ -0,0 +1,122 @@
+"""
+Idempotency-Key support for the money-moving API endpoints.
+
+A client sends a unique `Idempotency-Key` header with a POST and reuses it
+when retrying. The first request claims the key (a unique row per user) and
+its response is stored; retries within IDEMPOTENCY_KEY_TTL get that
+response back without the view running again. A retry that arrives while
+the first request is still running gets 409, and reusing a key for a
+different request gets 422. Server errors release the key so the client can
+try again, and a claim left unfinished for IDEMPOTENCY_LEASE_SECONDS (the
+worker died mid-request) is taken over by the next retry. Expired keys are removed by `manage.py purge_idempotency_keys`.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=JSONEncoder, default=str)
+    raw = f"{request.method} {request.path}\n{body}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _claim(request, key, fingerprint):
+    """Create the key row; returns (record, created)."""
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=request.user, key=key, fingerprint=fingerprint, expires_at=expires_at
+            ), True
+    except IntegrityError:
+        pass
+
+    record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+    abandoned_before = now - timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS)
+    if (record is None or record.expires_at <= now
+            or (record.response_status is None and record.created_at <= abandoned_before)):
+        # Released, expired or abandoned in the meantime: claim it afresh. The
+        # delete is conditional, so only one of several retries takes it over
+        IdempotencyKey.objects.filter(user=request.user, key=key).filter(
+            Q(expires_at__lte=now) | Q(response_status__isnull=True, created_at__lte=abandoned_before)
+        ).delete()
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    user=request.user, key=key, fingerprint=fingerprint, expires_at=expires_at
+                ), True
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+    return record, False
+
+
+def idempotent(view_method):
+    """Decorate a viewset action that moves money."""
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({'error': 'Idempotency-Key is too long'}, status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = request_fingerprint(request)
+        record, created = _claim(request, key, fingerprint)
+        if not created:
+            if record is None or record.response_status is None:
+                return Response({'error': 'A request with this Idempotency-Key is still being processed'},
+                                status=status.HTTP_409_CONFLICT)
+            if record.fingerprint != fingerprint:
+                return Response({'error': 'Idempotency-Key was already used for a different request'},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            response = Response(record.response_body, status=record.response_status)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+
+        if response.status_code >= 500:
+            record.delete()
+            return response
+
+        # An update rather than save(): the claim may have been taken over
+        IdempotencyKey.objects.filter(pk=record.pk).update(
+            response_status=response.status_code,
+            response_body=json.loads(json.dumps(response.data, cls=JSONEncoder)),
+        )
+        return response
+    return wrapper
+
+
+def purge_expired_keys(batch_size=5000, now=None):
+    """Delete expired keys in batches. Returns the number removed."""
+    now = now or timezone.now()
+    removed = 0
+    while True:
+        batch = list(
+            IdempotencyKey.objects.filter(expires_at__lte=now).order_by('expires_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not batch:
+            break
+        removed += IdempotencyKey.objects.filter(id__in=batch).delete()[0]
+    return removed
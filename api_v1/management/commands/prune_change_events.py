@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api_v1.sync import prune_change_events
+
+
+class Command(BaseCommand):
+    help = 'Deletes sync change events older than the retention window; older client tokens get a reset'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        removed = prune_change_events(cutoff, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} change event(s)'))
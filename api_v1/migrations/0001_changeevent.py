@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-19 05:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('operation', models.CharField(choices=[('upsert', 'Created or updated'), ('delete', 'Deleted')], default='upsert', max_length=10)),
+                ('group_id', models.BigIntegerField(blank=True, null=True)),
+                ('wallet_id', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['group_id', 'id'], name='api_v1_chan_group_i_8d7eec_idx'), models.Index(fields=['wallet_id', 'id'], name='api_v1_chan_wallet__ed6388_idx')],
+            },
+        ),
+    ]
@@ -1,3 +1,56 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+
+class ChangeEvent(models.Model):
+    """
+    Append-only change feed behind the delta sync endpoint (api_v1.sync).
+    The primary key is the monotonically increasing change sequence number;
+    deletions are kept as tombstones (operation='delete').
+    """
+    OPERATION_CHOICES = [
+        ('upsert', 'Created or updated'),
+        ('delete', 'Deleted'),
+    ]
+
+    kind = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    operation = models.CharField(max_length=10, choices=OPERATION_CHOICES, default='upsert')
+    # Visibility scope: group-scoped rows carry group_id, ledger rows wallet_id
+    group_id = models.BigIntegerField(null=True, blank=True)
+    wallet_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['group_id', 'id']),
+            models.Index(fields=['wallet_id', 'id']),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.operation} {self.kind}:{self.object_id}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Stored outcome of a money-moving API request sent with an Idempotency-Key
+    header (api_v1.idempotency). Retries with the same key get the stored
+    response back instead of running the request again.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    # Hash of method, path and body: a reused key must carry the same request
+    fingerprint = models.CharField(max_length=64)
+    # Null while the first request is still running
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}:{self.key}"
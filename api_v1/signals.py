@@ -0,0 +1,57 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from chema.models import Comment, Group, GroupMembership, Post
+from condolence.models import Deceased
+from wallet.models import Transaction
+
+from .models import ChangeEvent
+from .sync import append_events
+
+
+def _record(kind, instance, operation, group_id=None, wallet_id=None):
+    append_events([
+        ChangeEvent(kind=kind, object_id=instance.pk, operation=operation, group_id=group_id, wallet_id=wallet_id)
+    ])
+
+
+def _operation(signal):
+    return 'delete' if signal is post_delete else 'upsert'
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def record_group_change(sender, instance, signal, **kwargs):
+    _record('group', instance, _operation(signal), group_id=instance.pk)
+
+
+@receiver(post_save, sender=GroupMembership)
+@receiver(post_delete, sender=GroupMembership)
+def record_membership_change(sender, instance, signal, **kwargs):
+    _record('membership', instance, _operation(signal), group_id=instance.group_id)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def record_post_change(sender, instance, signal, **kwargs):
+    _record('post', instance, _operation(signal), group_id=instance.group_id)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def record_comment_change(sender, instance, signal, **kwargs):
+    # Comments are deleted before their post when a post cascades
+    group_id = Post.objects.filter(pk=instance.post_id).values_list('group_id', flat=True).first()
+    _record('comment', instance, _operation(signal), group_id=group_id)
+
+
+@receiver(post_save, sender=Deceased)
+@receiver(post_delete, sender=Deceased)
+def record_deceased_change(sender, instance, signal, **kwargs):
+    _record('deceased', instance, _operation(signal), group_id=instance.group_id)
+
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+def record_transaction_change(sender, instance, signal, **kwargs):
+    _record('transaction', instance, _operation(signal), wallet_id=instance.wallet_id)
@@ -0,0 +1,193 @@
+"""
+Delta sync for offline-capable mobile clients (see sync_api_view).
+
+Every create, update and delete of a synced row appends a ChangeEvent
+(api_v1.signals). The event id is the change sequence number and doubles as
+the client's sync token: `sync/?since=<token>` returns the current state of
+rows changed after that point plus tombstones for deleted ones, scoped to
+the caller's groups and wallet.
+
+Events are inserted when the writing transaction commits, not while it is
+open, so however long a transaction runs its events get ids above every
+token handed out before it committed.
+
+Code paths that bypass model signals (QuerySet.update, bulk_create) must
+call `record_changes` themselves.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from chema.models import Comment, Group, GroupMembership, Post
+from condolence.models import Deceased
+from wallet.models import Transaction, Wallet
+
+from .models import ChangeEvent
+
+SYNC_BATCH_SIZE = 500
+# Events are inserted on commit (append_events), but each insert still
+# allocates its id before its own commit, so a lower id can become visible
+# just after a higher one. Events younger than this are left for the next
+# sync instead of being skipped.
+SYNC_SETTLE_SECONDS = 2
+
+# kind -> (model, compact columns, response key)
+SYNC_KINDS = {
+    'group': (Group, {
+        'id': 'id', 'name': 'name', 'description': 'description', 'cover_image': 'cover_image',
+        'is_active': 'is_active', 'requires_approval': 'requires_approval', 'updated_at': 'updated_at',
+    }, 'groups'),
+    'membership': (GroupMembership, {
+        'id': 'id', 'group': 'group_id', 'member': 'member_id', 'first_name': 'member__first_name',
+        'surname': 'member__surname', 'status': 'status', 'role': 'role', 'is_admin': 'is_admin',
+        'is_active': 'is_active', 'is_deceased': 'is_deceased', 'date_joined': 'date_joined',
+        'approved_at': 'approved_at',
+    }, 'memberships'),
+    'post': (Post, {
+        'id': 'id', 'group': 'group_id', 'author': 'author_id', 'content': 'content', 'image': 'image',
+        'video': 'video', 'approved': 'approved', 'created_at': 'created_at',
+    }, 'posts'),
+    'comment': (Comment, {
+        'id': 'id', 'post': 'post_id', 'author': 'author_id', 'content': 'content', 'created_at': 'created_at',
+    }, 'comments'),
+    'deceased': (Deceased, {
+        'id': 'id', 'group': 'group_id', 'deceased': 'deceased_id', 'date': 'date',
+        'contributions_open': 'contributions_open', 'cont_is_active': 'cont_is_active',
+        'beneficiary': 'beneficiary_id', 'funds_disbursed': 'funds_disbursed',
+    }, 'deceased'),
+    'transaction': (Transaction, {
+        'id': 'id', 'transaction_type': 'transaction_type', 'amount': 'amount', 'status': 'status',
+        'destination_group': 'destination_group_id',
+        'recipient_wallet': 'recipient_wallet_id', 'deceased_contribution': 'deceased_contribution_id',
+        'timestamp': 'timestamp',
+    }, 'transactions'),
+}
+
+
+def append_events(events):
+    """Insert `events` once the current transaction commits (at once outside one)."""
+    transaction.on_commit(lambda: ChangeEvent.objects.bulk_create(events))
+
+
+def record_changes(kind, object_ids, operation='upsert', group_id=None, wallet_id=None):
+    append_events([
+        ChangeEvent(kind=kind, object_id=pk, operation=operation, group_id=group_id, wallet_id=wallet_id)
+        for pk in object_ids
+    ])
+
+
+def record_membership_changes(memberships):
+    """Record upserts for memberships changed through QuerySet.update()."""
+    append_events([
+        ChangeEvent(kind='membership', object_id=pk, group_id=group_id)
+        for pk, group_id in memberships.values_list('pk', 'group_id')
+    ])
+
+
+def record_transaction_changes(transactions):
+    """Record upserts for transactions written with bulk_create() or update()."""
+    append_events([
+        ChangeEvent(kind='transaction', object_id=t.pk, wallet_id=t.wallet_id) for t in transactions
+    ])
+
+
+def current_token():
+    return ChangeEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def token_expired(since):
+    """True when events after `since` have been pruned (prune_change_events)."""
+    oldest = ChangeEvent.objects.order_by('id').values_list('id', flat=True).first()
+    return oldest is not None and oldest > since + 1 and not ChangeEvent.objects.filter(id__lte=since).exists()
+
+
+def prune_change_events(cutoff, batch_size=5000):
+    """Delete events created before `cutoff`. Returns the number removed."""
+    removed = 0
+    while True:
+        batch = list(
+            ChangeEvent.objects.filter(created_at__lt=cutoff).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not batch:
+            break
+        removed += ChangeEvent.objects.filter(id__in=batch).delete()[0]
+    return removed
+
+
+def _fetch_rows(kind, ids):
+    model, columns, _ = SYNC_KINDS[kind]
+    names, lookups = list(columns), list(columns.values())
+    rows = model.objects.filter(pk__in=ids).values_list(*lookups)
+    return {row[0]: dict(zip(names, row)) for row in rows}
+
+
+def changes_since(user, since, limit=SYNC_BATCH_SIZE):
+    """
+    Return the sync payload for `user` covering events after `since`.
+    Several events for the same row collapse into its current state.
+    """
+    profile = user.profile
+    group_ids = list(
+        GroupMembership.objects.filter(member=profile, status='active').values_list('group_id', flat=True)
+    )
+    wallet_id = Wallet.objects.filter(user=user).values_list('id', flat=True).first()
+
+    scope = Q(group_id__in=group_ids)
+    if wallet_id is not None:
+        scope |= Q(wallet_id=wallet_id)
+    # The caller's own membership rows are always visible, so leaving a
+    # group or being removed from it still reaches the client.
+    own_memberships = GroupMembership.objects.filter(member=profile).values_list('pk', flat=True)
+    scope |= Q(kind='membership', object_id__in=own_memberships)
+
+    settled = timezone.now() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    events = list(
+        ChangeEvent.objects.filter(scope, id__gt=since, created_at__lte=settled)
+        .order_by('id')
+        .values_list('id', 'kind', 'object_id', 'operation')[:limit]
+    )
+
+    latest = {}
+    for _, kind, object_id, operation in events:
+        if kind in SYNC_KINDS:
+            latest[(kind, object_id)] = operation
+
+    changed = {key: [] for _, _, key in SYNC_KINDS.values()}
+    deleted = {key: [] for _, _, key in SYNC_KINDS.values()}
+    for kind, (_, _, key) in SYNC_KINDS.items():
+        upserts = [pk for (k, pk), op in latest.items() if k == kind and op == 'upsert']
+        rows = _fetch_rows(kind, upserts) if upserts else {}
+        changed[key] = list(rows.values())
+        # Rows deleted after their upsert event are reported as deletions too
+        deleted[key] = sorted(
+            pk for (k, pk), op in latest.items() if k == kind and (op == 'delete' or pk not in rows)
+        )
+
+    # Groups the caller joined or was approved into since the token need
+    # their history fetched once; events from before were never sent.
+    since_time = ChangeEvent.objects.filter(id=since).values_list('created_at', flat=True).first()
+    resync = sorted({
+        row['group'] for row in changed['memberships']
+        if row['member'] == profile.id and row['status'] == 'active' and (
+            since_time is None
+            or row['date_joined'] > since_time
+            or (row['approved_at'] and row['approved_at'] > since_time)
+        )
+    })
+
+    has_more = len(events) == limit
+    token = events[-1][0] if events else since
+    if not has_more:
+        # Skip past settled events outside the caller's scope as well
+        token = max(token, ChangeEvent.objects.filter(id__gt=since, created_at__lte=settled)
+                    .order_by('-id').values_list('id', flat=True).first() or 0)
+
+    return {
+        'token': str(token),
+        'has_more': has_more,
+        'changes': changed,
+        'deleted': deleted,
+        'resync_groups': resync,
+    }
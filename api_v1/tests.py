@@ -1,3 +1,379 @@
+"""
+Query budgets for every /api/v1/ route (see core.testing).
+
+Read endpoints are checked at two dataset sizes and must run the same number
+of queries at both. Writes run once: repeating them changes what they do.
+Also here: Idempotency-Key handling of the money-moving endpoints, the
+ordering of sync change events and resumable uploads.
+"""
+import hashlib
+import os
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api_v1.models import ChangeEvent, IdempotencyKey
+from api_v1.sync import changes_since
+from chema.models import GroupMembership, Post
+from condolence.models import Contribution
+from core.testing import QueryBudgetTestCase, TemporaryMediaMixin, make_group
+from user.models import CustomUser
+from wallet.models import Transaction
+
+API = '/api/v1'
+
+
+class ReadBudgetTests(QueryBudgetTestCase):
+
+    def test_api_root(self):
+        self.assert_budget(f'{API}/', 0)
+
+    def test_profiles(self):
+        self.assert_budget(f'{API}/profiles/', 1)
+
+    def test_profile_me(self):
+        self.assert_budget(f'{API}/profiles/me/', 0)
+
+    def test_profile_detail(self):
+        self.assert_budget(f'{API}/profiles/{self.profile.id}/', 1)
+
+    def test_groups(self):
+        self.assert_budget(f'{API}/groups/', 1)
+
+    def test_groups_mine(self):
+        self.assert_budget(f'{API}/groups/mine/', 2)
+
+    def test_group_detail(self):
+        self.assert_budget(f'{API}/groups/{self.group.id}/', 1)
+
+    def test_group_dashboard(self):
+        self.assert_budget(f'{API}/groups/{self.group.id}/dashboard/', 5, status=200)
+
+    def test_group_members(self):
+        self.assert_budget(f'{API}/groups/{self.group.id}/members/', 3)
+
+    def test_group_pending_members(self):
+        self.assert_budget(f'{API}/groups/{self.group.id}/pending_members/', 3, status=200)
+
+    def test_group_transactions(self):
+        self.assert_budget(f'{API}/groups/{self.group.id}/transactions/', 6, status=200)
+
+    def test_memberships(self):
+        self.assert_budget(f'{API}/memberships/', 1)
+
+    def test_membership_detail(self):
+        self.assert_budget(f'{API}/memberships/{self.member.id}/', 1)
+
+    def test_posts(self):
+        self.assert_budget(f'{API}/posts/', 3)
+
+    def test_posts_for_group(self):
+        self.assert_budget(f'{API}/posts/?group_id={self.group.id}&page_size=50', 3)
+
+    def test_post_detail(self):
+        self.assert_budget(f'{API}/posts/{self.post.id}/', 2)
+
+    def test_post_images(self):
+        self.assert_budget(f'{API}/post-images/', 1)
+
+    def test_comments(self):
+        self.assert_budget(f'{API}/comments/', 2)
+
+    def test_comment_detail(self):
+        self.assert_budget(f'{API}/comments/{self.comment.id}/', 2)
+
+    def test_replies(self):
+        self.assert_budget(f'{API}/replies/', 1)
+
+    def test_reply_detail(self):
+        self.assert_budget(f'{API}/replies/{self.reply.id}/', 1)
+
+    def test_deceased(self):
+        response = self.assert_budget(f'{API}/deceased/', 1)
+        # The mobile wallet screen renders these nested names and pictures
+        row = next(row for row in response.json() if row['id'] == self.campaign.id)
+        self.assertEqual(row['deceased_detail']['full_name'], self.deceased_profile.full_name)
+        self.assertIn('profile_picture', row['deceased_detail'])
+        self.assertEqual(row['group_detail']['name'], self.group.name)
+
+    def test_deceased_detail(self):
+        self.assert_budget(f'{API}/deceased/{self.campaign.id}/', 9)
+
+    def test_contributions(self):
+        Contribution.objects.create(
+            group=self.group, deceased_member=self.campaign, contributing_member=self.profile, amount=Decimal('10.00')
+        )
+        response = self.assert_budget(f'{API}/contributions/', 2)
+        detail = response.json()['results'][0]['deceased_member_detail']
+        self.assertEqual(detail['deceased_detail']['full_name'], self.deceased_profile.full_name)
+        self.assertIn('profile_picture', detail['deceased_detail'])
+        self.assertEqual(detail['group_detail']['name'], self.group.name)
+
+    def test_contribution_detail(self):
+        contribution = Contribution.objects.create(
+            group=self.group, deceased_member=self.campaign, contributing_member=self.profile, amount=Decimal('10.00')
+        )
+        self.assert_budget(f'{API}/contributions/{contribution.id}/', 16, status=200)
+
+    def test_wallets(self):
+        self.assert_budget(f'{API}/wallets/', 5)
+
+    def test_wallet_balance(self):
+        self.assert_budget(f'{API}/wallets/balance/', 5)
+
+    def test_wallet_detail(self):
+        self.assert_budget(f'{API}/wallets/{self.me.wallet.id}/', 5)
+
+    def test_transactions(self):
+        self.assert_budget(f'{API}/transactions/', 2)
+
+    def test_transaction_detail(self):
+        transaction = self.me.wallet.transactions.order_by('pk').first()
+        self.assert_budget(f'{API}/transactions/{transaction.id}/', 1, status=200)
+
+    def test_users_me(self):
+        self.assert_budget(f'{API}/users/me/', 0)
+
+    def test_device_tokens(self):
+        self.assert_budget(f'{API}/device-tokens/', 1)
+
+    def test_search(self):
+        self.assert_budget(f'{API}/search/?q=member', 2)
+
+    def test_bootstrap(self):
+        self.assert_budget(f'{API}/bootstrap/?transactions=50', 3)
+
+    def test_sync(self):
+        self.assert_budget(f'{API}/sync/', 1)
+
+    def test_contacts(self):
+        self.assert_budget(f'{API}/contacts/', 2)
+
+
+class WriteBudgetTests(QueryBudgetTestCase):
+
+    def write(self, url, max_queries, data=None, status=None, method='POST'):
+        return self.assert_budget(url, max_queries, method=method, data=data, status=status, scales=False)
+
+    def test_auth_token(self):
+        self.me.set_password('budget-password')
+        self.me.save()
+        self.assert_budget(f'{API}/auth-token/', 5, method='POST', client=APIClient(), scales=False, status=200,
+                           data={'username': self.me.email, 'password': 'budget-password'})
+
+    def test_password_reset(self):
+        self.assert_budget(f'{API}/password-reset/', 2, method='POST', client=APIClient(), scales=False,
+                           data={'email': self.me.email}, status=200)
+
+    def test_signup(self):
+        self.assert_budget(f'{API}/users/signup/', 8, method='POST', client=APIClient(), scales=False,
+                           data={'email': 'new@budget.test', 'password': 'budget-password'}, status=201)
+
+    def test_profile_update(self):
+        self.write(f'{API}/profiles/{self.profile.id}/', 9, {'bio': 'Budget'}, status=200, method='PATCH')
+
+    def test_group_join(self):
+        group = GroupMembership.objects.filter(member=self.profile).exclude(group=self.group).first().group
+        GroupMembership.objects.filter(member=self.profile, group=group).delete()
+        self.write(f'{API}/groups/{group.id}/join/', 8, status=201)
+
+    def test_group_leave(self):
+        self.write(f'{API}/groups/{self.other_group.id}/leave/', 6, status=200)
+
+    def test_group_select(self):
+        self.write(f'{API}/groups/{self.other_group.id}/select/', 7, status=200)
+
+    def test_group_levy_opt_in(self):
+        self.write(f'{API}/groups/{self.group.id}/levy_opt_in/', 6, {'opt_in': False}, status=200)
+
+    def test_group_mark_read(self):
+        self.write(f'{API}/groups/{self.group.id}/mark_read/', 2, status=200)
+
+    def test_membership_approve(self):
+        self.member.status = 'pending'
+        self.member.save()
+        self.write(f'{API}/memberships/{self.member.id}/approve/', 9, status=200)
+
+    def test_membership_reject(self):
+        self.member.status = 'pending'
+        self.member.save()
+        self.write(f'{API}/memberships/{self.member.id}/reject/', 9, status=200)
+
+    def test_membership_declare_deceased(self):
+        self.write(f'{API}/memberships/{self.member.id}/declare_deceased/', 9, status=200)
+
+    def test_post_create(self):
+        self.write(f'{API}/posts/', 11, {'group': self.group.id, 'content': 'Budget post'}, status=201)
+
+    def test_post_update(self):
+        post = Post.objects.filter(author=self.profile).first()
+        self.write(f'{API}/posts/{post.id}/', 7, {'content': 'Edited'}, status=200, method='PATCH')
+
+    def test_post_delete(self):
+        post = Post.objects.filter(author=self.profile).first()
+        self.write(f'{API}/posts/{post.id}/', 21, status=204, method='DELETE')
+
+    def test_post_like(self):
+        post = Post.objects.filter(author=self.profile).first()
+        self.write(f'{API}/posts/{post.id}/like/', 4, status=200)
+
+    def test_comment_create(self):
+        self.write(f'{API}/comments/', 5, {'post': self.post.id, 'content': 'Budget comment'}, status=201)
+
+    def test_reply_create(self):
+        self.write(f'{API}/replies/', 2, {'comment': self.comment.id, 'content': 'Budget reply'}, status=201)
+
+    def test_upload_create(self):
+        self.write(f'{API}/uploads/', 1, {'filename': 'clip.mp4', 'total_size': 1024}, status=201)
+
+    def test_deceased_levy(self):
+        self.write(f'{API}/deceased/{self.campaign.id}/levy/', 7, {'amount': '5.00'})
+
+    def test_deceased_bulk_contributions(self):
+        new_members = [CustomUser.objects.create_user(email=f'cash{i}@budget.test').profile for i in range(2)]
+        GroupMembership.objects.bulk_create([
+            GroupMembership(group=self.group, member=profile, status='active') for profile in new_members
+        ])
+        rows = [{'contributing_member': profile.id, 'amount': '25.00', 'payment_method': 'cash'}
+                for profile in new_members]
+        self.write(f'{API}/deceased/{self.campaign.id}/bulk_contributions/', 9, {'contributions': rows}, status=201)
+
+    def test_deceased_disburse_funds(self):
+        # Includes deactivating the fixture's malformed device tokens before the push
+        self.write(f'{API}/deceased/{self.campaign.id}/disburse_funds/', 25, status=200)
+
+    def test_wallet_top_up(self):
+        self.write(f'{API}/wallets/top_up/', 8, {'amount': '50.00', 'voucher_reference': 'VOUCHER-1'}, status=200)
+
+    def test_wallet_send_money(self):
+        self.write(f'{API}/wallets/send_money/', 22, {'recipient_user_id': self.member.member.user_id,
+                                                    'amount': '5.00'}, status=200)
+
+    def test_wallet_contribute_to_deceased(self):
+        self.write(f'{API}/wallets/contribute_to_deceased/', 33, {'deceased_id': self.campaign.id,
+                                                                'amount': '20.00'}, status=200)
+
+    def test_device_token_register(self):
+        self.write(f'{API}/device-tokens/register/', 6, {'token': 'budget-token', 'platform': 'ios'}, status=200)
+
+
+class IdempotencyTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='retry@idempotency.test', is_active=True)
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def top_up(self, key='key-1', amount='50.00'):
+        return self.api.post(f'{API}/wallets/top_up/', {'amount': amount, 'voucher_reference': 'VOUCHER-1'},
+                             format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def top_ups(self):
+        return Transaction.objects.filter(wallet__user=self.user, transaction_type='TOP_UP').count()
+
+    def test_retry_replays_the_stored_response(self):
+        first = self.top_up()
+        retry = self.top_up()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual((retry.status_code, retry.json()), (200, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.top_ups(), 1)
+
+    def test_key_reused_for_a_different_request(self):
+        self.top_up()
+        self.assertEqual(self.top_up(amount='60.00').status_code, 422)
+        self.assertEqual(self.top_ups(), 1)
+
+    def test_retry_while_the_first_request_runs(self):
+        IdempotencyKey.objects.create(user=self.user, key='key-1', fingerprint='in-flight',
+                                      expires_at=timezone.now() + timedelta(days=1))
+        self.assertEqual(self.top_up().status_code, 409)
+        self.assertEqual(self.top_up().status_code, 409)
+        self.assertEqual(self.top_ups(), 0)
+
+    def test_abandoned_claim_is_taken_over(self):
+        record = IdempotencyKey.objects.create(user=self.user, key='key-1', fingerprint='in-flight',
+                                               expires_at=timezone.now() + timedelta(days=1))
+        IdempotencyKey.objects.filter(pk=record.pk).update(created_at=timezone.now() - timedelta(minutes=2))
+        response = self.top_up()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(self.top_ups(), 1)
+        self.assertEqual(self.top_up().json(), response.json())
+
+
+class SyncOrderTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='sync@order.test', is_active=True)
+        self.group = make_group(name='Sync', external_wallet_id='group_wallet_sync')
+        with self.captureOnCommitCallbacks(execute=True):
+            GroupMembership.objects.create(group=self.group, member=self.user.profile, status='active')
+
+    @mock.patch('api_v1.sync.SYNC_SETTLE_SECONDS', 0)
+    def test_long_transaction_is_not_skipped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            # Still open while another transaction commits a change
+            post = Post.objects.create(group=self.group, author=self.user.profile, content='Slow')
+            other = ChangeEvent.objects.create(kind='group', object_id=self.group.pk, group_id=self.group.pk)
+            # A client syncs meanwhile
+            token = changes_since(self.user, other.pk - 1)['token']
+            self.assertEqual(token, str(other.pk))
+
+        payload = changes_since(self.user, int(token))
+        self.assertEqual([row['id'] for row in payload['changes']['posts']], [post.pk])
+
+
+class ChunkedUploadTests(TemporaryMediaMixin, TestCase):
+    VIDEO = bytes(range(256)) * 40
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='uploader@upload.test', is_active=True)
+        group = make_group(name='Uploads', external_wallet_id='group_wallet_uploads')
+        self.post = Post.objects.create(group=group, author=self.user.profile, content='Video')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        response = self.api.post(f'{API}/uploads/', {
+            'filename': 'clip.mp4', 'total_size': len(self.VIDEO), 'content_type': 'video/mp4',
+            'checksum': hashlib.sha256(self.VIDEO).hexdigest(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.session_id = response.json()['id']
+        self.url = f'{API}/uploads/{self.session_id}/'
+
+    def put_chunk(self, start, end):
+        return self.api.put(f'{self.url}chunk/', self.VIDEO[start:end + 1], content_type='application/octet-stream',
+                            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.VIDEO)}')
+
+    def test_resume_and_finalize(self):
+        self.assertEqual(self.put_chunk(0, 4095).json(), {'received_bytes': 4096, 'complete': False})
+        # Resuming: the client asks where to continue from
+        self.assertEqual(self.api.get(self.url).json()['received_bytes'], 4096)
+        # A retried chunk is acknowledged, one past the offset is refused
+        self.assertEqual(self.put_chunk(0, 4095).json()['received_bytes'], 4096)
+        response = self.put_chunk(8192, len(self.VIDEO) - 1)
+        self.assertEqual((response.status_code, response.json()['received_bytes']), (409, 4096))
+        self.assertEqual(self.api.post(f'{self.url}finalize/', {'post': self.post.id}, format='json').status_code, 409)
+
+        self.assertTrue(self.put_chunk(4096, len(self.VIDEO) - 1).json()['complete'])
+        response = self.api.post(f'{self.url}finalize/', {'post': self.post.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        self.post.refresh_from_db()
+        self.assertTrue(self.post.video.name.startswith('cas/'))
+        with self.post.video.open('rb') as video:
+            self.assertEqual(video.read(), self.VIDEO)
+        # The partial file is gone and the session is closed
+        self.assertFalse(os.path.exists(os.path.join(settings.CHUNKED_UPLOAD_DIR, f'{self.session_id}.part')))
+        self.assertEqual(self.api.get(self.url).status_code, 404)
 
-# Create your tests here.
+    def test_corrupt_chunk_is_rolled_back(self):
+        response = self.api.put(f'{self.url}chunk/', self.VIDEO[:4096], content_type='application/octet-stream',
+                                HTTP_CONTENT_RANGE=f'bytes 0-4095/{len(self.VIDEO)}', HTTP_X_CHUNK_SHA256='0' * 64)
+        self.assertEqual((response.status_code, response.json()['received_bytes']), (400, 0))
+        self.assertEqual(self.put_chunk(0, 4095).json()['received_bytes'], 4096)
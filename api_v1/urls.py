@@ -4,7 +4,8 @@ from .views import (
     ProfileViewSet, GroupViewSet, PostViewSet, CommentViewSet, 
     DeceasedViewSet, ContributionViewSet, WalletViewSet, PostImageViewSet,
     TransactionViewSet, UserViewSet, ReplyViewSet, GroupMembershipViewSet,
-    DeviceTokenViewSet, password_reset_request, search_api_view
+    DeviceTokenViewSet, UploadSessionViewSet, password_reset_request, search_api_view,
+    bootstrap_api_view, sync_api_view, contacts_api_view
 )
 from rest_framework.authtoken.views import obtain_auth_token
 
@@ -14,6 +15,7 @@ router.register(r'groups', GroupViewSet)
 router.register(r'memberships', GroupMembershipViewSet)
 router.register(r'posts', PostViewSet)
 router.register(r'post-images', PostImageViewSet)
+router.register(r'uploads', UploadSessionViewSet, basename='uploads')
 router.register(r'comments', CommentViewSet)
 router.register(r'replies', ReplyViewSet)
 router.register(r'deceased', DeceasedViewSet)
@@ -28,5 +30,8 @@ urlpatterns = [
     path('auth-token/', obtain_auth_token, name='auth_token'),
     path('password-reset/', password_reset_request, name='api_password_reset'),
     path('search/', search_api_view, name='api_search'),
+    path('bootstrap/', bootstrap_api_view, name='api_bootstrap'),
+    path('sync/', sync_api_view, name='api_sync'),
+    path('contacts/', contacts_api_view, name='api_contacts'),
 ]
 
@@ -9,26 +9,46 @@ class StandardPagination(PageNumberPagination):
     page_size = 15
     page_size_query_param = 'page_size'
     max_page_size = 50
+from decimal import Decimal
+
+from django.db import IntegrityError
+from django.db.models import Count, Prefetch
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 
-from chema.models import Group, Post, Comment, GroupMembership, PostImage, Reply
+from chema.models import Group, Post, Comment, GroupMembership, PostImage, Reply, UploadSession
 from user.models import Profile
 from condolence.models import Contribution, Deceased
 from wallet.models import Wallet, Transaction
 
+from chema.contacts import get_contacts
 from chema.serializers import (
     GroupSerializer, PostSerializer, CommentSerializer, 
-    GroupMembershipSerializer, PostImageSerializer, ReplySerializer
+    GroupMembershipSerializer, PostImageSerializer, ReplySerializer,
+    UploadSessionSerializer, ContactSerializer
 )
 from user.serializers import ProfileSerializer, UserSerializer, SignupSerializer
-from condolence.serializers import ContributionSerializer, DeceasedSerializer
+from condolence.serializers import (
+    ContributionSerializer, ContributionSummarySerializer, DeceasedSerializer, DeceasedSummarySerializer,
+    LevyRunSerializer
+)
+from condolence.bulk import record_bulk_contributions
+from condolence.totals import group_campaigns
+from condolence.forms import BulkContributionFormSet, formset_data
+from condolence.levy import LevyError, run_levy
+from wallet.ledger import (
+    DuplicateContribution, InsufficientFunds, debit_for_campaign, debit_wallet, disburse_campaign_funds,
+)
 from wallet.serializers import WalletSerializer, TransactionSerializer
 
 from django.contrib.auth import get_user_model
 CustomUser = get_user_model()
 
-from user.notifications import send_push_notification
+from user.notifications import send_push_notification, send_push_notifications
+from .conditional import conditional_etag, group_etag, my_groups_etag, wallet_etag
+from .idempotency import idempotent
+from .sync import changes_since, current_token, record_membership_changes, token_expired
 
 class IsAuthorOrReadOnly(permissions.BasePermission):
     """
@@ -55,7 +75,7 @@ class ProfileViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         # Allow users to only see their own profile or public profiles
         if self.request.user.is_authenticated:
-            return Profile.objects.filter(is_active=True)
+            return Profile.objects.filter(is_active=True).select_related('user')
         return Profile.objects.none()
 
     @action(detail=False, methods=['get'])
@@ -101,15 +121,18 @@ class GroupViewSet(viewsets.ModelViewSet):
         )
 
     def get_queryset(self):
-        queryset = Group.objects.filter(is_active=True)
+        queryset = Group.objects.filter(is_active=True).with_member_context(self.request.user)
         # For Discovery, we might want to exclude groups user is already in
         # But for now, let's just provide a simple way to get 'mine'
         return queryset
 
     @action(detail=False, methods=['get'])
+    @conditional_etag(my_groups_etag)
     def mine(self, request):
         profile = request.user.profile
-        groups = Group.objects.filter(groupmembership__member=profile, groupmembership__status='active')
+        groups = Group.objects.filter(
+            groupmembership__member=profile, groupmembership__status='active'
+        ).with_member_context(request.user)
         serializer = self.get_serializer(groups, many=True)
         return Response(serializer.data)
 
@@ -128,7 +151,10 @@ class GroupViewSet(viewsets.ModelViewSet):
     def leave(self, request, pk=None):
         group = self.get_object()
         profile = request.user.profile
-        GroupMembership.objects.filter(group=group, member=profile).update(is_active=False, status='inactive')
+        memberships = GroupMembership.objects.filter(group=group, member=profile)
+        memberships.update(is_active=False, status='inactive')
+        Group.bump_versions([group.id])
+        record_membership_changes(memberships)
         return Response({'status': 'left'}, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['post'])
@@ -139,8 +165,22 @@ class GroupViewSet(viewsets.ModelViewSet):
         GroupMembership.objects.filter(member=profile, group=group).update(is_active=True)
         # Deactivate others for this user
         GroupMembership.objects.filter(member=profile).exclude(group=group).update(is_active=False)
+        # Member lists only show selected memberships
+        Group.bump_versions(GroupMembership.objects.filter(member=profile).values_list('group_id', flat=True))
+        record_membership_changes(GroupMembership.objects.filter(member=profile))
         return Response({'status': 'selected'})
 
+    @action(detail=True, methods=['post'])
+    def levy_opt_in(self, request, pk=None):
+        """Opt the caller in (or out with opt_in=false) of automatic levy debits for this group."""
+        group = self.get_object()
+        membership = GroupMembership.objects.filter(group=group, member=request.user.profile, status='active').first()
+        if membership is None:
+            return Response({'error': 'You are not an active member of this group'}, status=status.HTTP_403_FORBIDDEN)
+        membership.levy_opt_in = str(request.data.get('opt_in', True)).lower() not in ('false', '0')
+        membership.save(update_fields=['levy_opt_in'])
+        return Response({'levy_opt_in': membership.levy_opt_in})
+
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         group = self.get_object()
@@ -149,9 +189,10 @@ class GroupViewSet(viewsets.ModelViewSet):
         return Response({'status': 'marked_read'})
 
     @action(detail=True, methods=['get'])
+    @conditional_etag(group_etag('groups.members'))
     def members(self, request, pk=None):
         group = self.get_object()
-        memberships = GroupMembership.objects.filter(group=group, is_active=True)
+        memberships = GroupMembership.objects.filter(group=group, is_active=True).select_related('member__user')
         serializer = GroupMembershipSerializer(memberships, many=True, context={'request': request})
         return Response(serializer.data)
 
@@ -160,11 +201,79 @@ class GroupViewSet(viewsets.ModelViewSet):
         group = self.get_object()
         if not group.is_admin(request.user):
             return Response({'error': 'Not authorized'}, status=status.HTTP_403_FORBIDDEN)
-        memberships = GroupMembership.objects.filter(group=group, status='pending')
+        memberships = GroupMembership.objects.filter(group=group, status='pending').select_related('member__user')
         serializer = GroupMembershipSerializer(memberships, many=True, context={'request': request})
         return Response(serializer.data)
 
     @action(detail=True, methods=['get'])
+    def dashboard(self, request, pk=None):
+        """
+        Admin screen in one request: pending requests, member counts by role
+        and status, and active campaigns with their totals. Every figure comes
+        from a grouped SQL aggregate, so the query count does not grow with
+        the group.
+        """
+        group = self.get_object()
+        if not group.is_admin(request.user):
+            return Response({'error': 'Not authorized'}, status=status.HTTP_403_FORBIDDEN)
+
+        pending = list(
+            GroupMembership.objects.filter(group=group, status='pending')
+            .order_by('date_joined')
+            .values('id', 'member_id', 'member__first_name', 'member__surname', 'join_message', 'date_joined')
+        )
+
+        by_status, by_role = {}, {}
+        counts = (
+            GroupMembership.objects.filter(group=group)
+            .order_by().values('status', 'role').annotate(count=Count('id'))
+        )
+        for row in counts:
+            by_status[row['status']] = by_status.get(row['status'], 0) + row['count']
+            if row['status'] == 'active':
+                by_role[row['role']] = by_role.get(row['role'], 0) + row['count']
+
+        campaigns = [d for d in group_campaigns(group) if d.cont_is_active]
+
+        return Response({
+            'group': {'id': group.id, 'name': group.name},
+            'pending_count': len(pending),
+            'pending': [
+                {
+                    'id': row['id'],
+                    'member': row['member_id'],
+                    'first_name': row['member__first_name'],
+                    'surname': row['member__surname'],
+                    'join_message': row['join_message'],
+                    'date_joined': row['date_joined'],
+                }
+                for row in pending
+            ],
+            'members': {
+                'active': by_status.get('active', 0),
+                'by_role': by_role,
+                'by_status': by_status,
+            },
+            'campaigns': [
+                {
+                    'id': d.id,
+                    'deceased': d.deceased_id,
+                    'deceased_name': d.deceased.full_name,
+                    'date': d.date,
+                    'contributions_open': d.contributions_open,
+                    'beneficiary': d.beneficiary_id,
+                    'beneficiary_name': d.beneficiary.full_name if d.beneficiary else None,
+                    'funds_disbursed': d.funds_disbursed,
+                    'total_raised': d.get_total_raised(),
+                    'total_disbursed': d.get_total_disbursed(),
+                    'balance': d.get_balance(),
+                }
+                for d in campaigns
+            ],
+        })
+
+    @action(detail=True, methods=['get'])
+    @conditional_etag(group_etag('groups.transactions'))
     def transactions(self, request, pk=None):
         group = self.get_object()
         # Transparency: Any active member or admin can view history
@@ -181,13 +290,13 @@ class GroupViewSet(viewsets.ModelViewSet):
         transactions = Transaction.objects.filter(
             destination_group=group,
             status='COMPLETED'
-        ).order_by('-timestamp')
+        ).for_listing(request.user).order_by('-timestamp')
         
-        serializer = TransactionSerializer(transactions, many=True)
+        serializer = TransactionSerializer(transactions, many=True, context={'request': request})
         return Response(serializer.data)
 
 class GroupMembershipViewSet(viewsets.ModelViewSet):
-    queryset = GroupMembership.objects.all()
+    queryset = GroupMembership.objects.select_related('member__user')
     serializer_class = GroupMembershipSerializer
 
     @action(detail=True, methods=['post'])
@@ -252,16 +361,16 @@ class GroupMembershipViewSet(viewsets.ModelViewSet):
             )
             
         # Notify admins
-        admins = membership.group.members.filter(groupmembership__is_admin=True, groupmembership__is_active=True)
-        for admin_profile in admins:
-            if admin_profile == request.user.profile: continue # Skip sender
-            send_push_notification(
-                user=admin_profile.user,
-                title=f"Deceased Member Report",
-                message=f"{membership.member.full_name} has been declared deceased in {membership.group.name}.",
-                notification_type="deceased_declared",
-                data={'group_id': membership.group.id, 'deceased_id': membership.member.id}
-            )
+        admins = membership.group.members.filter(
+            groupmembership__is_admin=True, groupmembership__is_active=True
+        ).exclude(pk=request.user.profile.pk) # Skip sender
+        send_push_notifications(
+            users=CustomUser.objects.filter(profile__in=admins),
+            title=f"Deceased Member Report",
+            message=f"{membership.member.full_name} has been declared deceased in {membership.group.name}.",
+            notification_type="deceased_declared",
+            data={'group_id': membership.group.id, 'deceased_id': membership.member.id}
+        )
         
         return Response({'status': 'deceased_declared'}, status=status.HTTP_200_OK)
 
@@ -272,7 +381,7 @@ class PostViewSet(viewsets.ModelViewSet):
     pagination_class = StandardPagination
 
     def get_queryset(self):
-        queryset = Post.objects.filter(approved=True).order_by('-created_at')
+        queryset = Post.objects.filter(approved=True).with_feed_context(self.request.user).order_by('-created_at')
         group_id = self.request.query_params.get('group_id')
         if group_id:
             queryset = queryset.filter(group_id=group_id)
@@ -305,14 +414,13 @@ class PostViewSet(viewsets.ModelViewSet):
             # Notify group members (limited to 20 for performance)
             if post.group:
                 members = post.group.members.filter(groupmembership__is_active=True).exclude(id=profile.id)[:20]
-                for member in members:
-                    send_push_notification(
-                        user=member.user, # Profile -> User
-                        title=f"New Post in {post.group.name}",
-                        message=f"{profile.full_name} posted: {post.content[:40]}{'...' if len(post.content) > 40 else ''}",
-                        notification_type="new_post",
-                        data={'post_id': post.id, 'group_id': post.group.id}
-                    )
+                send_push_notifications(
+                    users=CustomUser.objects.filter(profile__in=members), # Profile -> User
+                    title=f"New Post in {post.group.name}",
+                    message=f"{profile.full_name} posted: {post.content[:40]}{'...' if len(post.content) > 40 else ''}",
+                    notification_type="new_post",
+                    data={'post_id': post.id, 'group_id': post.group.id}
+                )
 
         except Exception as e:
             # Handle potential missing profile or notification errors
@@ -325,13 +433,85 @@ class PostImageViewSet(viewsets.ModelViewSet):
     serializer_class = PostImageSerializer
     permission_classes = [permissions.IsAuthenticated, IsPostImageAuthorOrReadOnly]
 
+class UploadSessionViewSet(viewsets.GenericViewSet):
+    """
+    Resumable chunked upload of post videos.
+    See chema.uploads for the protocol.
+    """
+    serializer_class = UploadSessionSerializer
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner=self.request.user, status='active')
+
+    def _error(self, exc):
+        body = {'error': exc.message}
+        if exc.received_bytes is not None:
+            body['received_bytes'] = exc.received_bytes
+        return Response(body, status=exc.status)
+
+    def create(self, request):
+        from chema.uploads import UploadError, create_session
+        try:
+            total_size = int(request.data.get('total_size', 0))
+        except (TypeError, ValueError):
+            return Response({'error': 'total_size must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        filename = request.data.get('filename')
+        if not filename:
+            return Response({'error': 'filename is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            session = create_session(
+                request.user,
+                filename=filename,
+                total_size=total_size,
+                content_type=request.data.get('content_type', ''),
+                checksum=request.data.get('checksum', ''),
+            )
+        except UploadError as exc:
+            return self._error(exc)
+        return Response(self.get_serializer(session).data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None):
+        # Used by clients to find the offset to resume from
+        return Response(self.get_serializer(self.get_object()).data)
+
+    def destroy(self, request, pk=None):
+        from chema.uploads import abort_session
+        abort_session(self.get_object())
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=['put'])
+    def chunk(self, request, pk=None):
+        from chema.uploads import UploadError, parse_content_range, write_chunk
+        session = self.get_object()
+        try:
+            start, end = parse_content_range(request.headers.get('Content-Range'), session.total_size)
+            # Read the raw body stream directly; request.data is never touched
+            session = write_chunk(session, request.stream, start, end, request.headers.get('X-Chunk-SHA256'))
+        except UploadError as exc:
+            return self._error(exc)
+        return Response({'received_bytes': session.received_bytes, 'complete': session.is_complete})
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        from chema.uploads import UploadError, finalize_session
+        session = self.get_object()
+        post = get_object_or_404(Post, pk=request.data.get('post'), author=request.user.profile)
+        try:
+            finalize_session(session, post)
+        except UploadError as exc:
+            return self._error(exc)
+        return Response(PostSerializer(post, context={'request': request}).data)
+
 class CommentViewSet(viewsets.ModelViewSet):
     queryset = Comment.objects.all().order_by('-created_at')
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticated, IsAuthorOrReadOnly]
 
     def get_queryset(self):
-        queryset = Comment.objects.all().order_by('-created_at')
+        queryset = Comment.objects.select_related('author__user').prefetch_related(
+            Prefetch('replies', queryset=Reply.objects.select_related('author__user'))
+        ).order_by('-created_at')
         post_id = self.request.query_params.get('post_id')
         if post_id:
             queryset = queryset.filter(post_id=post_id)
@@ -345,7 +525,7 @@ class CommentViewSet(viewsets.ModelViewSet):
             serializer.save()
 
 class ReplyViewSet(viewsets.ModelViewSet):
-    queryset = Reply.objects.all().order_by('created_at')
+    queryset = Reply.objects.select_related('author__user').order_by('created_at')
     serializer_class = ReplySerializer
     permission_classes = [permissions.IsAuthenticated, IsAuthorOrReadOnly]
 
@@ -356,11 +536,100 @@ class ReplyViewSet(viewsets.ModelViewSet):
         except Exception:
             serializer.save()
 
+def filter_by_date(queryset, params, field):
+    """Apply optional `date_from` / `date_to` (YYYY-MM-DD) query params to `field`."""
+    date_from = parse_date(params.get('date_from') or '')
+    date_to = parse_date(params.get('date_to') or '')
+    if date_from:
+        queryset = queryset.filter(**{f'{field}__gte': date_from})
+    if date_to:
+        queryset = queryset.filter(**{f'{field}__lte': date_to})
+    return queryset
+
+
 class DeceasedViewSet(viewsets.ModelViewSet):
+    """
+    Campaigns in the caller's groups.
+    Query params: group, status (open, closed, disbursed), date_from, date_to
+    """
     queryset = Deceased.objects.filter(cont_is_active=True)
     serializer_class = DeceasedSerializer
 
+    def get_queryset(self):
+        queryset = (
+            Deceased.objects.filter(cont_is_active=True, group__in=Group.objects.visible_to(self.request.user))
+            .with_totals()
+            .order_by('-date', '-id')
+        )
+        params = self.request.query_params
+        if params.get('group', '').isdigit():
+            queryset = queryset.filter(group_id=params['group'])
+        status_filter = params.get('status')
+        if status_filter == 'open':
+            queryset = queryset.filter(contributions_open=True)
+        elif status_filter == 'closed':
+            queryset = queryset.filter(contributions_open=False)
+        elif status_filter == 'disbursed':
+            queryset = queryset.filter(funds_disbursed=True)
+        queryset = filter_by_date(queryset, params, 'date')
+
+        if self.action == 'list':
+            return queryset.select_related('deceased__user', 'group')
+        return queryset.select_related('deceased__user', 'beneficiary__user', 'group')
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return DeceasedSummarySerializer
+        return DeceasedSerializer
+
+    @action(detail=True, methods=['post'])
+    def levy(self, request, pk=None):
+        """Debit `amount` from every opted-in member's wallet and return the run report."""
+        deceased = self.get_object()
+        if not deceased.group.is_admin(request.user):
+            return Response({'error': 'Only group admins can run a levy'}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            run = run_levy(deceased, request.data.get('amount'), initiated_by=request.user.profile)
+        except LevyError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(LevyRunSerializer(run).data)
+
+    @action(detail=True, methods=['post'])
+    def bulk_contributions(self, request, pk=None):
+        """
+        Record many manual contributions in one transaction.
+        Body: {"contributions": [{"contributing_member": id, "amount": "100.00", "payment_method": "cash"}, ...]}
+        Returns 409 with per-row conflicts (and saves nothing) if any row cannot be recorded.
+        """
+        deceased = self.get_object()
+        if not deceased.group.is_admin(request.user):
+            return Response({'error': 'Only group admins can record contributions'}, status=status.HTTP_403_FORBIDDEN)
+
+        formset = BulkContributionFormSet(data=formset_data(request.data.get('contributions') or []))
+        if not formset.is_valid():
+            errors = [{'row': index, 'errors': form.errors} for index, form in enumerate(formset) if form.errors]
+            return Response({'error': 'Invalid rows', 'rows': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = [form.cleaned_data for form in formset]
+        contributions, conflicts = record_bulk_contributions(deceased, request.user.profile, rows)
+        if conflicts:
+            return Response({
+                'error': 'Some rows could not be recorded',
+                'conflicts': [
+                    {'row': index, 'contributing_member': rows[index]['contributing_member'], 'error': message}
+                    for index, message in sorted(conflicts.items())
+                ],
+            }, status=status.HTTP_409_CONFLICT)
+
+        deceased = Deceased.objects.with_totals().get(pk=deceased.pk)
+        return Response({
+            'created': len(contributions),
+            'total_raised': str(deceased.get_total_raised()),
+            'balance': str(deceased.get_balance()),
+        }, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['post'])
+    @idempotent
     def disburse_funds(self, request, pk=None):
         deceased = self.get_object()
         if not deceased.group.is_admin(request.user):
@@ -369,10 +638,6 @@ class DeceasedViewSet(viewsets.ModelViewSet):
         if not deceased.beneficiary:
             return Response({'error': 'No beneficiary assigned'}, status=status.HTTP_400_BAD_REQUEST)
         
-        balance = deceased.get_balance()
-        if balance <= 0:
-            return Response({'error': 'No funds available for disbursement'}, status=status.HTTP_400_BAD_REQUEST)
-        
         # Perform payout
         from wallet.models import Wallet, Transaction
         from django.db import transaction as db_transaction
@@ -384,16 +649,15 @@ class DeceasedViewSet(viewsets.ModelViewSet):
         )
         
         with db_transaction.atomic():
-            # Create payout transaction for beneficiary
-            transaction = Transaction.objects.create(
-                wallet=beneficiary_wallet,
-                transaction_type='PAYOUT_RECEIVED',
-                amount=balance,
-                status='COMPLETED',
-                destination_group=deceased.group,
-                deceased_contribution=deceased,
-                waas_reference_id=f"PAY_{timezone.now().timestamp()}"
-            )
+            # Create payout transaction for beneficiary (the whole balance, read under a lock)
+            try:
+                transaction = disburse_campaign_funds(
+                    deceased, beneficiary_wallet,
+                    waas_reference_id=f"PAY_{timezone.now().timestamp()}"
+                )
+            except InsufficientFunds:
+                return Response({'error': 'No funds available for disbursement'}, status=status.HTTP_400_BAD_REQUEST)
+            balance = transaction.amount
             
             # We no longer close the fund automatically here
             # deceased.funds_disbursed = True
@@ -422,7 +686,25 @@ class ContributionViewSet(viewsets.ModelViewSet):
     pagination_class = StandardPagination
 
     def get_queryset(self):
-        return Contribution.objects.filter(contributing_member=self.request.user.profile).order_by('-contribution_date')
+        """
+        The caller's own contributions.
+        Query params: group, deceased, date_from, date_to
+        """
+        queryset = Contribution.objects.filter(contributing_member=self.request.user.profile)
+        params = self.request.query_params
+        if params.get('group', '').isdigit():
+            queryset = queryset.filter(group_id=params['group'])
+        if params.get('deceased', '').isdigit():
+            queryset = queryset.filter(deceased_member_id=params['deceased'])
+        queryset = filter_by_date(queryset, params, 'contribution_date')
+        return queryset.select_related(
+            'group', 'deceased_member__deceased__user', 'deceased_member__group'
+        ).order_by('-contribution_date', '-id')
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ContributionSummarySerializer
+        return ContributionSerializer
 
 class WalletViewSet(viewsets.ModelViewSet):
     serializer_class = WalletSerializer
@@ -431,11 +713,13 @@ class WalletViewSet(viewsets.ModelViewSet):
         return Wallet.objects.filter(user=self.request.user)
 
     @action(detail=False, methods=['get'])
+    @conditional_etag(wallet_etag('wallets.balance'))
     def balance(self, request):
         wallet, _ = Wallet.objects.get_or_create(user=request.user, defaults={'external_wallet_id': f"WAAS_{request.user.id}"})
-        return Response({'balance': wallet.get_balance()})
+        return Response({'balance': wallet.get_balance(), 'pending': wallet.get_pending_amount()})
 
     @action(detail=False, methods=['post'])
+    @idempotent
     def top_up(self, request):
         wallet, _ = Wallet.objects.get_or_create(user=request.user, defaults={'external_wallet_id': f"WAAS_{request.user.id}"})
         amount = request.data.get('amount')
@@ -468,6 +752,7 @@ class WalletViewSet(viewsets.ModelViewSet):
         })
 
     @action(detail=False, methods=['post'])
+    @idempotent
     def send_money(self, request):
         from django.db import transaction as db_transaction
         
@@ -497,30 +782,26 @@ class WalletViewSet(viewsets.ModelViewSet):
         except CustomUser.DoesNotExist:
             return Response({'error': 'Recipient not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        # Check balance
-        if sender_wallet.get_balance() < amount_val:
-            return Response({'error': 'Insufficient balance'}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Create both transactions atomically
-        with db_transaction.atomic():
-            # Debit from sender
-            sender_txn = Transaction.objects.create(
-                wallet=sender_wallet,
-                transaction_type='P2P_SENT',
-                amount=amount,
-                status='COMPLETED',
-                recipient_wallet=recipient_wallet,
-                waas_reference_id=f"P2P_{timezone.now().timestamp()}"
-            )
+        # Create both transactions atomically; the debit re-checks the balance under a lock
+        try:
+            with db_transaction.atomic():
+                # Debit from sender
+                sender_txn = debit_wallet(
+                    sender_wallet, amount, 'P2P_SENT',
+                    recipient_wallet=recipient_wallet,
+                    waas_reference_id=f"P2P_{timezone.now().timestamp()}"
+                )
 
-            # Credit to recipient
-            recipient_txn = Transaction.objects.create(
-                wallet=recipient_wallet,
-                transaction_type='P2P_RECEIVED',
-                amount=amount,
-                status='COMPLETED',
-                waas_reference_id=f"P2P_{timezone.now().timestamp()}"
-            )
+                # Credit to recipient
+                recipient_txn = Transaction.objects.create(
+                    wallet=recipient_wallet,
+                    transaction_type='P2P_RECEIVED',
+                    amount=amount,
+                    status='COMPLETED',
+                    waas_reference_id=f"P2P_{timezone.now().timestamp()}"
+                )
+        except InsufficientFunds:
+            return Response({'error': 'Insufficient balance'}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({
             'status': 'success',
@@ -530,6 +811,7 @@ class WalletViewSet(viewsets.ModelViewSet):
         })
 
     @action(detail=False, methods=['post'])
+    @idempotent
     def contribute_to_deceased(self, request):
         from condolence.models import Deceased, Contribution
         from django.db import transaction as db_transaction
@@ -558,31 +840,28 @@ class WalletViewSet(viewsets.ModelViewSet):
         if not deceased.cont_is_active or not deceased.contributions_open:
             return Response({'error': 'Contributions are closed for this member'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Check balance
-        if wallet.get_balance() < amount_val:
-            return Response({'error': 'Insufficient balance'}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Create transaction and contribution atomically
-        with db_transaction.atomic():
-            # Create wallet transaction
-            transaction = Transaction.objects.create(
-                wallet=wallet,
-                transaction_type='TRANSFER',
-                amount=amount,
-                status='COMPLETED',
-                deceased_contribution=deceased,
-                waas_reference_id=f"DEC_{timezone.now().timestamp()}"
-            )
+        # Create transaction and contribution atomically; the debit re-checks the balance under a lock
+        try:
+            with db_transaction.atomic():
+                # Create wallet transaction
+                transaction = debit_for_campaign(
+                    wallet, request.user.profile, deceased, amount,
+                    waas_reference_id=f"DEC_{timezone.now().timestamp()}"
+                )
 
-            # Create contribution record
-            contribution = Contribution.objects.create(
-                group=deceased.group,
-                deceased_member=deceased,
-                contributing_member=request.user.profile,
-                amount=amount,
-                payment_method='wallet',
-                transaction=transaction
-            )
+                # Create contribution record
+                contribution = Contribution.objects.create(
+                    group=deceased.group,
+                    deceased_member=deceased,
+                    contributing_member=request.user.profile,
+                    amount=amount,
+                    payment_method='wallet',
+                    transaction=transaction
+                )
+        except InsufficientFunds:
+            return Response({'error': 'Insufficient balance'}, status=status.HTTP_400_BAD_REQUEST)
+        except (DuplicateContribution, IntegrityError):
+            return Response({'error': 'You have already contributed to this campaign'}, status=status.HTTP_400_BAD_REQUEST)
 
         # Send Notifications
         try:
@@ -623,7 +902,11 @@ class TransactionViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = TransactionSerializer
 
     def get_queryset(self):
-        return Transaction.objects.filter(wallet__user=self.request.user).order_by('-timestamp')
+        return Transaction.objects.filter(wallet__user=self.request.user).for_listing(self.request.user).order_by('-timestamp')
+
+    @conditional_etag(wallet_etag('transactions.list'))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
 
 @api_view(['POST'])
@@ -700,15 +983,114 @@ def search_api_view(request):
     groups = Group.objects.filter(
         Q(name__icontains=query) | 
         Q(description__icontains=query)
-    ).distinct()
+    ).distinct().with_member_context(request.user)
 
     members = Profile.objects.filter(
         Q(user__email__icontains=query) | 
         Q(first_name__icontains=query) | 
         Q(surname__icontains=query)
-    ).distinct()
+    ).distinct().select_related('user')
 
     return Response({
         'groups': GroupSerializer(groups, many=True, context={'request': request}).data,
         'members': ProfileSerializer(members, many=True, context={'request': request}).data
     })
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def contacts_api_view(request):
+    """
+    Everyone sharing an active group with the caller, listed once with the
+    ids of the shared groups. Replaces calling groups/{id}/members/ per group.
+    """
+    contacts = get_contacts(request.user.profile)
+    return Response(ContactSerializer(contacts, many=True, context={'request': request}).data)
+
+
+BOOTSTRAP_TRANSACTIONS = 10
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def bootstrap_api_view(request):
+    """
+    Everything the mobile app needs on launch or group switch in one round trip:
+    the user and profile, active memberships (with unread counts and the
+    selected flag), wallet balance and the latest transactions.
+    Query param: transactions (how many to include, max 50)
+    """
+    user = request.user
+    profile = user.profile
+
+    groups = list(
+        Group.objects.filter(groupmembership__member=profile, groupmembership__status='active')
+        .with_member_context(user)
+        .order_by('name')
+    )
+    groups_by_id = {group.id: group for group in groups}
+    selected = next((group.id for group in groups if group.my_membership_selected), None)
+
+    wallet = Wallet.objects.with_balance().filter(user=user).first()
+    if wallet is None:
+        wallet, _ = Wallet.objects.get_or_create(user=user, defaults={'external_wallet_id': f"WAAS_{user.id}"})
+        wallet.balance = Decimal('0.00')
+
+    try:
+        limit = min(int(request.query_params.get('transactions', BOOTSTRAP_TRANSACTIONS)), 50)
+    except ValueError:
+        limit = BOOTSTRAP_TRANSACTIONS
+    transactions = list(
+        Transaction.objects.filter(wallet=wallet)
+        .select_related('wallet__user__profile', 'recipient_wallet__user__profile')
+        .order_by('-timestamp')[:limit]
+    )
+
+    # Destination groups are serialized from annotated rows, fetched in one go
+    missing = {t.destination_group_id for t in transactions if t.destination_group_id} - set(groups_by_id)
+    if missing:
+        groups_by_id.update(
+            (group.id, group) for group in Group.objects.filter(pk__in=missing).with_member_context(user)
+        )
+    for t in transactions:
+        if t.destination_group_id:
+            t.destination_group = groups_by_id[t.destination_group_id]
+
+    context = {'request': request}
+    return Response({
+        'user': UserSerializer(user, context=context).data,
+        'profile': ProfileSerializer(profile, context=context).data,
+        'groups': GroupSerializer(groups, many=True, context=context).data,
+        'selected_group_id': selected,
+        'wallet': {
+            'id': wallet.id,
+            'external_wallet_id': wallet.external_wallet_id,
+            'balance': wallet.balance,
+        },
+        'transactions': TransactionSerializer(transactions, many=True, context=context).data,
+    })
+
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def sync_api_view(request):
+    """
+    Delta sync: rows created, updated or deleted since the client's token,
+    across its groups, posts, comments, memberships, deceased campaigns and
+    wallet transactions (see api_v1.sync).
+    Query param: since (token from the previous response; omit on first sync)
+    Keep calling with the returned token while `has_more` is true. `reset`
+    means the token is unknown or too old: reload via the list endpoints
+    (or bootstrap/) and continue from the returned token.
+    """
+    try:
+        since = int(request.query_params.get('since', 0))
+    except ValueError:
+        since = -1
+    if since <= 0 or token_expired(since):
+        return Response({'reset': True, 'token': str(current_token())})
+
+    payload = changes_since(request.user, since)
+    payload['reset'] = False
+    return Response(payload)
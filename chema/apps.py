@@ -5,3 +5,6 @@ class ChemaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chema'
 
+    def ready(self):
+        import chema.signals
+
@@ -0,0 +1,26 @@
+"""
+The group catalogue behind the group_list page: every group with its admin
+and member count, shared by all users. Cached (core.cache) under a version
+read from the groups table: their count, latest edit and summed
+Group.version, which chema.signals bumps on membership changes and when a
+member or admin profile is saved. Every process therefore sees every change.
+"""
+from django.db.models import Count, Max, Sum
+
+from core.cache import cached
+
+from .models import Group
+
+
+def catalogue_version():
+    totals = Group.objects.aggregate(count=Count('pk'), versions=Sum('version'), updated=Max('updated_at'))
+    updated = totals['updated'].timestamp() if totals['updated'] else 0
+    return f"{totals['count']}.{totals['versions'] or 0}.{updated}"
+
+
+def build_catalogue():
+    return list(Group.objects.select_related('admin', 'admin__user').annotate(member_count=Count('members')))
+
+
+def group_catalogue():
+    return cached('groups.catalogue', catalogue_version(), build_catalogue)
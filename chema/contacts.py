@@ -0,0 +1,58 @@
+"""
+The caller's contacts: everyone sharing at least one active group with them
+(api_v1 `contacts/`, used by the send-money recipient picker).
+
+Built with one query and cached per user under the versions of the
+caller's groups (core.cache). Membership changes, profile edits and group
+edits all bump Group.version or updated_at (chema.signals), so every
+process reads the new list on its next request, whatever the cache backend.
+"""
+import hashlib
+
+from core.cache import cached, group_version
+from core.tracing import span
+
+from .models import Group, GroupMembership
+
+
+def contacts_version(profile):
+    """Cache key part covering every group `profile` has a membership of."""
+    groups = Group.objects.filter(groupmembership__member=profile).distinct().order_by('pk')
+    versions = ','.join(group_version(group) for group in groups.only('pk', 'version', 'updated_at'))
+    return f'{profile.pk}.{hashlib.md5(versions.encode()).hexdigest()}'
+
+
+def build_contacts(profile):
+    """Return one dict per distinct contact with the ids of the shared groups."""
+    my_groups = GroupMembership.objects.filter(
+        member=profile, status='active', group__is_active=True
+    ).values('group_id')
+    rows = (
+        GroupMembership.objects.filter(group_id__in=my_groups, status='active', member__is_deceased=False)
+        .exclude(member=profile)
+        .order_by('member__first_name', 'member__surname', 'member_id')
+        .values_list('member_id', 'member__user_id', 'member__first_name', 'member__surname',
+                     'member__phone', 'member__profile_picture', 'group_id')
+    )
+    contacts = {}
+    for profile_id, user_id, first_name, surname, phone, picture, group_id in rows:
+        contact = contacts.get(profile_id)
+        if contact is None:
+            contact = contacts[profile_id] = {
+                'profile_id': profile_id,
+                'user_id': user_id,
+                'first_name': first_name,
+                'surname': surname,
+                'phone': phone,
+                'profile_picture': picture,
+                'group_ids': [],
+            }
+        contact['group_ids'].append(group_id)
+    return list(contacts.values())
+
+
+def get_contacts(profile):
+    def build():
+        with span('contacts.build'):
+            return build_contacts(profile)
+    return cached('contacts', contacts_version(profile), build)
@@ -0,0 +1,95 @@
+import os
+import shutil
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chema.models import MediaBlob
+from chema.storage import CAS_PREFIX, acquire_blob, cas_name, hash_file, media_file_fields
+
+
+class Command(BaseCommand):
+    help = 'Moves existing media files into the content-addressed store, merging duplicates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report savings without changing anything')
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        batch_size = options['batch_size']
+        fields = list(media_file_fields())
+
+        migrated = merged = missing = 0
+        saved_bytes = 0
+        seen_digests = set()
+        # Names already accounted for in a dry run (nothing gets rewritten)
+        counted = set()
+
+        for model, field_name in fields:
+            legacy = model.objects.exclude(**{f'{field_name}__startswith': CAS_PREFIX}).exclude(**{field_name: ''})
+            skipped = set()
+            while True:
+                names = list(
+                    legacy.exclude(**{f'{field_name}__in': skipped})
+                    .order_by(field_name)
+                    .values_list(field_name, flat=True)
+                    .distinct()[:batch_size]
+                )
+                if not names:
+                    break
+                for name in names:
+                    if name in counted:
+                        skipped.add(name)
+                        continue
+                    path = default_storage.path(name)
+                    if not os.path.isfile(path):
+                        missing += 1
+                        skipped.add(name)
+                        continue
+
+                    digest, size = hash_file(path)
+                    # Same content already stored (maybe under another extension): reuse its name
+                    target = (
+                        MediaBlob.objects.filter(digest=digest).values_list('name', flat=True).first()
+                        or cas_name(digest, name)
+                    )
+                    target_path = default_storage.path(target)
+                    duplicate = digest in seen_digests or os.path.exists(target_path)
+                    seen_digests.add(digest)
+
+                    if dry_run:
+                        skipped.add(name)
+                        counted.add(name)
+                        migrated += 1
+                        if duplicate:
+                            merged += 1
+                            saved_bytes += size
+                        continue
+
+                    # Link the file into place first so rows never point at a missing file
+                    if not os.path.exists(target_path):
+                        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                        try:
+                            os.link(path, target_path)
+                        except OSError:
+                            shutil.copyfile(path, target_path)
+
+                    with transaction.atomic():
+                        references = 0
+                        for other_model, other_field in fields:
+                            references += other_model.objects.filter(**{other_field: name}).update(**{other_field: target})
+                        acquire_blob(digest, target, size, count=references)
+
+                    os.remove(path)
+                    migrated += 1
+                    if duplicate:
+                        merged += 1
+                        saved_bytes += size
+
+        prefix = '[dry run] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Migrated {migrated} file(s), merged {merged} duplicate(s), '
+            f'freed {saved_bytes / (1024 * 1024):.1f} MB; {missing} referenced file(s) missing on disk'
+        ))
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chema.storage import collect_garbage
+
+
+class Command(BaseCommand):
+    help = 'Deletes content-addressed media files that are no longer referenced'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=settings.MEDIA_GC_GRACE_HOURS)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        deleted, freed = collect_garbage(
+            timedelta(hours=options['grace_hours']),
+            dry_run=options['dry_run'],
+        )
+        prefix = '[dry run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Deleted {deleted} unreferenced file(s), freed {freed / (1024 * 1024):.1f} MB'
+        ))
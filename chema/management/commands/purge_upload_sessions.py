@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from chema.uploads import purge_expired_sessions
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired or finished chunked upload sessions and their partial files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        removed = purge_expired_sessions(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} upload session(s)'))
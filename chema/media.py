@@ -0,0 +1,128 @@
+"""
+Helpers for serving user-uploaded media with HTTP Range, conditional GET
+and group-membership checks (see chema.views.serve_media).
+"""
+import os
+import re
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Value
+from django.utils.http import http_date, parse_http_date_safe
+
+from .models import GroupMembership, Post, PostImage
+from .storage import CAS_STAGING_DIR
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# (model, file field, lookup from the model to its group id)
+GROUP_MEDIA_FIELDS = [
+    (Post, 'image', 'group_id'),
+    (Post, 'video', 'group_id'),
+    (PostImage, 'image', 'post__group_id'),
+]
+
+
+class RangeFile:
+    """
+    Read-limited view over an open file, positioned at the start of a byte
+    range. `fileno` is kept so WSGI servers can still use sendfile(); they
+    honour the Content-Length we set for the range.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        self.file.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range `Range` header.
+    Returns (start, end_inclusive), None to serve the whole file, or
+    False if the range cannot be satisfied.
+    """
+    match = RANGE_RE.match((header or '').strip())
+    if not match or match.groups() == ('', ''):
+        # Missing, malformed or multi-range: serve the full body
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def file_etag(stat):
+    return '"%x-%x"' % (stat.st_size, int(stat.st_mtime_ns))
+
+
+def not_modified(request, etag, mtime):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        tags = [t.strip() for t in if_none_match.split(',')]
+        return '*' in tags or etag in tags or f'W/{etag}' in tags
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since') or '')
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+def range_applies(request, etag, mtime):
+    """An If-Range validator that no longer matches means: send it all."""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return if_range == http_date(mtime)
+
+
+def is_internal_path(path):
+    """Partial chunked uploads and files still being hashed are never served."""
+    full = os.path.realpath(os.path.join(settings.MEDIA_ROOT, path))
+    internal_dirs = (settings.CHUNKED_UPLOAD_DIR, os.path.join(settings.MEDIA_ROOT, CAS_STAGING_DIR))
+    return any(full.startswith(os.path.realpath(directory) + os.sep) for directory in internal_dirs)
+
+
+def media_access(user, name):
+    """
+    (group_private, allowed) for the file `name`, in one query (a UNION of
+    index lookups on the file columns). Files no post references (covers,
+    avatars, ...) are not group-private. A group-private file is allowed
+    to active members of a group whose post references it; `user` is None
+    for anonymous requests.
+    """
+    lookups = []
+    for model, field, group_lookup in GROUP_MEDIA_FIELDS:
+        if user is None:
+            is_member = Value(False)
+        else:
+            is_member = Exists(GroupMembership.objects.filter(
+                group_id=OuterRef(group_lookup), member__user=user, status='active',
+            ))
+        lookups.append(
+            model.objects.filter(**{field: name}).order_by()
+            .annotate(is_member=is_member).values_list('is_member', flat=True)
+        )
+    rows = list(lookups[0].union(*lookups[1:]))
+    return bool(rows), any(rows) or (user is not None and user.is_superuser)
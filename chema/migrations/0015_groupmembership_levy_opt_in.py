@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 05:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chema', '0014_group_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='groupmembership',
+            name='levy_opt_in',
+            field=models.BooleanField(default=False, help_text='Member agrees to be debited automatically when a levy is run'),
+        ),
+    ]
@@ -1,10 +1,85 @@
 import os
 import random
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
 from django.conf import settings
 from django.db import models
+from django.db.models import (
+    BooleanField, Case, Count, DecimalField, Exists, ExpressionWrapper, F, OuterRef, Q,
+    Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Coalesce
 from django.urls import reverse
+from django.utils import timezone
 from user.models import Profile
 
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class GroupQuerySet(models.QuerySet):
+
+    def visible_to(self, user):
+        """Groups `user` is an active member of, or administers (same rules as Group.is_admin)."""
+        if user.is_superuser:
+            return self
+        memberships = GroupMembership.objects.filter(member__user=user, status='active').values('group_id')
+        admin_of = Group.admins.through.objects.filter(customuser_id=user.pk).values('group_id')
+        return self.filter(Q(pk__in=memberships) | Q(pk__in=admin_of) | Q(creator_id=user.pk))
+
+    def with_member_context(self, user):
+        """
+        Annotate everything GroupSerializer needs for `user` (member count,
+        balance, selection, unread posts and admin flag) so a list of groups
+        is serialized without per-group queries.
+        """
+        from wallet.models import Transaction
+
+        profile = user.profile
+        my_membership = GroupMembership.objects.filter(group=OuterRef('pk'), member=profile)
+        member_count = (
+            GroupMembership.objects.filter(group=OuterRef('pk'))
+            .order_by().values('group').annotate(c=Count('pk')).values('c')
+        )
+        balance = (
+            Transaction.objects.filter(destination_group=OuterRef('pk'), status='COMPLETED')
+            .order_by().values('destination_group')
+            .annotate(b=Sum(Case(
+                When(transaction_type='TRANSFER', then=F('amount')),
+                When(transaction_type='PAYOUT_RECEIVED', then=-F('amount')),
+                default=Value(0),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            )))
+            .values('b')
+        )
+        unread = (
+            Post.objects.filter(
+                group=OuterRef('pk'),
+                approved=True,
+                created_at__gt=Coalesce(OuterRef('my_last_viewed_at'), Value(EPOCH)),
+            )
+            .exclude(author=profile)
+            .order_by().values('group').annotate(c=Count('pk')).values('c')
+        )
+        admin_role = GroupMembership.objects.filter(
+            group=OuterRef('pk'), member=profile, role__in=['admin', 'moderator'], is_active=True
+        )
+        in_admins = Group.admins.through.objects.filter(group_id=OuterRef('pk'), customuser_id=user.pk)
+
+        return self.annotate(
+            my_membership_status=Subquery(my_membership.values('status')[:1]),
+            my_membership_selected=Subquery(my_membership.values('is_active')[:1]),
+            my_last_viewed_at=Subquery(my_membership.values('last_viewed_at')[:1]),
+        ).annotate(
+            member_count=Coalesce(Subquery(member_count), 0),
+            ledger_balance=Coalesce(Subquery(balance), Value(0), output_field=DecimalField(max_digits=12, decimal_places=2)),
+            unread_count=Coalesce(Subquery(unread), 0),
+            user_is_admin=ExpressionWrapper(
+                Q(creator_id=user.pk) | Exists(in_admins) | Exists(admin_role),
+                output_field=BooleanField(),
+            ),
+        )
+
+
 class Group(models.Model):
     name = models.CharField(max_length=100)
     is_active = models.BooleanField(default=True)
@@ -28,13 +103,30 @@ class Group(models.Model):
     # Wallet Integration
     external_wallet_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
 
+    # Bumped whenever group-scoped data (members, posts, balance) changes; used for ETags
+    version = models.PositiveBigIntegerField(default=0)
+
+    objects = GroupQuerySet.as_manager()
+
+    @classmethod
+    def bump_versions(cls, group_ids):
+        cls.objects.filter(pk__in=list(group_ids)).update(version=F('version') + 1)
+
     def get_admins(self):
-        return self.members.filter(groupmembership__is_admin=True)
+        """Admin profiles, as a list cached per group version (core.cache)."""
+        from core.cache import cached, group_version
+        return cached('group.admins', group_version(self), lambda: list(
+            self.members.filter(groupmembership__is_admin=True).select_related('user')
+        ))
     
     def get_total_members(self):
+        if hasattr(self, 'member_count'):
+            return self.member_count
         return self.members.count()
 
     def get_balance(self):
+        if hasattr(self, 'ledger_balance'):
+            return self.ledger_balance
         from wallet.models import Transaction
         from django.db.models import Sum
         from decimal import Decimal
@@ -152,6 +244,7 @@ class GroupMembership(models.Model):
     can_comment = models.BooleanField(default=True)
     join_message = models.TextField(blank=True, help_text="Message when requesting to join")
     last_viewed_at = models.DateTimeField(null=True, blank=True)
+    levy_opt_in = models.BooleanField(default=False, help_text="Member agrees to be debited automatically when a levy is run")
     
     def __str__(self):
         return f"{self.member.full_name} in {self.group.name}"
@@ -171,27 +264,56 @@ class GroupMembership(models.Model):
                 self.user == self.group.creator)    
 
 
+class PostQuerySet(models.QuerySet):
+
+    def with_feed_context(self, user):
+        """
+        Load the author and images and annotate comment and like counts and
+        whether `user` liked each post, so a feed page is serialized without
+        per-post queries.
+        """
+        comment_count = (
+            Comment.objects.filter(post=OuterRef('pk'))
+            .order_by().values('post').annotate(c=Count('pk')).values('c')
+        )
+        like_count = (
+            Post.likes.through.objects.filter(post_id=OuterRef('pk'))
+            .order_by().values('post_id').annotate(c=Count('pk')).values('c')
+        )
+        liked = Post.likes.through.objects.filter(post_id=OuterRef('pk'), profile__user_id=user.pk)
+        return self.select_related('author__user').prefetch_related('images').annotate(
+            comment_total=Coalesce(Subquery(comment_count), 0),
+            likes_total=Coalesce(Subquery(like_count), 0),
+            user_has_liked=Exists(liked),
+        )
+
+
 class Post(models.Model):
     author = models.ForeignKey(Profile, on_delete=models.CASCADE, null=True, blank=True)
     group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True, blank=True)
     content = models.TextField(blank=True, null=True)
-    image = models.ImageField(upload_to='post_images/', null=True, blank=True)
-    video = models.FileField(upload_to='post_videos/', null=True, blank=True)
+    # Indexed: serve_media looks posts up by file name (chema.media)
+    image = models.ImageField(upload_to='post_images/', null=True, blank=True, db_index=True)
+    video = models.FileField(upload_to='post_videos/', null=True, blank=True, db_index=True)
     likes = models.ManyToManyField(Profile, related_name='liked_posts', blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     approved = models.BooleanField(default=True, null=True, blank=True)
 
+    objects = PostQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.author.full_name}: {self.content}"
 
     def get_likes_count(self):
+        if hasattr(self, 'likes_total'):
+            return self.likes_total
         return self.likes.count()
 
 
 
 class PostImage(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to='post_images/')
+    image = models.ImageField(upload_to='post_images/', db_index=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
@@ -201,6 +323,65 @@ class PostImage(models.Model):
         ordering = ['uploaded_at']
 
 
+class UploadSession(models.Model):
+    """
+    A resumable, chunked upload of a large post video.
+    Chunks are appended to a partial file on disk and the finished file is
+    moved into storage on finalize.
+    """
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('complete', 'Complete'),
+        ('aborted', 'Aborted'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    total_size = models.PositiveBigIntegerField()
+    received_bytes = models.PositiveBigIntegerField(default=0)
+    checksum = models.CharField(max_length=64, blank=True, help_text="Expected SHA-256 of the whole file")
+    chunk_checksums = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    post = models.ForeignKey(Post, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload_sessions')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.received_bytes}/{self.total_size})"
+
+    def save(self, *args, **kwargs):
+        if not self.expires_at:
+            self.expires_at = timezone.now() + timedelta(hours=settings.CHUNKED_UPLOAD_EXPIRY_HOURS)
+        super().save(*args, **kwargs)
+
+    @property
+    def part_path(self):
+        return os.path.join(settings.CHUNKED_UPLOAD_DIR, f"{self.id}.part")
+
+    @property
+    def is_complete(self):
+        return self.received_bytes >= self.total_size
+
+
+class MediaBlob(models.Model):
+    """
+    One physical file in the content-addressed media store (chema.storage),
+    shared by every field that references the same content.
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    touched_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
+
+
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
     author = models.ForeignKey(Profile, on_delete=models.CASCADE, null=True, blank=True)
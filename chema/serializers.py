@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import Group, GroupMembership, Post, PostImage, Comment, Reply, Dependent
+from django.core.files.storage import default_storage
+from .models import Group, GroupMembership, Post, PostImage, Comment, Reply, Dependent, UploadSession
 from user.serializers import ProfileSerializer
 
 class GroupMembershipSerializer(serializers.ModelSerializer):
@@ -28,7 +29,12 @@ class GroupSerializer(serializers.ModelSerializer):
             'is_selected', 'unread_posts_count', 'membership_status'
         ]
 
+    # Groups loaded with Group.objects.with_member_context(user) carry these
+    # values as annotations, avoiding per-group queries.
+
     def get_is_selected(self, obj):
+        if hasattr(obj, 'my_membership_selected'):
+            return bool(obj.my_membership_selected)
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             try:
@@ -40,11 +46,15 @@ class GroupSerializer(serializers.ModelSerializer):
 
     def get_is_admin(self, obj):
         request = self.context.get('request')
+        if hasattr(obj, 'user_is_admin'):
+            return obj.user_is_admin or bool(request and request.user.is_superuser)
         if request and request.user:
             return obj.is_admin(request.user)
         return False
 
     def get_unread_posts_count(self, obj):
+        if hasattr(obj, 'unread_count'):
+            return obj.unread_count if obj.my_membership_status else 0
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             try:
@@ -66,6 +76,8 @@ class GroupSerializer(serializers.ModelSerializer):
 
     def get_membership_status(self, obj):
         """Returns 'active', 'pending', or null if user is not a member."""
+        if hasattr(obj, 'my_membership_status'):
+            return obj.my_membership_status
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             try:
@@ -76,6 +88,13 @@ class GroupSerializer(serializers.ModelSerializer):
                 pass
         return None
 
+class GroupBriefSerializer(serializers.ModelSerializer):
+    """Name and cover only, for nesting in list rows."""
+    class Meta:
+        model = Group
+        fields = ['id', 'name', 'cover_image']
+        read_only_fields = fields
+
 class PostImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = PostImage
@@ -117,13 +136,20 @@ class PostSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['author']
 
+    # Posts loaded with Post.objects.with_feed_context(user) carry the counts
+    # and the like flag as annotations.
+
     def get_comment_count(self, obj):
+        if hasattr(obj, 'comment_total'):
+            return obj.comment_total
         return Comment.objects.filter(post=obj).count()
 
     def get_likes_count(self, obj):
         return obj.get_likes_count()
 
     def get_has_liked(self, obj):
+        if hasattr(obj, 'user_has_liked'):
+            return obj.user_has_liked
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             try:
@@ -140,3 +166,29 @@ class DependentSerializer(serializers.ModelSerializer):
             'id', 'guardian', 'name', 'date_of_birth', 
             'relationship', 'group'
         ]
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'filename', 'content_type', 'total_size', 'received_bytes',
+            'checksum', 'status', 'post', 'created_at', 'expires_at'
+        ]
+        read_only_fields = ['received_bytes', 'status', 'post', 'created_at', 'expires_at']
+
+class ContactSerializer(serializers.Serializer):
+    """Compact contact rows built by chema.contacts (plain dicts, not model instances)."""
+    profile_id = serializers.IntegerField()
+    user_id = serializers.IntegerField()
+    first_name = serializers.CharField()
+    surname = serializers.CharField()
+    phone = serializers.CharField(allow_null=True)
+    profile_picture = serializers.SerializerMethodField()
+    group_ids = serializers.ListField(child=serializers.IntegerField())
+
+    def get_profile_picture(self, obj):
+        if not obj['profile_picture']:
+            return None
+        url = default_storage.url(obj['profile_picture'])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
@@ -0,0 +1,63 @@
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from user.models import Profile
+from .models import Group, GroupMembership, Post, PostImage
+from .storage import release_instance_files, release_replaced_files, remember_stored_files
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=PostImage)
+@receiver(post_delete, sender=Group)
+def release_media_references(sender, instance, **kwargs):
+    # Shared media files are only removed once nothing references them
+    release_instance_files(instance)
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=PostImage)
+@receiver(pre_save, sender=Group)
+def remember_media_references(sender, instance, update_fields=None, **kwargs):
+    remember_stored_files(instance, update_fields)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=PostImage)
+@receiver(post_save, sender=Group)
+def release_replaced_media(sender, instance, **kwargs):
+    # A replaced file loses the reference the row held
+    release_replaced_files(instance)
+
+
+@receiver(post_save, sender=GroupMembership)
+@receiver(post_delete, sender=GroupMembership)
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def bump_group_version(sender, instance, **kwargs):
+    if instance.group_id:
+        Group.bump_versions([instance.group_id])
+
+
+@receiver(m2m_changed, sender=Group.admins.through)
+def bump_group_version_on_admins_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # instance is a user; pk_set holds group ids (None on clear)
+        group_ids = pk_set if pk_set is not None else instance.admin_groups.values_list('pk', flat=True)
+        Group.bump_versions(group_ids)
+    else:
+        Group.bump_versions([instance.pk])
+
+
+@receiver(post_save, sender=Profile)
+def bump_member_group_versions(sender, instance, created, **kwargs):
+    # Member lists and choices (condolence.forms.DeceasedForm) embed profile
+    # names; the group catalogue (chema.catalogue) shows each group's admin
+    if not created:
+        group_ids = list(
+            Group.objects.filter(Q(groupmembership__member=instance) | Q(admin=instance))
+            .values_list('pk', flat=True).distinct()
+        )
+        Group.bump_versions(group_ids)
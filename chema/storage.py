@@ -0,0 +1,217 @@
+"""
+Content-addressed media storage.
+
+Uploads are hashed (SHA-256) while they are streamed to disk and stored
+once under `cas/<aa>/<bb>/<digest><ext>`, whatever `upload_to` the model
+field asks for. The extension is that of the first upload of the content;
+later uploads of the same bytes reuse that name, whatever they are called. Identical photos posted to several groups therefore share
+one file. Each stored file has a `MediaBlob` row holding its reference
+count; files are only physically removed by `collect_garbage`, which
+recounts references from the database before deleting anything.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.apps import apps
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+CAS_PREFIX = 'cas/'
+# Uploads are written here while they are hashed; never served
+CAS_STAGING_DIR = CAS_PREFIX + 'tmp'
+HASH_BLOCK_SIZE = 64 * 1024
+
+
+def cas_name(digest, original_name):
+    ext = os.path.splitext(original_name)[1].lower()[:10]
+    return f"{CAS_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+def is_cas_name(name):
+    return bool(name) and name.startswith(CAS_PREFIX)
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is derived from the content in _save()
+        return name
+
+    def _save(self, name, content):
+        staging_dir = self.path(CAS_STAGING_DIR)
+        os.makedirs(staging_dir, exist_ok=True)
+
+        if hasattr(content, 'temporary_file_path'):
+            # Already on disk (large uploads, finished chunked uploads):
+            # hash it in place and move it rather than copying.
+            source = content.temporary_file_path()
+            digest, size = hash_file(source)
+            moved = True
+        else:
+            digest_obj = hashlib.sha256()
+            size = 0
+            fd, source = tempfile.mkstemp(dir=staging_dir)
+            with os.fdopen(fd, 'wb') as staged:
+                for chunk in content.chunks(HASH_BLOCK_SIZE):
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest_obj.update(chunk)
+                    staged.write(chunk)
+                    size += len(chunk)
+            digest = digest_obj.hexdigest()
+            moved = False
+
+        # Take the reference before touching the file so a concurrent
+        # garbage collection cannot remove it underneath us.
+        final_name = acquire_blob(digest, cas_name(digest, name), size)
+
+        final_path = self.path(final_name)
+        if os.path.exists(final_path):
+            # Duplicate content: keep the existing copy
+            if not moved:
+                os.remove(source)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            if moved:
+                file_move_safe(source, final_path, allow_overwrite=True)
+            else:
+                os.replace(source, final_path)
+            if self.file_permissions_mode is not None:
+                os.chmod(final_path, self.file_permissions_mode)
+
+        return final_name
+
+    def delete(self, name):
+        if is_cas_name(name):
+            # Shared content: drop one reference, garbage collection removes the file
+            release_blob(name)
+        else:
+            super().delete(name)
+
+
+def acquire_blob(digest, name, size, count=1):
+    """
+    Take `count` references on the blob for `digest`, creating it as `name`
+    if the content is new. Returns the blob's name, which is the existing
+    one when the content was first stored under another extension.
+    """
+    from chema.models import MediaBlob
+
+    now = timezone.now()
+    blobs = MediaBlob.objects.filter(digest=digest)
+    if blobs.update(ref_count=F('ref_count') + count, touched_at=now):
+        return blobs.values_list('name', flat=True).get()
+    try:
+        with transaction.atomic():
+            MediaBlob.objects.create(digest=digest, name=name, size=size, ref_count=count, touched_at=now)
+        return name
+    except IntegrityError:
+        # Created concurrently by another upload of the same content
+        blobs.update(ref_count=F('ref_count') + count, touched_at=now)
+        return blobs.values_list('name', flat=True).get()
+
+
+def release_blob(name):
+    from chema.models import MediaBlob
+
+    MediaBlob.objects.filter(name=name, ref_count__gt=0).update(
+        ref_count=F('ref_count') - 1,
+        touched_at=timezone.now(),
+    )
+
+
+def media_file_fields():
+    """Every (model, field name) whose files live in the default storage."""
+    for model in apps.get_models():
+        for field in model._meta.get_fields():
+            if isinstance(field, models.FileField) and field.storage is default_storage:
+                yield model, field.name
+
+
+def _file_field_names(instance):
+    return [field.name for field in instance._meta.get_fields() if isinstance(field, models.FileField)]
+
+
+def release_instance_files(instance):
+    """post_delete helper: drop the references held by a deleted row."""
+    for field_name in _file_field_names(instance):
+        name = getattr(instance, field_name).name
+        if is_cas_name(name):
+            release_blob(name)
+
+
+def remember_stored_files(instance, update_fields=None):
+    """pre_save helper: note the file names the row holds before the save."""
+    instance._stored_files = {}
+    if instance._state.adding or instance.pk is None:
+        return
+    field_names = [name for name in _file_field_names(instance) if update_fields is None or name in update_fields]
+    if field_names:
+        instance._stored_files = type(instance)._base_manager.filter(pk=instance.pk).values(*field_names).first() or {}
+
+
+def release_replaced_files(instance):
+    """post_save helper: drop the references of files the save replaced."""
+    for field_name, old_name in getattr(instance, '_stored_files', {}).items():
+        if is_cas_name(old_name) and getattr(instance, field_name).name != old_name:
+            release_blob(old_name)
+    instance._stored_files = {}
+
+
+def collect_garbage(grace_period, batch_size=500, dry_run=False):
+    """
+    Recount references from every media field, then delete blobs nobody
+    references. Blobs touched within `grace_period` are kept so uploads
+    whose rows are not committed yet are never removed.
+    Returns (deleted_count, freed_bytes).
+    """
+    from chema.models import MediaBlob
+
+    counts = {}
+    for model, field_name in media_file_fields():
+        names = model.objects.filter(**{f'{field_name}__startswith': CAS_PREFIX}).values_list(field_name, flat=True)
+        for name in names.iterator(chunk_size=batch_size):
+            counts[name] = counts.get(name, 0) + 1
+
+    cutoff = timezone.now() - grace_period
+    deleted = freed = 0
+    for blob in MediaBlob.objects.all().iterator(chunk_size=batch_size):
+        actual = counts.get(blob.name, 0)
+        if actual != blob.ref_count and not dry_run:
+            MediaBlob.objects.filter(pk=blob.pk).update(ref_count=actual)
+        if actual or blob.touched_at > cutoff:
+            continue
+        if dry_run:
+            deleted += 1
+            freed += blob.size
+            continue
+        with transaction.atomic():
+            # Lock the row: acquire_blob() blocks on it, then sees the row gone
+            # and rewrites the file if the same content is uploaded meanwhile.
+            locked = MediaBlob.objects.select_for_update().filter(
+                pk=blob.pk, ref_count=0, touched_at__lte=cutoff
+            ).first()
+            if locked is None:
+                continue
+            try:
+                os.remove(default_storage.path(locked.name))
+            except FileNotFoundError:
+                pass
+            locked.delete()
+        deleted += 1
+        freed += blob.size
+    return deleted, freed
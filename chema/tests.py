@@ -1,3 +1,343 @@
+"""
+Query budgets for the chema HTML/HTMX routes (see core.testing).
+
+Pages are checked at two dataset sizes and must run the same number of
+queries at both. Form posts run once. Also here: freshness of the cached
+contacts list and group catalogue, media access checks, the content-addressed store and
+serve_media's Range and conditional GET handling.
+"""
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.test import TestCase
 
-# Create your tests here.
+from chema.catalogue import group_catalogue
+from chema.contacts import get_contacts
+from chema.media import is_internal_path, media_access
+from chema.models import Comment, Group, GroupMembership, MediaBlob, Post, PostImage
+from chema.storage import collect_garbage
+from core.testing import QueryBudgetTestCase, TemporaryMediaMixin, make_group
+from user.models import CustomUser
+
+HTMX = {'HTTP_HX_REQUEST': 'true'}
+
+
+class PageBudgetTests(QueryBudgetTestCase):
+
+    def get(self, url, max_queries, headers=None, status=200):
+        return self.assert_budget(url, max_queries, client=self.html_client(), headers=headers, status=status)
+
+    def test_home(self):
+        self.get('/', 17)
+
+    def test_home_posts_partial(self):
+        self.get('/', 14, headers={**HTMX, 'HTTP_HX_TARGET': 'posts-list'})
+
+    def test_create_group_form(self):
+        self.get('/create_group/', 10)
+
+    def test_edit_group_form(self):
+        self.get(f'/edit_group/{self.group.id}/', 11)
+
+    def test_create_post_form(self):
+        self.get(f'/createPost/{self.group.id}/', 11)
+
+    def test_edit_post_form(self):
+        post = Post.objects.filter(author=self.profile).first()
+        self.get(f'/edit_post/{post.id}/', 11)
+
+    def test_edit_reply_form(self):
+        self.get(f'/edit_reply/{self.reply.id}/', 11)
+
+    def test_choice(self):
+        self.get('/choice', 10)
+
+    def test_add_dependents_form(self):
+        self.get('/add-dependents/', 11)
+
+    def test_member_detail(self):
+        self.get(f'/member/{self.group.id}/{self.member.member_id}/', 17)
+
+    def test_search(self):
+        self.get('/search/?q=member', 2)
+
+    def test_group_detail(self):
+        self.get(f'/group_detail_view/{self.group.id}/', 16)
+
+    def test_members_table(self):
+        self.get(f'/members-table/{self.group.id}/', 14)
+
+    def test_group_discovery(self):
+        self.get('/group-discovery/', 9)
+
+    def test_group_list(self):
+        self.get('/group-list/', 11)
+
+    def test_my_groups(self):
+        self.get('/my-groups/', 15)
+
+    def test_my_groups_tab(self):
+        self.get(f'/my-groups/?switch_id={self.group.id}', 20, headers=HTMX)
+
+
+class FormBudgetTests(QueryBudgetTestCase):
+
+    def submit(self, url, max_queries, data=None, headers=None, status=None):
+        return self.assert_budget(url, max_queries, method='POST', data=data or {}, client=self.html_client(),
+                                  headers=headers, status=status, scales=False)
+
+    def test_join_existing_group(self):
+        group = make_group(name='Joinable', external_wallet_id='group_wallet_joinable')
+        self.submit('/join-existing-group/', 10, {'group': group.id}, status=302)
+
+    def test_join_active_group(self):
+        self.assert_budget('/join_active_group/', 5, client=self.html_client(), status=302, scales=False)
+
+    def test_create_post(self):
+        self.submit(f'/createPost/{self.group.id}/', 8, {'content': 'Budget post'}, headers=HTMX)
+
+    def test_edit_post(self):
+        post = Post.objects.filter(author=self.profile).first()
+        self.submit(f'/edit_post/{post.id}/', 7, {'content': 'Edited'}, headers=HTMX)
+
+    def test_delete_post(self):
+        post = Post.objects.filter(author=self.profile).first()
+        self.submit(f'/delete_post/{post.id}/', 22, headers=HTMX)
+
+    def test_approve_post(self):
+        self.submit(f'/approve-post/{self.post.id}/', 5, status=302)
+
+    def test_create_comment(self):
+        self.submit(f'/create_comment/{self.post.id}/', 7, {'content': 'Budget comment'}, headers=HTMX)
+
+    def test_edit_comment(self):
+        comment = Comment.objects.create(post=self.post, author=self.profile, content='Mine')
+        self.submit(f'/edit_comment/{comment.id}/', 8, {'content': 'Edited'})
+
+    def test_add_reply(self):
+        self.submit(f'/add_reply/{self.comment.id}/', 5, {'content': 'Budget reply'}, headers=HTMX)
+
+    def test_update_member_attribute(self):
+        self.submit(f'/update_member_attribute/{self.group.id}/{self.member.member_id}/', 11,
+                  {'field': 'role', 'value': 'moderator'}, status=200)
+
+    def test_toggle_group(self):
+        self.submit(f'/toggle_group/{self.other_group.id}/', 21, headers=HTMX, status=200)
+
+    def test_upload_csv_rejects_missing_file(self):
+        self.submit('/upload_csv/', 0, status=400)
+
+
+class ContactsTests(TestCase):
+
+    def setUp(self):
+        self.group = make_group(name='Contacts', external_wallet_id='group_wallet_contacts')
+        self.me = self.member('me@contacts.test')
+        self.other = self.member('other@contacts.test')
+
+    def member(self, email):
+        profile = CustomUser.objects.create_user(email=email).profile
+        GroupMembership.objects.create(group=self.group, member=profile, status='active')
+        return profile
+
+    def contact_ids(self):
+        return [contact['profile_id'] for contact in get_contacts(self.me)]
+
+    def test_removal_without_signals_is_seen(self):
+        self.assertEqual(self.contact_ids(), [self.other.id])
+        # What another process does: no local invalidation, only the version bump
+        GroupMembership.objects.filter(member=self.other).update(status='inactive')
+        Group.bump_versions([self.group.id])
+        self.assertEqual(self.contact_ids(), [])
+
+    def test_profile_rename_is_seen(self):
+        get_contacts(self.me)
+        self.other.first_name = 'Renamed'
+        self.other.save()
+        self.assertEqual(get_contacts(self.me)[0]['first_name'], 'Renamed')
+
+
+class CatalogueTests(TestCase):
+
+    def setUp(self):
+        self.admin = CustomUser.objects.create_user(email='admin@catalogue.test').profile
+        self.group = make_group(name='Catalogue', admin=self.admin, external_wallet_id='group_wallet_catalogue')
+
+    def entry(self):
+        return next(group for group in group_catalogue() if group.pk == self.group.pk)
+
+    def test_changes_are_seen_without_a_local_invalidation(self):
+        self.assertEqual(self.entry().member_count, 0)
+        # What another process does: only the database changes
+        GroupMembership.objects.bulk_create([GroupMembership(group=self.group, member=self.admin, status='active')])
+        Group.bump_versions([self.group.pk])
+        self.assertEqual(self.entry().member_count, 1)
+
+        make_group(name='Newer', external_wallet_id='group_wallet_catalogue_newer')
+        self.assertIn('Newer', [group.name for group in group_catalogue()])
+
+    def test_admin_rename_is_seen(self):
+        self.entry()
+        self.admin.first_name = 'Renamed'
+        self.admin.save()
+        self.assertEqual(self.entry().admin.first_name, 'Renamed')
+
+
+class MediaAccessTests(TestCase):
+
+    def setUp(self):
+        self.group = make_group(name='Media', external_wallet_id='group_wallet_media')
+        self.other = make_group(name='Other media', external_wallet_id='group_wallet_media_other')
+        self.user = CustomUser.objects.create_user(email='viewer@media.test')
+        GroupMembership.objects.create(group=self.group, member=self.user.profile, status='active')
+        post = Post.objects.create(group=self.group, author=self.user.profile, image='cas/aa/bb/photo.jpg')
+        other_post = Post.objects.create(group=self.other, author=self.user.profile, video='cas/cc/dd/clip.mp4')
+        PostImage.objects.create(post=other_post, image='cas/aa/bb/photo.jpg')
+        PostImage.objects.create(post=post, image='cas/ee/ff/gallery.png')
+
+    def test_members_only(self):
+        with self.assertNumQueries(1):
+            # Also referenced by a post in a group the user is not in
+            self.assertEqual(media_access(self.user, 'cas/aa/bb/photo.jpg'), (True, True))
+        self.assertEqual(media_access(self.user, 'cas/ee/ff/gallery.png'), (True, True))
+        self.assertEqual(media_access(self.user, 'cas/cc/dd/clip.mp4'), (True, False))
+        self.assertEqual(media_access(None, 'cas/aa/bb/photo.jpg'), (True, False))
+
+    def test_unreferenced_files_are_public(self):
+        self.assertEqual(media_access(None, 'profile_pictures/me.jpg'), (False, False))
+        self.assertEqual(media_access(self.user, 'group_covers/cover.jpg'), (False, False))
+
+    def test_internal_paths(self):
+        partial = os.path.relpath(settings.CHUNKED_UPLOAD_DIR, settings.MEDIA_ROOT)
+        self.assertTrue(is_internal_path(f'{partial}/upload.part'))
+        self.assertTrue(is_internal_path('cas/tmp/tmpabc123'))
+        self.assertTrue(is_internal_path('cas/aa/../tmp/tmpabc123'))
+        self.assertFalse(is_internal_path('cas/aa/bb/photo.jpg'))
+
+
+class MediaStorageTests(TemporaryMediaMixin, TestCase):
+
+    def setUp(self):
+        self.group = make_group(name='Store', external_wallet_id='group_wallet_store')
+        self.author = CustomUser.objects.create_user(email='author@store.test').profile
+
+    def post_with(self, content, name='photo.jpg'):
+        post = Post(group=self.group, author=self.author, content='Photo')
+        post.image.save(name, ContentFile(content), save=True)
+        return post
+
+    def refs(self, name):
+        return MediaBlob.objects.get(name=name).ref_count
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.post_with(b'same bytes')
+        second = self.post_with(b'same bytes', name='copy.JPG')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(first.image.name.startswith('cas/'))
+        self.assertEqual(self.refs(first.image.name), 2)
+        self.assertEqual(MediaBlob.objects.count(), 1)
+
+    def test_same_content_under_another_extension(self):
+        first = self.post_with(b'renamed bytes')
+        second = self.post_with(b'renamed bytes', name='copy.png')
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(os.listdir(os.path.dirname(default_storage.path(first.image.name))),
+                         [os.path.basename(first.image.name)])
+        first.delete()
+        second.delete()
+        self.assertEqual(self.refs(first.image.name), 0)
+
+    def test_delete_and_replace_release_references(self):
+        first = self.post_with(b'shared')
+        second = self.post_with(b'shared')
+        name = first.image.name
+        first.delete()
+        self.assertEqual(self.refs(name), 1)
+
+        second.image.save('new.jpg', ContentFile(b'replacement'), save=True)
+        self.assertEqual(self.refs(name), 0)
+        self.assertEqual(self.refs(second.image.name), 1)
+
+        # Saves that leave the file alone keep the reference
+        second.content = 'Edited'
+        second.save()
+        self.assertEqual(self.refs(second.image.name), 1)
+
+    def test_garbage_collection(self):
+        kept = self.post_with(b'kept')
+        dropped = self.post_with(b'dropped')
+        dropped_name = dropped.image.name
+        dropped.delete()
+        # A reference count that drifted is recounted, not trusted
+        MediaBlob.objects.filter(name=kept.image.name).update(ref_count=0)
+
+        self.assertEqual(collect_garbage(timedelta(hours=1)), (0, 0))
+        self.assertEqual(collect_garbage(timedelta(0), dry_run=True), (1, len(b'dropped')))
+        self.assertTrue(default_storage.exists(dropped_name))
+
+        self.assertEqual(collect_garbage(timedelta(0)), (1, len(b'dropped')))
+        self.assertFalse(default_storage.exists(dropped_name))
+        self.assertFalse(MediaBlob.objects.filter(name=dropped_name).exists())
+        self.assertTrue(default_storage.exists(kept.image.name))
+        self.assertEqual(self.refs(kept.image.name), 1)
+
+
+class ServeMediaTests(TemporaryMediaMixin, TestCase):
+    CONTENT = b'0123456789' * 10
+
+    def setUp(self):
+        group = make_group(name='Serve', external_wallet_id='group_wallet_serve')
+        self.user = CustomUser.objects.create_user(email='viewer@serve.test', is_active=True)
+        GroupMembership.objects.create(group=group, member=self.user.profile, status='active')
+        post = Post(group=group, author=self.user.profile, content='Clip')
+        post.video.save('clip.mp4', ContentFile(self.CONTENT), save=True)
+        self.url = settings.MEDIA_URL + post.video.name
+        self.client.force_login(self.user)
+
+    def get(self, **headers):
+        return self.client.get(self.url, headers=headers)
+
+    def test_full_body(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_byte_ranges(self):
+        response = self.get(Range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[10:20])
+
+        response = self.get(Range='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[-5:])
+
+        response = self.get(Range='bytes=200-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+    def test_conditional_requests(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(If_None_Match=etag).status_code, 304)
+        self.assertEqual(self.get(If_None_Match='"other"').status_code, 200)
+        # A stale If-Range validator gets the whole file
+        self.assertEqual(self.get(Range='bytes=0-9', If_Range='"other"').status_code, 200)
+        self.assertEqual(self.get(Range='bytes=0-9', If_Range=etag).status_code, 206)
+
+    def test_staging_files_are_not_served(self):
+        staged = os.path.join(settings.MEDIA_ROOT, 'cas', 'tmp', 'tmpupload')
+        with open(staged, 'wb') as f:
+            f.write(b'half hashed')
+        self.assertEqual(self.client.get(settings.MEDIA_URL + 'cas/tmp/tmpupload').status_code, 404)
+
+    def test_only_post_media_needs_a_member(self):
+        self.client.logout()
+        self.assertEqual(self.get().status_code, 401)
+
+        cover = default_storage.save('group_covers/cover.jpg', ContentFile(b'cover'))
+        response = self.client.get(settings.MEDIA_URL + cover)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'cover')
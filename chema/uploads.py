@@ -0,0 +1,205 @@
+"""
+Resumable chunked uploads for large post videos.
+
+Protocol (see api_v1.views.UploadSessionViewSet):
+  1. POST   uploads/                  -> create a session (filename, total_size, optional sha256)
+  2. PUT    uploads/{id}/chunk/       -> raw bytes, `Content-Range: bytes start-end/total`
+                                         and optional `X-Chunk-SHA256` header
+  3. GET    uploads/{id}/             -> resume: returns received_bytes
+  4. POST   uploads/{id}/finalize/    -> attaches the assembled file to a post
+
+Chunks are streamed straight from the request body into a partial file on
+disk, so nothing is buffered by Django's upload handlers.
+"""
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+
+from .models import UploadSession
+
+READ_BLOCK_SIZE = 64 * 1024
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+class UploadError(Exception):
+    """Raised when a chunk or finalize request cannot be accepted."""
+
+    def __init__(self, message, status=400, received_bytes=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.received_bytes = received_bytes
+
+
+class PartialUploadFile(File):
+    """
+    Wraps a finished partial file. Exposing `temporary_file_path` lets
+    FileSystemStorage move the file into place instead of copying it.
+    """
+
+    def __init__(self, path, name):
+        super().__init__(open(path, 'rb'), name=name)
+        self._path = path
+
+    def temporary_file_path(self):
+        return self._path
+
+
+def parse_content_range(header, total_size):
+    """Return (start, end_inclusive) from a Content-Range header."""
+    match = CONTENT_RANGE_RE.match((header or '').strip())
+    if not match:
+        raise UploadError("A valid Content-Range header is required (bytes start-end/total).")
+    start, end = int(match.group(1)), int(match.group(2))
+    total = match.group(3)
+    if end < start:
+        raise UploadError("Invalid Content-Range: end before start.")
+    if total != '*' and int(total) != total_size:
+        raise UploadError("Content-Range total does not match the session size.")
+    if end >= total_size:
+        raise UploadError("Chunk extends past the declared file size.")
+    return start, end
+
+
+def create_session(user, filename, total_size, content_type='', checksum=''):
+    if total_size <= 0:
+        raise UploadError("total_size must be positive.")
+    if total_size > settings.CHUNKED_UPLOAD_MAX_SIZE:
+        raise UploadError("File is too large.", status=413)
+    if content_type and not content_type.startswith('video/'):
+        raise UploadError("Only video uploads are supported.")
+
+    session = UploadSession.objects.create(
+        owner=user,
+        filename=os.path.basename(filename)[:255] or 'video',
+        content_type=content_type or '',
+        total_size=total_size,
+        checksum=(checksum or '').lower(),
+    )
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    # Pre-create the partial file so chunks can always be opened for update
+    open(session.part_path, 'wb').close()
+    return session
+
+
+def write_chunk(session, stream, start, end, chunk_checksum=None):
+    """
+    Stream one chunk from `stream` into the partial file at `start`.
+    Chunks must arrive in order; a retried chunk that was already stored is
+    acknowledged without being written again.
+    """
+    length = end - start + 1
+
+    if session.status != 'active':
+        raise UploadError("Upload session is no longer active.", status=409)
+    if session.expires_at <= timezone.now():
+        raise UploadError("Upload session has expired.", status=410)
+    if length > settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+        raise UploadError("Chunk is too large.", status=413)
+    if end < session.received_bytes:
+        # Duplicate of a chunk we already have (client retry)
+        return session
+    if start != session.received_bytes:
+        raise UploadError("Unexpected chunk offset.", status=409, received_bytes=session.received_bytes)
+
+    digest = hashlib.sha256()
+    written = 0
+    with open(session.part_path, 'r+b') as part:
+        part.seek(start)
+        while written < length:
+            block = stream.read(min(READ_BLOCK_SIZE, length - written))
+            if not block:
+                break
+            digest.update(block)
+            part.write(block)
+            written += len(block)
+
+        if written != length or (chunk_checksum and digest.hexdigest() != chunk_checksum.lower()):
+            # Roll the partial file back so the client can resend this chunk
+            part.truncate(start)
+            if written != length:
+                raise UploadError("Chunk body is shorter than its Content-Range.", received_bytes=start)
+            raise UploadError("Chunk checksum mismatch.", received_bytes=start)
+
+    # Conditional update guards against two requests racing for the same offset
+    updated = UploadSession.objects.filter(pk=session.pk, received_bytes=start, status='active').update(
+        received_bytes=start + length,
+        chunk_checksums=session.chunk_checksums + [[start, digest.hexdigest()]],
+        updated_at=timezone.now(),
+    )
+    session.refresh_from_db()
+    if not updated:
+        raise UploadError("Chunk was superseded by a concurrent request.", status=409, received_bytes=session.received_bytes)
+    return session
+
+
+def verify_checksum(path, expected):
+    """Hash the file block by block (never loading it into memory)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest() == expected
+
+
+def finalize_session(session, post):
+    """Move the assembled file into storage as `post.video`."""
+    if session.status != 'active':
+        raise UploadError("Upload session is no longer active.", status=409)
+    if not session.is_complete:
+        raise UploadError("Upload is incomplete.", status=409, received_bytes=session.received_bytes)
+    if session.checksum and not verify_checksum(session.part_path, session.checksum):
+        raise UploadError("File checksum mismatch.", status=422)
+
+    upload = PartialUploadFile(session.part_path, session.filename)
+    try:
+        post.video.save(session.filename, upload, save=True)
+    finally:
+        upload.close()
+
+    session.status = 'complete'
+    session.post = post
+    session.save(update_fields=['status', 'post', 'updated_at'])
+    discard_partial_file(session)
+    return post
+
+
+def abort_session(session):
+    session.status = 'aborted'
+    session.save(update_fields=['status', 'updated_at'])
+    discard_partial_file(session)
+
+
+def discard_partial_file(session):
+    try:
+        os.remove(session.part_path)
+    except FileNotFoundError:
+        pass
+
+
+def purge_expired_sessions(batch_size=500, now=None):
+    """
+    Delete expired, aborted and completed sessions together with any
+    leftover partial files. Returns the number of sessions removed.
+    """
+    from django.db.models import Q
+
+    now = now or timezone.now()
+    stale = UploadSession.objects.filter(Q(expires_at__lte=now) | ~Q(status='active'))
+    removed = 0
+    while True:
+        batch = list(stale.values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            break
+        for pk in batch:
+            try:
+                os.remove(os.path.join(settings.CHUNKED_UPLOAD_DIR, f"{pk}.part"))
+            except FileNotFoundError:
+                pass
+        removed += UploadSession.objects.filter(pk__in=batch).delete()[0]
+    return removed
@@ -3,7 +3,7 @@ from django.http import HttpResponse, JsonResponse,HttpResponseRedirect, Http404
 from django.contrib.auth.decorators import login_required
 from .models import *
 from django.urls import reverse 
-from django.db.models import Sum
+from django.db.models import Prefetch, Sum
 from django.forms import inlineformset_factory 
 from django.contrib import messages
 from condolence.models import Contribution,Deceased
@@ -11,6 +11,27 @@ from user.models import Profile
 from .forms import *
 from condolence.forms import DeceasedForm
 from django.core.exceptions import PermissionDenied
+from django.views.decorators.http import require_http_methods
+from api_v1.sync import record_membership_changes
+from .catalogue import group_catalogue
+
+
+def group_feed(group):
+    """
+    Posts of `group`, newest first, with everything posts_list.html renders
+    for them prefetched: authors, images, comments and each comment's three
+    latest replies (as `latest_replies`).
+    """
+    latest_replies = Reply.objects.select_related('author__user').order_by('-created_at')[:3]
+    comments = Comment.objects.select_related('author__user').prefetch_related(
+        Prefetch('replies', queryset=latest_replies, to_attr='latest_replies')
+    )
+    return (
+        Post.objects.filter(group=group)
+        .select_related('author__user')
+        .prefetch_related('images', Prefetch('comment_set', queryset=comments))
+        .order_by('-created_at')
+    )
 
 
 @login_required
@@ -49,7 +70,7 @@ def home(request):
 
 
     # Fetch only the posts of the active group
-    active_group_posts = Post.objects.filter(group=active_group).order_by('-created_at')
+    active_group_posts = group_feed(active_group)
 
     # Fetch comments for the posts in the active group
     active_group_comments = Comment.objects.filter(post__in=active_group_posts).order_by('-created_at')
@@ -60,12 +81,9 @@ def home(request):
         'minimized': not (active_group_posts.exists() or active_group_comments.exists()),
         'posts': active_group_posts[:5],  # Limit the number of posts to display initially
         'comments': active_group_comments,  # Comments for active group's posts
-        'admins_as_members': active_group.get_admins(),  # Use the new method to get admins
+        'admins_as_members': active_group.get_admins,  # Use the new method to get admins
     }
 
-    for comment in group_data['comments']:
-        comment.replies.set(Reply.objects.filter(comment=comment).order_by('-created_at')[:3])
-
     deceased_form = DeceasedForm(active_group=active_group)
 
     context = {
@@ -75,7 +93,7 @@ def home(request):
         'active_group_posts': active_group_posts,
         'active_group_comments': active_group_comments,
         'contributions': contributions,
-        'admins_as_members': active_group.get_admins(),
+        'admins_as_members': active_group.get_admins,
         'deceased': deceased,
         'deceased_form': deceased_form,
     }
@@ -543,7 +561,9 @@ def group_detail_view(request, group_id):
          messages.error(request, "You must be a member to view this group.")
          return redirect('home')
 
-    deceased = Deceased.objects.filter(group=group).annotate(
+    deceased = Deceased.objects.filter(group=group).select_related(
+        'deceased__user', 'group_admin__user'
+    ).annotate(
         total_raised=Sum('member_deceased__amount')
     ).order_by('-date')
     
@@ -694,7 +714,10 @@ def my_groups(request):
     if switch_id:
         request.session['active_group_id'] = int(switch_id)
         # Ensure membership is marked as active if it wasn't
-        GroupMembership.objects.filter(member=user, group_id=switch_id).update(is_active=True)
+        switched = GroupMembership.objects.filter(member=user, group_id=switch_id)
+        switched.update(is_active=True)
+        Group.bump_versions([switch_id])
+        record_membership_changes(switched)
 
     groups = user.groups.all()
     # Find active group from session or fallback to first active membership
@@ -715,7 +738,7 @@ def my_groups(request):
             request.session['active_group_id'] = active_membership.group.id
             
     active_group = active_membership.group if active_membership else None
-    admins_as_members = active_group.get_admins() if active_group else []
+    admins_as_members = active_group.get_admins if active_group else []
     
     context = {
         'groups': groups,
@@ -732,11 +755,10 @@ def my_groups(request):
 @login_required
 def group_list(request):
     """List all groups for users to browse and join."""
-    groups = Group.objects.all().annotate(member_count=Count('members'))
-    groups = Group.objects.select_related(
-        'admin', 
-        'admin__user'
-    ).annotate(member_count=Count('members'))
+    groups = group_catalogue()
+    joined = set(GroupMembership.objects.filter(member=request.user.profile).values_list('group_id', flat=True))
+    for group in groups:
+        group.is_joined = group.pk in joined
     return render(request, 'chema/group_list.html', {'groups': groups})
 
 @login_required
@@ -756,7 +778,7 @@ def toggle_group(request, group_id):
     if request.headers.get('HX-Request'):
         # Fetch the updated data for the new active group
         active_group = membership.group
-        active_group_posts = Post.objects.filter(group=active_group).order_by('-created_at')
+        active_group_posts = group_feed(active_group)
         active_group_comments = Comment.objects.filter(post__in=active_group_posts).order_by('-created_at')
         
         group_data = {
@@ -764,19 +786,16 @@ def toggle_group(request, group_id):
             'minimized': not (active_group_posts.exists() or active_group_comments.exists()),
             'posts': active_group_posts[:5],
             'comments': active_group_comments,
-            'admins_as_members': active_group.get_admins(),
+            'admins_as_members': active_group.get_admins,
         }
         
-        for comment in group_data['comments']:
-            comment.replies.set(Reply.objects.filter(comment=comment).order_by('-created_at')[:3])
-        
         context = {
             'group_data': group_data,
             'active_group': active_group,
             'active_group_posts': active_group_posts,
             'active_group_comments': active_group_comments,
             'contributions': Contribution.objects.filter(deceased_member_id__contributions_open=True, group=active_group),
-            'admins_as_members': active_group.get_admins(),
+            'admins_as_members': active_group.get_admins,
             'deceased': Deceased.objects.filter(group=active_group),
         }
         
@@ -858,14 +877,96 @@ def group_members_table(request, group_id):
     return render(request, 'chema/group_members_table.html', context)
 
 
+def _media_user(request):
+    """Session user, or the user behind a DRF `Authorization: Token` header (mobile)."""
+    if request.user.is_authenticated:
+        return request.user
+    from rest_framework.authentication import TokenAuthentication
+    from rest_framework.exceptions import AuthenticationFailed
+    try:
+        result = TokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+@require_http_methods(['GET', 'HEAD'])
+def serve_media(request, path):
+    """
+    Serve uploaded media with byte-range support so mobile players can
+    start playback immediately and seek without downloading the whole file.
+    Post media is only visible to active members of the post's group; other
+    files (group covers, profile pictures) are public.
+    """
+    import mimetypes
+    import os
+    from django.conf import settings
+    from django.core.exceptions import SuspiciousFileOperation
+    from django.http import FileResponse, HttpResponseNotModified
+    from django.utils._os import safe_join
+    from django.utils.http import http_date
+    from .media import (
+        RangeFile, file_etag, is_internal_path, media_access,
+        not_modified, parse_range, range_applies,
+    )
 
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if is_internal_path(path):
+        raise Http404
+    user = _media_user(request)
+    group_private, allowed = media_access(user, path)
+    if group_private and user is None:
+        return HttpResponse("Authentication required", status=401)
+    if group_private and not allowed:
+        return HttpResponse("Unauthorized", status=403)
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    stat = os.stat(full_path)
+    etag = file_etag(stat)
+    last_modified = http_date(stat.st_mtime)
+    cache_headers = {
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        'Cache-Control': f'private, max-age={settings.MEDIA_CACHE_MAX_AGE}',
+        'Accept-Ranges': 'bytes',
+    }
 
+    if not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+        for header, value in cache_headers.items():
+            response[header] = value
+        return response
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    size = stat.st_size
+    byte_range = None
+    if range_applies(request, etag, stat.st_mtime):
+        byte_range = parse_range(request.headers.get('Range'), size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    accel_prefix = settings.MEDIA_ACCEL_REDIRECT_PREFIX
+    if accel_prefix:
+        # Let the front-end server stream the file (and handle Range itself)
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + path.lstrip('/')
+    elif byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        response = FileResponse(RangeFile(open(full_path, 'rb'), start, length), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = length
+    else:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    response.block_size = 64 * 1024
 
-    
-
+    for header, value in cache_headers.items():
+        response[header] = value
+    return response
 
-       
-   
-    
-    
-    
\ No newline at end of file
@@ -3,3 +3,4 @@ from . models import *
 
 admin.site.register(Contribution)
 admin.site.register(Deceased)
+admin.site.register(LevyRun)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CondolenceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'condolence'
+
+    def ready(self):
+        import condolence.signals
@@ -0,0 +1,74 @@
+"""
+Batch entry of manual (cash, bank, ...) contributions by a group admin.
+
+All rows are validated together and saved with one bulk insert in a single
+transaction: either every row is recorded or none is, and conflicts with
+the one-contribution-per-member rule are reported per row.
+"""
+from django.db import IntegrityError, transaction as db_transaction
+
+from chema.models import Group, GroupMembership
+
+from .models import Contribution
+
+
+def find_conflicts(deceased, rows):
+    """
+    Return {row index: message} for rows that cannot be saved. `rows` are
+    dicts with contributing_member (profile id), amount and payment_method.
+    """
+    member_ids = [row['contributing_member'] for row in rows]
+    in_group = set(
+        GroupMembership.objects.filter(group_id=deceased.group_id, member_id__in=member_ids)
+        .values_list('member_id', flat=True)
+    )
+    already_paid = set(
+        Contribution.objects.filter(deceased_member=deceased, contributing_member_id__in=member_ids)
+        .values_list('contributing_member_id', flat=True)
+    )
+
+    conflicts, seen = {}, set()
+    for index, member_id in enumerate(member_ids):
+        if member_id not in in_group:
+            conflicts[index] = "Not a member of this group."
+        elif member_id == deceased.deceased_id:
+            conflicts[index] = "Cannot contribute to their own campaign."
+        elif member_id in already_paid:
+            conflicts[index] = "Already has a contribution for this campaign."
+        elif member_id in seen:
+            conflicts[index] = "Entered more than once in this batch."
+        seen.add(member_id)
+    return conflicts
+
+
+def record_bulk_contributions(deceased, admin_profile, rows):
+    """
+    Save `rows` for `deceased`. Returns (contributions, conflicts); nothing
+    is saved when conflicts is non-empty.
+    """
+    if not deceased.cont_is_active or not deceased.contributions_open:
+        return [], {index: "Contributions are closed for this member." for index in range(len(rows))}
+
+    conflicts = find_conflicts(deceased, rows)
+    if conflicts:
+        return [], conflicts
+
+    try:
+        with db_transaction.atomic():
+            contributions = Contribution.objects.bulk_create([
+                Contribution(
+                    group_id=deceased.group_id,
+                    deceased_member=deceased,
+                    contributing_member_id=row['contributing_member'],
+                    group_admin=admin_profile,
+                    amount=row['amount'],
+                    payment_method=row.get('payment_method') or 'cash',
+                )
+                for row in rows
+            ])
+    except IntegrityError:
+        # Another entry for one of these members landed meanwhile
+        return [], find_conflicts(deceased, rows) or {index: "Could not be saved, please retry." for index in range(len(rows))}
+    # bulk_create sends no post_save (see condolence.signals)
+    Group.bump_versions([deceased.group_id])
+    return contributions, {}
@@ -1,4 +1,9 @@
+from decimal import Decimal
+from functools import partial
+
 from django import forms
+
+from core.cache import cached, group_version
 from .models import *
 from chema.models import *
 
@@ -39,7 +44,7 @@ class ContributionForm(forms.ModelForm):
             self.fields['deceased_member'].queryset = Deceased.objects.filter(
                 group=active_group, 
                 cont_is_active=True
-            )
+            ).select_related('deceased')
             # Filter contributing members to active group members only
             self.fields['contributing_member'].queryset = active_group.members.all()
         else:
@@ -90,9 +95,19 @@ class DeceasedForm(forms.ModelForm):
                 groupmembership__is_deceased=False,
                 profile_deceased__isnull=True
             ).distinct()
+            if not self.is_bound:
+                # Every page's modal renders this form (chema.context_processors);
+                # choices are looked up only if it does
+                self.fields['deceased'].choices = partial(
+                    cached, 'group.deceased_choices', group_version(active_group), self._deceased_choices
+                )
         else:
             self.fields['deceased'].queryset = Profile.objects.none()
 
+    def _deceased_choices(self):
+        field = self.fields['deceased']
+        return [(getattr(value, 'value', value), label) for value, label in field.iterator(field)]
+
 
 class BeneficiaryForm(forms.ModelForm):
     class Meta:
@@ -114,4 +129,47 @@ class BeneficiaryForm(forms.ModelForm):
             self.fields['beneficiary'].queryset = Profile.objects.none()
         
         self.fields['beneficiary'].label = "Select Beneficiary"
-        self.fields['beneficiary'].empty_label = "Select a beneficiary..."
\ No newline at end of file
+        self.fields['beneficiary'].empty_label = "Select a beneficiary..."
+
+class BulkContributionRowForm(forms.Form):
+    """One row of the treasurer's batch entry grid (see condolence.bulk)."""
+    contributing_member = forms.IntegerField(widget=forms.HiddenInput())
+    include = forms.BooleanField(required=False, widget=forms.CheckboxInput(attrs={
+        'class': 'checkbox checkbox-sm checkbox-primary'
+    }))
+    amount = forms.DecimalField(required=False, min_value=Decimal('0.01'), max_digits=10, decimal_places=2,
+                                widget=forms.NumberInput(attrs={
+                                    'class': 'input input-bordered input-sm w-24 bg-white',
+                                    'step': '0.01',
+                                }))
+    payment_method = forms.ChoiceField(
+        choices=[c for c in Contribution._meta.get_field('payment_method').choices if c[0] != 'wallet'],
+        initial='cash',
+        widget=forms.Select(attrs={'class': 'select select-bordered select-sm bg-white'}),
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('include') and not cleaned_data.get('amount'):
+            self.add_error('amount', "Enter the amount paid.")
+        return cleaned_data
+
+
+BulkContributionFormSet = forms.formset_factory(BulkContributionRowForm, extra=0)
+
+
+def formset_data(rows, prefix='form'):
+    """Turn a JSON list of row dicts into BulkContributionFormSet data (every row included)."""
+    data = {
+        f'{prefix}-TOTAL_FORMS': str(len(rows)),
+        f'{prefix}-INITIAL_FORMS': '0',
+    }
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            row = {}
+        row = {'payment_method': 'cash', **row}
+        for field in ('contributing_member', 'amount', 'payment_method'):
+            if row.get(field) is not None:
+                data[f'{prefix}-{index}-{field}'] = str(row[field])
+        data[f'{prefix}-{index}-include'] = 'on'
+    return data
@@ -0,0 +1,166 @@
+"""
+Batch levy collection: debit a fixed amount from every opted-in member of a
+campaign's group in one run (DeceasedViewSet.levy, `manage.py run_levy`).
+
+Members are processed in chunks; each chunk locks its wallets the way
+wallet.ledger does, reads their available balances (completed less pending
+outgoing) in one aggregate query and writes Transaction, Contribution and
+Notification rows with bulk inserts inside a single atomic block. Members
+whose balance is too low are skipped and listed in the LevyRun report.
+"""
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from api_v1.sync import record_transaction_changes
+from chema.models import Group, GroupMembership
+from core.metrics import record_transaction_writes
+from user.models import Notification
+from wallet.ledger import available_balances, lock_wallet
+from wallet.models import Transaction
+
+from .models import Contribution, LevyRun
+
+LEVY_CHUNK_SIZE = 500
+CENT = Decimal('0.01')
+# Contribution.amount is DecimalField(max_digits=10, decimal_places=2)
+LEVY_MAX_AMOUNT = Decimal('99999999.99')
+
+
+class LevyError(Exception):
+    """Raised when a levy cannot be started for a campaign."""
+
+
+def levy_candidates(deceased):
+    """(profile id, user id, wallet id) of members to debit, excluding those who already paid."""
+    already_paid = Contribution.objects.filter(deceased_member=deceased, contributing_member=OuterRef('member_id'))
+    return (
+        GroupMembership.objects.filter(
+            group_id=deceased.group_id, status='active', levy_opt_in=True, is_deceased=False,
+            member__user__wallet__isnull=False,
+        )
+        .exclude(member_id=deceased.deceased_id)
+        .exclude(Exists(already_paid))
+        .order_by('member_id')
+        .values_list('member_id', 'member__user_id', 'member__user__wallet__id')
+        .distinct()
+    )
+
+
+def clean_amount(amount):
+    """`amount` as a Decimal quantized to cents; raises LevyError unless it is a positive, finite sum."""
+    try:
+        amount = Decimal(str(amount))
+        if not amount.is_finite():
+            raise LevyError("Levy amount must be a number.")
+        amount = amount.quantize(CENT)
+    except ArithmeticError:
+        raise LevyError("Invalid amount format.")
+    if amount <= 0:
+        raise LevyError("Levy amount must be positive.")
+    if amount > LEVY_MAX_AMOUNT:
+        raise LevyError("Levy amount is too large.")
+    return amount
+
+
+def run_levy(deceased, amount, initiated_by=None, chunk_size=LEVY_CHUNK_SIZE):
+    """Collect `amount` from every candidate of `deceased`. Returns the finished LevyRun."""
+    amount = clean_amount(amount)
+    if not deceased.cont_is_active or not deceased.contributions_open:
+        raise LevyError("Contributions are closed for this member.")
+
+    run = LevyRun.objects.create(deceased=deceased, amount=amount, initiated_by=initiated_by)
+    candidates = list(levy_candidates(deceased))
+    run.already_paid_count = (
+        GroupMembership.objects.filter(group_id=deceased.group_id, status='active', levy_opt_in=True)
+        .filter(member__deceased_contributions__deceased_member=deceased)
+        .count()
+    )
+    try:
+        for start in range(0, len(candidates), chunk_size):
+            _collect_chunk(run, deceased, amount, candidates[start:start + chunk_size])
+    except Exception as exc:
+        run.status = 'failed'
+        run.error = str(exc)
+    else:
+        run.status = 'completed'
+    run.finished_at = timezone.now()
+    run.save()
+    return run
+
+
+def _collect_chunk(run, deceased, amount, chunk):
+    wallet_ids = [wallet_id for _, _, wallet_id in chunk]
+    with db_transaction.atomic():
+        # The same row locks as debit_wallet, taken in a stable order so
+        # concurrent debits cannot deadlock with us
+        for wallet_id in sorted(wallet_ids):
+            lock_wallet(wallet_id)
+        # Pending outgoing transfers count against the balance, as in debit_wallet
+        balances = available_balances(wallet_ids)
+        # Re-checked under the lock: a member may have paid since the run started
+        paid = set(
+            Contribution.objects.filter(
+                deceased_member=deceased, contributing_member_id__in=[profile_id for profile_id, _, _ in chunk]
+            ).values_list('contributing_member_id', flat=True)
+        )
+
+        debit, insufficient = [], []
+        for profile_id, user_id, wallet_id in chunk:
+            if profile_id in paid:
+                run.already_paid_count += 1
+            elif balances.get(wallet_id, 0) < amount:
+                insufficient.append(profile_id)
+            else:
+                debit.append((profile_id, user_id, wallet_id))
+
+        reference = f"LEVY_{run.id}"
+        transactions = Transaction.objects.bulk_create([
+            Transaction(
+                wallet_id=wallet_id,
+                transaction_type=Transaction.TransactionType.TRANSFER,
+                amount=amount,
+                status=Transaction.TransactionStatus.COMPLETED,
+                destination_group_id=deceased.group_id,
+                deceased_contribution=deceased,
+                waas_reference_id=f"{reference}_{wallet_id}",
+            )
+            for _, _, wallet_id in debit
+        ])
+        Contribution.objects.bulk_create([
+            Contribution(
+                group_id=deceased.group_id,
+                deceased_member=deceased,
+                contributing_member_id=profile_id,
+                group_admin=run.initiated_by,
+                amount=amount,
+                payment_method='wallet',
+                transaction=txn,
+            )
+            for (profile_id, _, _), txn in zip(debit, transactions)
+        ])
+        # In-app notices only; pushing to thousands of devices is left to the notification pipeline
+        Notification.objects.bulk_create([
+            Notification(
+                recipient_id=user_id,
+                title="Levy Collected",
+                message=f"{amount} was collected from your wallet for {deceased.deceased.full_name}'s fund.",
+                notification_type="levy_collected",
+                data={'deceased_id': deceased.id, 'levy_run_id': run.id},
+            )
+            for _, user_id, _ in debit
+        ])
+
+        # bulk_create skips the ledger signals; lock_wallet already bumped the
+        # wallets' versions, and the group's moves with this chunk
+        Group.bump_versions([deceased.group_id])
+        record_transaction_changes(transactions)
+        record_transaction_writes(transactions)
+
+        run.collected_count += len(debit)
+        run.collected_total += amount * len(debit)
+        run.insufficient_count += len(insufficient)
+        run.insufficient_members += insufficient
+        run.save()
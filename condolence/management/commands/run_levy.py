@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from condolence.levy import LevyError, run_levy
+from condolence.models import Deceased
+
+
+class Command(BaseCommand):
+    help = 'Collects a fixed levy from every opted-in member of a campaign\'s group'
+
+    def add_arguments(self, parser):
+        parser.add_argument('deceased_id', type=int)
+        parser.add_argument('amount')
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            deceased = Deceased.objects.select_related('deceased').get(pk=options['deceased_id'])
+        except Deceased.DoesNotExist:
+            raise CommandError('Campaign not found')
+        try:
+            run = run_levy(deceased, options['amount'], chunk_size=options['chunk_size'])
+        except LevyError as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(
+            f'Levy run {run.id} ({run.status}): collected {run.collected_total} from {run.collected_count} member(s), '
+            f'{run.insufficient_count} skipped for insufficient balance, {run.already_paid_count} already paid'
+        )
+        if run.error:
+            raise CommandError(run.error)
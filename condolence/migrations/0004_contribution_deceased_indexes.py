@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-19 05:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chema', '0014_group_version'),
+        ('condolence', '0003_contribution_payment_method_contribution_transaction_and_more'),
+        ('user', '0003_notification'),
+        ('wallet', '0004_wallet_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contribution',
+            index=models.Index(fields=['group', 'contribution_date'], name='condolence__group_i_c71d81_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contribution',
+            index=models.Index(fields=['contributing_member', 'contribution_date'], name='condolence__contrib_5f70ea_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deceased',
+            index=models.Index(fields=['group', 'cont_is_active', 'date'], name='condolence__group_i_408596_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-19 05:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('condolence', '0004_contribution_deceased_indexes'),
+        ('user', '0003_notification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LevyRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='running', max_length=20)),
+                ('collected_count', models.PositiveIntegerField(default=0)),
+                ('collected_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('insufficient_count', models.PositiveIntegerField(default=0)),
+                ('already_paid_count', models.PositiveIntegerField(default=0)),
+                ('insufficient_members', models.JSONField(blank=True, default=list)),
+                ('error', models.TextField(blank=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('deceased', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='levy_runs', to='condolence.deceased')),
+                ('initiated_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='levy_runs', to='user.profile')),
+            ],
+        ),
+    ]
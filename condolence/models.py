@@ -27,7 +27,36 @@ class Contribution(models.Model):
     
     class Meta:
         unique_together = ('deceased_member', 'contributing_member')
+        indexes = [
+            models.Index(fields=['group', 'contribution_date']),
+            models.Index(fields=['contributing_member', 'contribution_date']),
+        ]
     
+class DeceasedQuerySet(models.QuerySet):
+
+    def with_totals(self):
+        """Annotate raised/disbursed totals (see get_total_raised / get_total_disbursed)."""
+        from django.db.models import DecimalField, OuterRef, Subquery, Sum, Value
+        from django.db.models.functions import Coalesce
+        from wallet.models import Transaction
+
+        amount = DecimalField(max_digits=12, decimal_places=2)
+        raised = (
+            Contribution.objects.filter(deceased_member=OuterRef('pk'))
+            .order_by().values('deceased_member').annotate(t=Sum('amount')).values('t')
+        )
+        disbursed = (
+            Transaction.objects.filter(
+                deceased_contribution=OuterRef('pk'), transaction_type='PAYOUT_RECEIVED', status='COMPLETED'
+            )
+            .order_by().values('deceased_contribution').annotate(t=Sum('amount')).values('t')
+        )
+        return self.annotate(
+            raised_total=Coalesce(Subquery(raised), Value(0), output_field=amount),
+            disbursed_total=Coalesce(Subquery(disbursed), Value(0), output_field=amount),
+        )
+
+
 class Deceased(models.Model):
     deceased  = models.OneToOneField(Profile, on_delete=models.CASCADE,related_name='profile_deceased',default=True, unique=True)
     group     = models.ForeignKey(Group, on_delete=models.CASCADE)
@@ -40,6 +69,13 @@ class Deceased(models.Model):
     beneficiary = models.ForeignKey(Profile, on_delete=models.SET_NULL, null=True, blank=True, related_name='beneficiary_for')
     funds_disbursed = models.BooleanField(default=False)
 
+    objects = DeceasedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['group', 'cont_is_active', 'date']),
+        ]
+
     def __str__ (self):
        return f"{self.deceased}"
    
@@ -49,10 +85,14 @@ class Deceased(models.Model):
         self.save()
 
     def get_total_raised(self):
+        if hasattr(self, 'raised_total'):
+            return self.raised_total
         from django.db.models import Sum
         return self.member_deceased.aggregate(total=Sum('amount'))['total'] or 0
 
     def get_total_disbursed(self):
+        if hasattr(self, 'disbursed_total'):
+            return self.disbursed_total
         from django.db.models import Sum
         # Sum of all payout transactions linked to this deceased member
         return self.wallet_contributions.filter(
@@ -65,4 +105,32 @@ class Deceased(models.Model):
         from decimal import Decimal
         raised = self.get_total_raised()
         disbursed = self.get_total_disbursed()
-        return raised - disbursed
\ No newline at end of file
+        return raised - disbursed
+
+class LevyRun(models.Model):
+    """
+    One batch levy collection for a campaign (see condolence.levy).
+    Holds the summary report of who was debited and who was skipped.
+    """
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    deceased = models.ForeignKey(Deceased, on_delete=models.CASCADE, related_name='levy_runs')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    initiated_by = models.ForeignKey(Profile, on_delete=models.SET_NULL, null=True, blank=True, related_name='levy_runs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    collected_count = models.PositiveIntegerField(default=0)
+    collected_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    insufficient_count = models.PositiveIntegerField(default=0)
+    already_paid_count = models.PositiveIntegerField(default=0)
+    # Profile ids skipped for insufficient balance, for follow-up by the treasurer
+    insufficient_members = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Levy of {self.amount} for {self.deceased} ({self.status})"
@@ -1,7 +1,7 @@
 from rest_framework import serializers
-from .models import Contribution, Deceased
-from user.serializers import ProfileSerializer
-from chema.serializers import GroupSerializer
+from .models import Contribution, Deceased, LevyRun
+from user.serializers import ProfileBriefSerializer, ProfileSerializer
+from chema.serializers import GroupBriefSerializer, GroupSerializer
 
 class DeceasedSerializer(serializers.ModelSerializer):
     deceased_detail = ProfileSerializer(source='deceased', read_only=True)
@@ -29,6 +29,22 @@ class DeceasedSerializer(serializers.ModelSerializer):
     def get_balance(self, obj):
         return obj.get_balance()
 
+class DeceasedSummarySerializer(serializers.ModelSerializer):
+    """Compact list representation; expects with_totals() and select_related('deceased__user', 'group')."""
+    deceased_detail = ProfileBriefSerializer(source='deceased', read_only=True)
+    group_detail = GroupBriefSerializer(source='group', read_only=True)
+    total_raised = serializers.DecimalField(source='get_total_raised', max_digits=12, decimal_places=2, read_only=True)
+    total_disbursed = serializers.DecimalField(source='get_total_disbursed', max_digits=12, decimal_places=2, read_only=True)
+    balance = serializers.DecimalField(source='get_balance', max_digits=12, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = Deceased
+        fields = [
+            'id', 'deceased', 'deceased_detail', 'group', 'group_detail', 'date',
+            'contributions_open', 'cont_is_active', 'beneficiary', 'funds_disbursed',
+            'total_raised', 'total_disbursed', 'balance'
+        ]
+
 class ContributionSerializer(serializers.ModelSerializer):
     contributing_member_detail = ProfileSerializer(source='contributing_member', read_only=True)
     deceased_member_detail = DeceasedSerializer(source='deceased_member', read_only=True)
@@ -40,3 +56,33 @@ class ContributionSerializer(serializers.ModelSerializer):
             'contributing_member', 'contributing_member_detail', 
             'group_admin', 'amount', 'payment_method', 'contribution_date'
         ]
+
+class DeceasedBriefSerializer(serializers.ModelSerializer):
+    deceased_detail = ProfileBriefSerializer(source='deceased', read_only=True)
+    group_detail = GroupBriefSerializer(source='group', read_only=True)
+
+    class Meta:
+        model = Deceased
+        fields = ['id', 'deceased_detail', 'group_detail', 'contributions_open', 'cont_is_active']
+        read_only_fields = fields
+
+class ContributionSummarySerializer(serializers.ModelSerializer):
+    """Compact list representation; expects select_related('group', 'deceased_member__deceased__user', 'deceased_member__group')."""
+    deceased_member_detail = DeceasedBriefSerializer(source='deceased_member', read_only=True)
+
+    class Meta:
+        model = Contribution
+        fields = [
+            'id', 'group', 'deceased_member', 'deceased_member_detail',
+            'contributing_member', 'amount', 'payment_method', 'contribution_date'
+        ]
+
+class LevyRunSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LevyRun
+        fields = [
+            'id', 'deceased', 'amount', 'initiated_by', 'status', 'collected_count',
+            'collected_total', 'insufficient_count', 'already_paid_count',
+            'insufficient_members', 'error', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from chema.models import Group
+from .models import Contribution, Deceased
+
+
+@receiver(post_save, sender=Deceased)
+@receiver(post_delete, sender=Deceased)
+@receiver(post_save, sender=Contribution)
+@receiver(post_delete, sender=Contribution)
+def bump_campaign_group_version(sender, instance, **kwargs):
+    # Campaign lists, totals and member choices are cached per group version
+    Group.bump_versions([instance.group_id])
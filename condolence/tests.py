@@ -1,3 +1,171 @@
+"""
+Query budgets for the condolence HTML/HTMX routes (see core.testing), the
+levy's balance checks and the cached member choices of DeceasedForm.
+
+Pages are checked at two dataset sizes and must run the same number of
+queries at both. Form posts run once.
+"""
+from decimal import Decimal
+
 from django.test import TestCase
 
-# Create your tests here.
+from chema.models import Group, GroupMembership
+from core.testing import QueryBudgetTestCase, make_group
+from user.models import CustomUser
+from wallet.ledger import available_balance
+from wallet.models import Transaction
+
+from .forms import DeceasedForm, formset_data
+from .levy import LevyError, run_levy
+from .models import Contribution, Deceased, LevyRun
+
+HTMX = {'HTTP_HX_REQUEST': 'true'}
+
+
+class PageBudgetTests(QueryBudgetTestCase):
+
+    def get(self, url, max_queries, headers=None, status=200):
+        return self.assert_budget(url, max_queries, client=self.html_client(), headers=headers, status=status)
+
+    def test_create_contribution_form(self):
+        self.get(f'/create-contribution/?deceased_id={self.campaign.id}', 15)
+
+    def test_wallet_payment_form(self):
+        self.get(f'/create-contribution/?deceased_id={self.campaign.id}&mode=personal', 11)
+
+    def test_bulk_contributions_form(self):
+        self.get(f'/bulk-contributions/{self.campaign.id}/', 13)
+
+    def test_test_form(self):
+        self.get('/test-form/', 12)
+
+    def test_contribution_detail(self):
+        self.get(f'/contribution/{self.contribution.id}/', 14)
+
+    def test_contribution_detail_modal(self):
+        self.get(f'/contribution/{self.contribution.id}/', 11, headers=HTMX)
+
+    def test_contributions_list(self):
+        self.get('/contributions_list/', 16)
+
+    def test_deceased_modal(self):
+        self.get('/deceased/', 11, headers=HTMX)
+
+    def test_filter_contributions(self):
+        self.get(f'/filter-contributions/{self.campaign.id}/', 14, headers=HTMX)
+
+    def test_filter_contributions_all(self):
+        self.get('/filter-contributions/all/', 12, headers=HTMX)
+
+    def test_member_status(self):
+        self.get(f'/filter-contributions/{self.campaign.id}/?mode=detailed&status=unpaid', 14, headers=HTMX)
+
+    def test_search_contributions(self):
+        self.get('/search-contributions/?q=Budget', 12, headers=HTMX)
+
+    def test_manage_beneficiary_form(self):
+        self.get(f'/manage-beneficiary/{self.campaign.id}/', 11, headers=HTMX)
+
+    def test_disburse_funds_form(self):
+        self.get(f'/disburse-funds/{self.campaign.id}/', 21, headers=HTMX)
+
+
+class FormBudgetTests(QueryBudgetTestCase):
+
+    def submit(self, url, max_queries, data=None, headers=None, status=None):
+        return self.assert_budget(url, max_queries, method='POST', data=data or {}, client=self.html_client(),
+                                  headers=headers, status=status, scales=False)
+
+    def unpaid_members(self, count):
+        profiles = [CustomUser.objects.create_user(email=f'unpaid{i}@budget.test').profile for i in range(count)]
+        GroupMembership.objects.bulk_create([
+            GroupMembership(group=self.group, member=profile, status='active') for profile in profiles
+        ])
+        return profiles
+
+    def test_create_contribution(self):
+        member, = self.unpaid_members(1)
+        self.submit('/create-contribution/', 12, {
+            'contributing_member': member.id, 'amount': '30.00', 'deceased_member': self.campaign.id,
+            'payment_method': 'cash',
+        }, headers=HTMX, status=200)
+        self.assertTrue(Contribution.objects.filter(contributing_member=member).exists())
+
+    def test_bulk_contributions(self):
+        rows = [{'contributing_member': member.id, 'amount': '30.00'} for member in self.unpaid_members(3)]
+        self.submit(f'/bulk-contributions/{self.campaign.id}/', 13, formset_data(rows), headers=HTMX)
+        self.assertEqual(Contribution.objects.filter(deceased_member=self.campaign, amount='30.00').count(), 3)
+
+    def test_toggle_deceased(self):
+        self.submit(f'/toggle_deceased/{self.campaign.id}/', 4, status=302)
+
+    def test_stop_contributions(self):
+        self.submit(f'/stop_contributions/{self.campaign.id}/', 9, status=200)
+
+    def test_manage_beneficiary(self):
+        self.submit(f'/manage-beneficiary/{self.campaign.id}/', 10, {'beneficiary': self.profile.id}, headers=HTMX)
+
+    def test_disburse_funds(self):
+        self.submit(f'/disburse-funds/{self.campaign.id}/', 21, {'amount': '10.00'}, headers=HTMX, status=204)
+
+
+class LevyTests(TestCase):
+
+    def setUp(self):
+        self.group = make_group(name='Levy group', external_wallet_id='group_wallet_levy')
+        self.deceased = Deceased.objects.create(
+            deceased=CustomUser.objects.create_user(email='late@levy.test').profile, group=self.group
+        )
+        self.payer = self.member('payer@levy.test', balance='30.00')
+        self.pending = self.member('pending@levy.test', balance='30.00')
+        # Settled at the provider later; it already spends the balance
+        Transaction.objects.create(wallet=self.pending.user.wallet, transaction_type='TRANSFER',
+                                   amount=Decimal('20.00'), status='PENDING')
+
+    def member(self, email, balance):
+        profile = CustomUser.objects.create_user(email=email).profile
+        GroupMembership.objects.create(group=self.group, member=profile, status='active', levy_opt_in=True)
+        Transaction.objects.create(wallet=profile.user.wallet, transaction_type='TOP_UP',
+                                   amount=Decimal(balance), status='COMPLETED')
+        return profile
+
+    def test_pending_transfers_count_against_the_balance(self):
+        version = Group.objects.get(pk=self.group.pk).version
+        run = run_levy(self.deceased, '20.00')
+
+        self.assertEqual(run.status, 'completed')
+        self.assertEqual(run.collected_count, 1)
+        self.assertEqual(run.insufficient_members, [self.pending.id])
+        self.assertEqual(available_balance(self.pending.user.wallet.id), Decimal('10.00'))
+        self.assertTrue(Contribution.objects.filter(deceased_member=self.deceased, contributing_member=self.payer).exists())
+        self.assertGreater(Group.objects.get(pk=self.group.pk).version, version)
+
+    def test_amount_is_validated_before_the_run(self):
+        for amount in ('NaN', 'sNaN', 'Infinity', '-Infinity', 'abc', None, '0.001', '-5', '1e9'):
+            with self.subTest(amount=amount), self.assertRaises(LevyError):
+                run_levy(self.deceased, amount)
+        self.assertFalse(LevyRun.objects.exists())
+
+        run = run_levy(self.deceased, '12.3449')
+        self.assertEqual(run.amount, Decimal('12.34'))
+
+
+class DeceasedChoicesTests(TestCase):
+
+    def setUp(self):
+        self.group = make_group(name='Choices', external_wallet_id='group_wallet_choices')
+        self.member = CustomUser.objects.create_user(email='member@choices.test').profile
+        self.member.first_name, self.member.surname = 'Old', 'Name'
+        self.member.save()
+        GroupMembership.objects.create(group=self.group, member=self.member, status='active')
+
+    def labels(self):
+        # A fresh group instance per request, as the views load it
+        form = DeceasedForm(active_group=Group.objects.get(pk=self.group.pk))
+        return [label for value, label in form.fields['deceased'].choices if value]
+
+    def test_profile_rename_refreshes_the_cached_labels(self):
+        self.assertEqual(self.labels(), ['Old Name'])
+        self.member.first_name = 'New'
+        self.member.save()
+        self.assertEqual(self.labels(), ['New Name'])
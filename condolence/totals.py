@@ -0,0 +1,23 @@
+"""
+A group's campaigns with their raised and disbursed totals, cached per
+group version (core.cache). Every campaign change, contribution and payout
+bumps Group.version (condolence.signals, wallet.signals, and the bulk paths
+in condolence.bulk, condolence.levy and wallet.settlement), so the cached
+list never lags the database. Code that moves money still reads totals
+fresh through Deceased.objects.with_totals().
+"""
+from core.cache import cached, group_version
+
+from .models import Deceased
+
+
+def group_campaigns(group):
+    """
+    Every campaign of `group`, newest first, annotated by with_totals() and
+    with the deceased's and beneficiary's profiles and users loaded.
+    """
+    return cached('group.campaigns', group_version(group), lambda: list(
+        Deceased.objects.filter(group=group).with_totals()
+        .select_related('deceased__user', 'beneficiary__user')
+        .order_by('-date', '-pk')
+    ))
@@ -3,6 +3,7 @@ from . import views
 
 urlpatterns = [
     path('create-contribution/', views.create_contribution, name='create_contribution'),
+    path('bulk-contributions/<int:deceased_id>/', views.bulk_contributions, name='bulk_contributions'),
     path('test-form/', views.test_form, name='test_form'),  # Test URL
     path('contribution/<int:contribution_id>/', views.contribution_detail, name='contribution_detail'), 
     path('contributions_list/', views.contributions_list, name='contributions_list'),
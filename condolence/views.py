@@ -1,15 +1,19 @@
 from django.http import HttpResponse
-from django.db.models import Sum, Q
+from django.core.paginator import Paginator
+from django.db.models import Count, F, FilteredRelation, Sum, Q
 from django.shortcuts import render, get_object_or_404, redirect
 from condolence.forms import *
+from .bulk import record_bulk_contributions
+from .totals import group_campaigns
 from .models import *
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from chema.models import *
+from wallet.ledger import InsufficientFunds, disburse_campaign_funds
 from wallet.models import Wallet, Transaction
 from decimal import Decimal
 
-
+MEMBER_STATUS_PAGE_SIZE = 50
 
 
 @login_required
@@ -130,6 +134,67 @@ def create_contribution(request):
 
 
 
+@login_required
+def bulk_contributions(request, deceased_id):
+    """
+    Admin grid for entering many manual contributions at once. GET lists the
+    members who have not paid yet; POST saves the ticked rows in one batch.
+    """
+    active_membership = GroupMembership.objects.filter(member=request.user.profile, is_active=True).first()
+    if not active_membership:
+        active_membership = GroupMembership.objects.filter(member=request.user.profile).first()
+    if not active_membership:
+        return HttpResponse("No active group found", status=403)
+
+    active_group = active_membership.group
+    if not active_group.is_admin(request.user):
+        return HttpResponse("Only group admins can record contributions.", status=403)
+    deceased_obj = get_object_or_404(Deceased.objects.select_related('deceased'), id=deceased_id, group=active_group)
+
+    group_members = Profile.objects.filter(groups=active_group).select_related('user').distinct()
+
+    if request.method == 'POST':
+        formset = BulkContributionFormSet(request.POST)
+        if formset.is_valid():
+            selected = [form for form in formset if form.cleaned_data.get('include')]
+            rows = [form.cleaned_data for form in selected]
+            contributions, conflicts = record_bulk_contributions(deceased_obj, request.user.profile, rows)
+            for index, message in conflicts.items():
+                selected[index].add_error(None, message)
+            if contributions:
+                import json
+                # One refresh of the list and totals for the whole batch
+                triggers = {'update-contributions': True}
+                message = f"Recorded {len(contributions)} contribution(s)."
+                return HttpResponse(
+                    f"<div class='alert alert-success text-sm py-2'>{message}</div>",
+                    headers={'HX-Trigger': json.dumps(triggers)},
+                )
+    else:
+        unpaid = (
+            group_members.exclude(id=deceased_obj.deceased_id)
+            .exclude(deceased_contributions__deceased_member=deceased_obj)
+            .order_by('first_name', 'surname', 'id')
+            .values_list('id', flat=True)
+        )
+        formset = BulkContributionFormSet(initial=[
+            {'contributing_member': member_id, 'amount': Decimal('100.00')} for member_id in unpaid
+        ])
+
+    members = {member.id: member for member in group_members}
+    rows = []
+    for form in formset:
+        member_id = str(form['contributing_member'].value())
+        rows.append((form, members.get(int(member_id)) if member_id.isdigit() else None))
+    context = {
+        'formset': formset,
+        'rows': rows,
+        'deceased': deceased_obj,
+        'deceased_id': deceased_obj.id,
+    }
+    return render(request, 'condolence/partials/bulk_contribution_form.html', context)
+
+
 def test_form(request):
     """Test view to debug form rendering"""
     form = ContributionForm()
@@ -285,58 +350,81 @@ def filter_contributions(request, deceased_id=None):
         base_contributions = Contribution.objects.filter(
             group=active_group
         )
-    total_amount = base_contributions.aggregate(Sum('amount'))['amount__sum'] or 0
 
     # Detailed Mode Logic (When deceased is selected and mode is requested)
     if mode == 'detailed' and deceased_id and deceased_id != 'all':
         # Get the deceased object to show who this list is for
         deceased_obj = get_object_or_404(Deceased, id=deceased_id, group=active_group)
-        
-        # Get all members of the active group
-        all_members = Profile.objects.filter(groups=active_group)
-        
-        # Get contributions for this deceased person, indexed by member ID
-        contributions_map = {
-            c.contributing_member_id: c 
-            for c in base_contributions
-        }
-        
-        members_data = []
-        for member in all_members:
-            contribution = contributions_map.get(member.id)
-            is_paid = contribution is not None
-            
-            # Filter Logic
-            if status_filter == 'paid' and not is_paid: continue
-            if status_filter == 'unpaid' and is_paid: continue
-            
-            members_data.append({
+
+        # Every group member LEFT JOINed to their contribution for this deceased
+        # (at most one: unique per deceased/member), so paid/unpaid is a SQL filter
+        members = Profile.objects.filter(groups=active_group).annotate(
+            paid=FilteredRelation(
+                'deceased_contributions',
+                condition=Q(deceased_contributions__deceased_member=deceased_obj, deceased_contributions__group=active_group),
+            ),
+        ).annotate(
+            contribution_id=F('paid__id'),
+            paid_amount=F('paid__amount'),
+            paid_date=F('paid__contribution_date'),
+        )
+        summary = members.aggregate(
+            member_count=Count('id'),
+            paid_count=Count('contribution_id'),
+            total_amount=Sum('paid_amount'),
+        )
+        total_amount = summary['total_amount'] or 0
+
+        if status_filter == 'paid':
+            members = members.filter(contribution_id__isnull=False)
+            filtered_count = summary['paid_count']
+        elif status_filter == 'unpaid':
+            members = members.filter(contribution_id__isnull=True)
+            filtered_count = summary['member_count'] - summary['paid_count']
+        else:
+            filtered_count = summary['member_count']
+
+        paginator = Paginator(members.order_by('first_name', 'surname', 'id'), MEMBER_STATUS_PAGE_SIZE)
+        # Already known from the summary; saves a COUNT query
+        paginator.count = filtered_count
+        page_obj = paginator.get_page(request.GET.get('page'))
+
+        members_data = [
+            {
                 'member': member,
-                'is_paid': is_paid,
-                'amount': contribution.amount if contribution else 0,
-                'date': contribution.contribution_date if contribution else None,
-                'contribution_id': contribution.id if contribution else None
-            })
-            
+                'is_paid': member.contribution_id is not None,
+                'amount': member.paid_amount or 0,
+                'date': member.paid_date,
+                'contribution_id': member.contribution_id,
+            }
+            for member in page_obj
+        ]
+
         is_admin = active_group.is_admin(request.user)
-                   
+
         context = {
             'members_data': members_data,
+            'page_obj': page_obj,
+            'paid_count': summary['paid_count'],
+            'unpaid_count': summary['member_count'] - summary['paid_count'],
             'deceased': deceased_obj,  # Add the deceased object
             'deceased_id': deceased_id,
             'filter_status': status_filter,
             'total_amount': total_amount, # For OOB
+            'active_group': active_group,
             'is_admin': is_admin
         }
         return render(request, 'condolence/partials/member_status_list.html', context)
 
+    total_amount = base_contributions.aggregate(Sum('amount'))['amount__sum'] or 0
+
     # Standard List Logic
     deceased_obj = None
     if deceased_id and deceased_id != 'all':
-        contributions = base_contributions.order_by('-contribution_date')
+        contributions = base_contributions.select_related('contributing_member').order_by('-contribution_date')
         deceased_obj = Deceased.objects.filter(id=deceased_id, group=active_group).first()
     else:
-        contributions = base_contributions.order_by('-contribution_date')
+        contributions = base_contributions.select_related('contributing_member').order_by('-contribution_date')
         
     context = {
         'contributions': contributions,
@@ -365,13 +453,13 @@ def search_contributions(request):
     if query and active_group:
         contributions = Contribution.objects.filter(
             Q(contributing_member__first_name__icontains=query) |
-            Q(contributing_member__last_name__icontains=query) |
+            Q(contributing_member__surname__icontains=query) |
             Q(deceased_member__deceased__first_name__icontains=query) |
-            Q(deceased_member__deceased__last_name__icontains=query) |
+            Q(deceased_member__deceased__surname__icontains=query) |
             Q(amount__icontains=query) 
         ).filter(
             group=active_group
-        ).distinct().order_by('-contribution_date')
+        ).distinct().select_related('contributing_member').order_by('-contribution_date')
     else:
         contributions = Contribution.objects.none()
 
@@ -408,18 +496,20 @@ def contributions_list(request):
     
     active_group = active_membership.group
 
-    deceased_list = Deceased.objects.filter(group=active_group, contributions_open=True).annotate(
-        total_raised=Sum('member_deceased__amount')
+    deceased_list = sorted(
+        (d for d in group_campaigns(active_group) if d.contributions_open), key=lambda d: d.pk
     )
     
     # Auto-select the first deceased member if available
     # Assuming standard ordering (e.g., creation order), you might want to order by '-id' or '-date'
-    latest_deceased = deceased_list.last() # taking last created if id is sequential, or order by date if needed
+    latest_deceased = deceased_list[-1] if deceased_list else None # taking last created if id is sequential, or order by date if needed
     
     if latest_deceased:
-        contributions = Contribution.objects.filter(deceased_member=latest_deceased, group=active_group).order_by('-contribution_date')
+        contributions = Contribution.objects.filter(
+            deceased_member=latest_deceased, group=active_group
+        ).select_related('contributing_member').order_by('-contribution_date')
         selected_deceased_id = latest_deceased.id
-        total_contributions = latest_deceased.total_raised # Use the annotated value
+        total_contributions = latest_deceased.get_total_raised() # Use the annotated value
     else:
         contributions = Contribution.objects.none()
         selected_deceased_id = None
@@ -506,8 +596,6 @@ def disburse_funds(request, deceased_id):
     except:
         return HttpResponse("Invalid amount", status=400)
 
-    available_balance = deceased_obj.get_balance()
-    
     if amount_to_disburse <= 0:
         messages.error(request, "Amount must be positive.")
         # Re-render modal with error? For now simple response or redirect
@@ -517,23 +605,17 @@ def disburse_funds(request, deceased_id):
              return response
         return redirect('contributions_list')
 
-    if amount_to_disburse > available_balance:
-        return HttpResponse("Insufficient funds", status=400)
-
-    # Create Transaction for Beneficiary (PAYOUT_RECEIVED)
+    # Create Transaction for Beneficiary (PAYOUT_RECEIVED); the campaign
+    # balance is checked under a lock so concurrent payouts cannot overdraw it
     beneficiary_wallet, _ = Wallet.objects.get_or_create(
         user=deceased_obj.beneficiary.user, 
         defaults={'external_wallet_id': f"auto_{deceased_obj.beneficiary.user.email}"}
     )
     
-    Transaction.objects.create(
-        wallet=beneficiary_wallet,
-        transaction_type='PAYOUT_RECEIVED',
-        amount=amount_to_disburse,
-        status='COMPLETED',
-        destination_group=active_group,
-        deceased_contribution=deceased_obj
-    )
+    try:
+        disburse_campaign_funds(deceased_obj, beneficiary_wallet, amount_to_disburse)
+    except InsufficientFunds:
+        return HttpResponse("Insufficient funds", status=400)
     
     deceased_obj.funds_disbursed = True 
     # deceased_obj.stop_contributions() 
@@ -0,0 +1,323 @@
+"""
+Offline load benchmark of the main user journeys.
+
+Each journey is a short sequence of requests a real client makes (the mobile
+app through /api/v1/, the web app through the HTMX pages). `run_benchmark`
+drives them through the WSGI handler in-process with Django's test clients,
+so nothing touches the network: the WaaS provider is the in-process fake and
+push tokens are the dataset's invalid ones. Every journey runs as its own
+phase, `iterations` times on `concurrency` threads, after `warmup` unmeasured
+runs. For each phase it records latency percentiles, throughput, queries
+per run and the process's peak RSS.
+
+The dataset is core.testing's (seed_dataset); `manage.py benchmark`
+(core.management.commands.benchmark) builds it in a throwaway database and writes the report as JSON. `compare` diffs
+a report against a saved baseline.
+"""
+import io
+import queue
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from chema.models import Post
+from condolence.models import Deceased
+from core.middleware import QueryStats
+from user.models import CustomUser
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+API = '/api/v1'
+FEED_PAGES = 3
+# Latency and throughput may move this much (percent) before compare() flags it
+DEFAULT_TOLERANCE = 10
+
+
+class JourneyError(Exception):
+    pass
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def peak_rss_mb():
+    """High-water mark of this process's resident memory, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class Session:
+    """One user's API (token) and web (session cookie) clients."""
+
+    def __init__(self, user):
+        token, _ = Token.objects.get_or_create(user=user)
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.web = Client()
+        self.web.force_login(user)
+        self.requests = 0
+
+    def call(self, client, method, url, data=None, expect=200, **extra):
+        response = getattr(client, method)(url, data, **extra)
+        self.requests += 1
+        if response.status_code != expect:
+            raise JourneyError(f'{method.upper()} {url} returned {response.status_code}')
+        return response
+
+
+def sample_image(n):
+    """A small PNG that differs per run (uploads are stored by content)."""
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (n % 256, (n // 256) % 256, 128)).save(buffer, 'PNG')
+    return SimpleUploadedFile(f'bench-{n}.png', buffer.getvalue(), content_type='image/png')
+
+
+# --- Journeys: (session, fixtures, n) -> None, raising JourneyError ---
+
+def app_launch(session, fixtures, n):
+    session.call(session.api, 'get', f'{API}/bootstrap/')
+    session.call(session.api, 'get', f'{API}/sync/')
+    session.call(session.api, 'get', f'{API}/groups/mine/')
+
+
+def group_feed(session, fixtures, n):
+    # Up to three pages, as far as the feed goes
+    url, params = f'{API}/posts/', {'group_id': fixtures.group.id}
+    for _ in range(FEED_PAGES):
+        url = session.call(session.api, 'get', url, params).data.get('next')
+        if not url:
+            break
+        params = None
+
+
+def post_with_images(session, fixtures, n):
+    post = session.call(session.api, 'post', f'{API}/posts/',
+                        {'group': fixtures.group.id, 'content': f'Benchmark post {n}'}, expect=201, format='json')
+    for i in range(2):
+        session.call(session.api, 'post', f'{API}/post-images/',
+                     {'post': post.data['id'], 'image': sample_image(n * 2 + i)}, expect=201, format='multipart')
+
+
+def comment_thread(session, fixtures, n):
+    session.call(session.api, 'get', f'{API}/comments/', {'post_id': fixtures.thread.id})
+    comment = session.call(session.api, 'post', f'{API}/comments/',
+                           {'post': fixtures.thread.id, 'content': f'Benchmark comment {n}'},
+                           expect=201, format='json')
+    session.call(session.api, 'post', f'{API}/replies/',
+                 {'comment': comment.data['id'], 'content': f'Benchmark reply {n}'}, expect=201, format='json')
+
+
+def contribute(session, fixtures, n):
+    session.call(session.api, 'get', f'{API}/deceased/{fixtures.campaign.id}/')
+    session.call(session.api, 'post', f'{API}/wallets/contribute_to_deceased/',
+                 {'deceased_id': fixtures.campaign.id, 'amount': '20.00'}, format='json')
+    session.call(session.api, 'get', f'{API}/wallets/balance/')
+
+
+def wallet_history(session, fixtures, n):
+    session.call(session.api, 'get', f'{API}/wallets/balance/')
+    session.call(session.api, 'get', f'{API}/transactions/')
+    session.call(session.web, 'get', '/history/')
+
+
+def admin_dashboard(session, fixtures, n):
+    group_id = fixtures.group.id
+    for action in ('dashboard', 'members', 'pending_members', 'transactions'):
+        session.call(session.api, 'get', f'{API}/groups/{group_id}/{action}/')
+    session.call(session.web, 'get', f'/group_detail_view/{group_id}/')
+
+
+# name: (journey, who runs it). Payers are members who have not yet paid
+# into fixtures.campaign, one per run.
+JOURNEYS = {
+    'app_launch': (app_launch, 'member'),
+    'group_feed': (group_feed, 'member'),
+    'post_with_images': (post_with_images, 'member'),
+    'comment_thread': (comment_thread, 'member'),
+    'contribute': (contribute, 'payer'),
+    'wallet_history': (wallet_history, 'member'),
+    'admin_dashboard': (admin_dashboard, 'admin'),
+}
+
+
+def prepare_fixtures(data):
+    """Pick the journeys' targets from a seed_dataset() dataset."""
+    campaign = Deceased.objects.filter(group=data.group).exclude(pk=data.campaign.pk).order_by('pk').first()
+    # The post with the longest comment thread
+    thread = (Post.objects.filter(group=data.group).annotate(comments=Count('comment'))
+              .order_by('-comments', 'pk').first())
+    members = list(
+        CustomUser.objects.filter(
+            profile__groupmembership__group=data.group,
+            profile__groupmembership__role='member',
+            profile__groupmembership__is_deceased=False,
+        ).exclude(profile=campaign.deceased).order_by('pk')
+    )
+    return SimpleNamespace(
+        group=data.group,
+        admin=data.me,
+        campaign=campaign,
+        thread=thread,
+        members=members,
+    )
+
+
+def _actor(fixtures, who, n):
+    if who == 'admin':
+        return fixtures.admin
+    if who == 'payer':
+        if n >= len(fixtures.members):
+            raise JourneyError('no member left who has not paid; seed a larger dataset')
+        return fixtures.members[n]
+    return fixtures.members[n % len(fixtures.members)]
+
+
+def run_phase(name, fixtures, iterations, concurrency, first=0):
+    """Run journey `name` as runs first..first+iterations-1; return [(seconds, queries, requests, error)]."""
+    journey, who = JOURNEYS[name]
+    pending = queue.Queue()
+    for n in range(first, first + iterations):
+        pending.put(n)
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        sessions = {}
+        try:
+            while True:
+                try:
+                    n = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    user = _actor(fixtures, who, n)
+                    if user.pk not in sessions:
+                        sessions[user.pk] = Session(user)
+                except Exception as exc:
+                    with lock:
+                        results.append((0.0, 0, 0, f'{type(exc).__name__}: {exc}'))
+                    continue
+                session = sessions[user.pk]
+                session.requests = 0
+                stats = QueryStats()
+                error = None
+                started = time.perf_counter()
+                try:
+                    with connection.execute_wrapper(stats):
+                        journey(session, fixtures, n)
+                except Exception as exc:
+                    error = f'{type(exc).__name__}: {exc}'
+                elapsed = time.perf_counter() - started
+                with lock:
+                    results.append((elapsed, stats.count, session.requests, error))
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summarize(results, wall):
+    latencies = [seconds * 1000 for seconds, _, _, error in results if error is None]
+    queries = [count for _, count, _, error in results if error is None]
+    errors = [error for *_, error in results if error is not None]
+    summary = {
+        'runs': len(results),
+        'errors': len(errors),
+        'error_samples': sorted(set(errors))[:5],
+        'wall_seconds': round(wall, 3),
+        'throughput_per_second': round(len(latencies) / wall, 2) if wall else None,
+        'requests_per_second': round(sum(result[2] for result in results) / wall, 2) if wall else None,
+    }
+    if latencies:
+        summary.update({
+            'p50_ms': round(percentile(latencies, 0.5), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'queries_per_run': round(sum(queries) / len(queries), 1),
+            'max_queries': max(queries),
+        })
+    summary['peak_rss_mb'] = peak_rss_mb()
+    return summary
+
+
+def run_benchmark(data, journeys=None, iterations=50, concurrency=8, warmup=1, on_phase=None):
+    """
+    Run every journey in `journeys` (default: all) against the dataset and
+    return {'journeys': {name: summary}, 'totals': {...}}. `on_phase(name,
+    summary)` is called as each phase finishes.
+    """
+    fixtures = prepare_fixtures(data)
+    report = {}
+    started = time.perf_counter()
+    for name in journeys or JOURNEYS:
+        # Payers are used up, so warmup and measured runs take different ones
+        run_phase(name, fixtures, warmup, 1)
+        phase_started = time.perf_counter()
+        results = run_phase(name, fixtures, iterations, concurrency, first=warmup)
+        report[name] = summarize(results, time.perf_counter() - phase_started)
+        if on_phase is not None:
+            on_phase(name, report[name])
+    wall = time.perf_counter() - started
+    return {
+        'journeys': report,
+        'totals': {
+            'runs': sum(summary['runs'] for summary in report.values()),
+            'errors': sum(summary['errors'] for summary in report.values()),
+            'wall_seconds': round(wall, 3),
+            'peak_rss_mb': peak_rss_mb(),
+        },
+    }
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Diff two reports journey by journey. Returns (rows, regressions): rows
+    are (journey, metric, baseline, current, change %); a regression is a
+    latency or throughput change beyond `tolerance` percent in the wrong
+    direction, any increase in queries per run, or new errors.
+    """
+    # metric: True when higher is better
+    metrics = {'p50_ms': False, 'p95_ms': False, 'p99_ms': False, 'throughput_per_second': True,
+               'queries_per_run': False, 'errors': False}
+    rows, regressions = [], []
+    for name, current in report['journeys'].items():
+        before = baseline.get('journeys', {}).get(name)
+        if before is None:
+            continue
+        for metric, higher_is_better in metrics.items():
+            old, new = before.get(metric), current.get(metric)
+            if old is None or new is None:
+                continue
+            change = round((new - old) / old * 100, 1) if old else None
+            rows.append((name, metric, old, new, change))
+            worse = new < old if higher_is_better else new > old
+            if not worse:
+                continue
+            # Query counts and errors are deterministic: any increase counts
+            if metric in ('queries_per_run', 'errors') or change is None or abs(change) > tolerance:
+                regressions.append((name, metric, old, new, change))
+    return rows, regressions
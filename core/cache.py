@@ -0,0 +1,50 @@
+"""
+Versioned application cache for read-mostly data.
+
+Entries are keyed by the change counters of the data they were computed
+from, so writes never look for entries to delete: they bump a counter and
+the next read computes under a new key, while the old entry ages out after
+APP_CACHE_TIMEOUT.
+
+Group-scoped data (admins, campaign totals, member choices, contacts) is
+keyed by `group_version(group)`: Group.version, bumped by the signals in
+chema.signals, condolence.signals and wallet.signals on membership, admin,
+post, campaign, contribution and transaction changes, plus updated_at for
+edits to the group itself. Data spanning every group (chema.catalogue)
+combines the same columns across the groups table.
+
+Works with any Django backend (CACHES is built from CACHE_URL in
+core.settings). With the default local-memory backend each process has its
+own copy; the versions live in the database, so every process still sees
+every change.
+
+Lookups are counted in cache_requests_total and traced as cache.get spans.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import record_cache
+from .tracing import span
+
+_MISSING = object()
+
+
+def group_version(group):
+    """Cache key part for data derived from `group` and its members."""
+    return f'{group.pk}.{group.version}.{group.updated_at.timestamp() if group.updated_at else 0}'
+
+
+def cached(name, version, compute, timeout=None):
+    """
+    The value `compute()` returned for `name` at `version`, computing and
+    storing it on a miss. Values must be picklable.
+    """
+    key = f'{name}:{version}'
+    with span('cache.get', cache=name) as current:
+        value = cache.get(key, _MISSING)
+        current.set(hit=value is not _MISSING)
+    record_cache(name, value is not _MISSING)
+    if value is _MISSING:
+        value = compute()
+        cache.set(key, value, settings.APP_CACHE_TIMEOUT if timeout is None else timeout)
+    return value
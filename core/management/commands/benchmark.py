@@ -0,0 +1,141 @@
+import json
+import os
+import platform
+import subprocess
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from core.benchmark import DEFAULT_TOLERANCE, JOURNEYS, compare, run_benchmark
+from core.testing import seed_dataset
+from wallet.waas import WaaSClient
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks the main user journeys in-process against a freshly seeded throwaway database '
+            'and writes latency, throughput, query and memory figures as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--journeys', help=f"Comma-separated subset of: {', '.join(JOURNEYS)}")
+        parser.add_argument('--iterations', type=int, default=50, help='Measured runs per journey')
+        parser.add_argument('--concurrency', type=int, default=8, help='Threads running each journey')
+        parser.add_argument('--warmup', type=int, default=1, help='Unmeasured runs per journey first')
+        parser.add_argument('--size', type=int, default=100,
+                            help='Members, posts, transactions... seeded (raised to cover every contribute run)')
+        parser.add_argument('--output', default='benchmark.json', help='Where to write the report')
+        parser.add_argument('--baseline', help='A saved report to compare against')
+        parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                            help='Percent latency/throughput change tolerated before flagging a regression')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Exit with an error when the comparison finds a regression')
+
+    def handle(self, *args, **options):
+        journeys = options['journeys'].split(',') if options['journeys'] else list(JOURNEYS)
+        unknown = set(journeys) - set(JOURNEYS)
+        if unknown:
+            raise CommandError(f"Unknown journey(s): {', '.join(sorted(unknown))}")
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+        # Every contribute run needs a member who has not paid yet
+        size = max(options['size'], options['iterations'] + options['warmup'] + 1)
+
+        with tempfile.TemporaryDirectory(prefix='benchmark-') as workdir:
+            report = self._run(journeys, size, options, workdir)
+
+        report['meta'] = {
+            'started_at': timezone.now().isoformat(),
+            'revision': self._revision(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'journeys': journeys,
+            'iterations': options['iterations'],
+            'concurrency': options['concurrency'],
+            'warmup': options['warmup'],
+            'size': size,
+        }
+        totals = report['totals']
+        self.stdout.write(f"{totals['runs']} journey run(s) in {totals['wall_seconds']:.1f}s, "
+                          f"{totals['errors']} error(s), peak RSS {totals['peak_rss_mb']} MB")
+
+        regressions = []
+        if baseline is not None:
+            rows, regressions = compare(report, baseline, tolerance=options['tolerance'])
+            report['comparison'] = {
+                'baseline': options['baseline'],
+                'tolerance': options['tolerance'],
+                'rows': [dict(zip(('journey', 'metric', 'baseline', 'current', 'change_pct'), row)) for row in rows],
+                'regressions': len(regressions),
+            }
+            self.stdout.write(f"Compared with {options['baseline']}:")
+            differing = [key for key in ('iterations', 'concurrency', 'size', 'database')
+                         if baseline.get('meta', {}).get(key) != report['meta'][key]]
+            if differing:
+                self.stdout.write(self.style.WARNING(
+                    f"  The baseline was run with different {', '.join(differing)}; the figures are not comparable"
+                ))
+            for row in rows:
+                style = self.style.WARNING if row in regressions else (lambda text: text)
+                change = 'n/a' if row[4] is None else f'{row[4]:+.1f}%'
+                self.stdout.write(style(f'  {row[0]:<17} {row[1]:<22} {row[2]:>10} -> {row[3]:>10} ({change})'))
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}')
+
+    def _run(self, journeys, size, options, workdir):
+        # A file rather than SQLite's in-memory test database, so the worker
+        # threads' connections share it (see wallet.tests)
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        if connection.vendor == 'sqlite' and not test_settings.get('NAME'):
+            test_settings['NAME'] = os.path.join(workdir, 'benchmark.sqlite3')
+
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        media = os.path.join(workdir, 'media')
+        try:
+            # Uploads go to the temporary directory; payments to the in-process provider
+            with override_settings(MEDIA_ROOT=media, CHUNKED_UPLOAD_DIR=os.path.join(media, 'uploads_partial')), \
+                    mock.patch('wallet.waas._client', WaaSClient(base_url='')):
+                self.stdout.write(f'Seeding {size} members...')
+                data = SimpleNamespace()
+                seed_dataset(data, size)
+                self.stdout.write(f"Running {', '.join(journeys)}: {options['iterations']} run(s) each "
+                                  f"on {options['concurrency']} thread(s)")
+                return run_benchmark(
+                    data, journeys, iterations=options['iterations'], concurrency=options['concurrency'],
+                    warmup=options['warmup'], on_phase=self._print_phase,
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def _print_phase(self, name, summary):
+        if 'p50_ms' not in summary:
+            self.stdout.write(self.style.ERROR(f"  {name:<17} every run failed: {summary['error_samples']}"))
+            return
+        self.stdout.write(
+            f"  {name:<17} n={summary['runs']:<4} p50={summary['p50_ms']:7.1f}ms p95={summary['p95_ms']:7.1f}ms "
+            f"p99={summary['p99_ms']:7.1f}ms {summary['throughput_per_second']:7.1f}/s "
+            f"queries={summary['queries_per_run']:<6} errors={summary['errors']}"
+        )
+        for sample in summary['error_samples']:
+            self.stdout.write(self.style.WARNING(f'    {sample}'))
+
+    def _revision(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
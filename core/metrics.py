@@ -0,0 +1,334 @@
+"""
+In-process metrics with a Prometheus text exposition endpoint (/metrics).
+
+Counters and histograms live in `registry` and are updated in place: one
+dict lookup and a lock per observation. MetricsMiddleware records every
+request's latency by view, plus its database time and query count (from
+QueryInstrumentationMiddleware's request.sql_stats). Cache lookups, push
+deliveries, WaaS calls and wallet transaction writes are recorded where
+they happen, through the metrics defined at the bottom of this module.
+
+Under gunicorn each worker has its own registry, and without
+METRICS_MULTIPROC_DIR /metrics only shows the worker that answered the
+scrape. With it set, every process writes a snapshot of its registry to its
+own file there (at most every METRICS_FLUSH_SECONDS, and at exit), and the
+endpoint adds up all the files. On each scrape the files of exited workers
+are folded into one aggregate file and removed, so their counts are kept
+and the directory stays as large as the worker pool however often workers
+are recycled (max_requests). Empty the directory when the server starts.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+try:
+    import fcntl
+except ImportError:  # Windows: no gunicorn workers to fold
+    fcntl = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# Counts of exited workers, in METRICS_MULTIPROC_DIR
+AGGREGATE_FILE = 'aggregate.json'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _process_exited(snapshot_name):
+    """True when the worker that wrote `<pid>-<id>.json` is gone."""
+    try:
+        os.kill(int(snapshot_name.split('-', 1)[0]), 0)
+    except ValueError:
+        return False
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, registry, name, help, labels=()):
+        self.registry = registry
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    @staticmethod
+    def copy(value):
+        return value
+
+    @staticmethod
+    def merge(target, key, value):
+        target[key] = target.get(key, 0) + value
+
+    def render(self, values):
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_labels(self.label_names, key)} {_number(value)}'
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, registry, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.registry = registry
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        # key -> [count per bucket (the last one is +Inf), sum, count]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        index = bisect_left(self.buckets, value)
+        with self.registry.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @staticmethod
+    def copy(value):
+        return [list(value[0]), value[1], value[2]]
+
+    @staticmethod
+    def merge(target, key, value):
+        entry = target.get(key)
+        if entry is None:
+            target[key] = [list(value[0]), value[1], value[2]]
+            return
+        entry[0] = [a + b for a, b in zip(entry[0], value[0])]
+        entry[1] += value[1]
+        entry[2] += value[2]
+
+    def render(self, values):
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % (bound if bound == '+Inf' else _number(bound))
+                yield f'{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.label_names, key)} {_number(total)}'
+            yield f'{self.name}_count{_labels(self.label_names, key)} {count}'
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self._pid = None
+        self._file = None
+        self._flushed_at = 0.0
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(self, name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self, name, help, labels, buckets))
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: [[list(key), metric.copy(value)] for key, value in metric.values.items()]
+                for name, metric in self.metrics.items()
+            }
+
+    # --- Multi-process ---
+
+    def _snapshot_path(self, directory):
+        pid = os.getpid()
+        if self._pid != pid:
+            # A forked worker starts its own file (and its own counts)
+            if self._pid is not None:
+                with self.lock:
+                    for metric in self.metrics.values():
+                        metric.values = {}
+            self._pid = pid
+            self._file = f'{pid}-{uuid.uuid4().hex[:8]}.json'
+        return os.path.join(directory, self._file)
+
+    def flush(self):
+        directory = getattr(settings, 'METRICS_MULTIPROC_DIR', None)
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = self._snapshot_path(directory)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+        self._flushed_at = time.monotonic()
+
+    def maybe_flush(self):
+        if settings.METRICS_MULTIPROC_DIR and time.monotonic() - self._flushed_at >= settings.METRICS_FLUSH_SECONDS:
+            self.flush()
+
+    def _merge(self, snapshots):
+        merged = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            for name, samples in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                for key, value in samples:
+                    metric.merge(merged[name], tuple(key), value)
+        return merged
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None  # being replaced, or left half-written by a killed worker
+
+    def fold_exited(self, directory):
+        """Add the files of exited workers to AGGREGATE_FILE and remove them."""
+        if fcntl is None:
+            return
+        with open(os.path.join(directory, '.lock'), 'a') as lock:
+            # One scrape folds at a time, or the aggregate could lose an update
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            exited = [
+                entry.path for entry in os.scandir(directory)
+                if entry.name.endswith('.json') and entry.name != AGGREGATE_FILE and _process_exited(entry.name)
+            ]
+            if not exited:
+                return
+            aggregate = os.path.join(directory, AGGREGATE_FILE)
+            snapshots = [self._read(path) or {} for path in [aggregate, *exited]]
+            merged = self._merge(snapshots)
+            tmp = f'{aggregate}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({name: [[list(key), value] for key, value in values.items()]
+                           for name, values in merged.items()}, f)
+            os.replace(tmp, aggregate)
+            for path in exited:
+                os.remove(path)
+
+    def collect(self):
+        """{name: {labels: value}} for every process (this one live, the others from their files)."""
+        snapshots = [self.snapshot()]
+        directory = settings.METRICS_MULTIPROC_DIR
+        if directory and os.path.isdir(directory):
+            self.fold_exited(directory)
+            own = self._snapshot_path(directory)
+            for entry in os.scandir(directory):
+                if entry.name.endswith('.json') and entry.path != own:
+                    snapshot = self._read(entry.path)
+                    if snapshot is not None:
+                        snapshots.append(snapshot)
+        return self._merge(snapshots)
+
+    def render(self):
+        lines = []
+        for name, values in self.collect().items():
+            metric = self.metrics[name]
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            lines.extend(metric.render(values))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+class MetricsMiddleware:
+    """Put it before QueryInstrumentationMiddleware so request.sql_stats is complete."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        # Unrouted paths (404s) share one label instead of one per URL
+        view = match.view_name if match else '<unresolved>'
+        REQUEST_LATENCY.observe(elapsed, view=view, method=request.method, status=response.status_code)
+        stats = getattr(request, 'sql_stats', None)
+        if stats is not None:
+            REQUEST_DB_TIME.observe(stats.duration, view=view)
+            REQUEST_QUERIES.observe(stats.count, view=view)
+        registry.maybe_flush()
+        return response
+
+
+def metrics_view(request):
+    """Prometheus scrape target: a bearer METRICS_TOKEN, or a staff session."""
+    token = settings.METRICS_TOKEN
+    authorized = token and request.headers.get('Authorization') == f'Bearer {token}'
+    if not (authorized or (request.user.is_authenticated and request.user.is_staff)):
+        raise Http404
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+REQUEST_LATENCY = registry.histogram(
+    'http_request_duration_seconds', 'Request latency by view', ('view', 'method', 'status'),
+)
+REQUEST_DB_TIME = registry.histogram(
+    'http_request_db_seconds', 'Database time per request by view', ('view',),
+)
+REQUEST_QUERIES = registry.histogram(
+    'http_request_queries', 'SQL statements per request by view', ('view',), buckets=QUERY_BUCKETS,
+)
+CACHE_REQUESTS = registry.counter(
+    'cache_requests_total', 'Application cache lookups by cache and result (hit/miss)', ('cache', 'result'),
+)
+PUSH_NOTIFICATIONS = registry.counter(
+    'push_notifications_total', 'Push messages by result (sent/failed/invalid/skipped)', ('result',),
+)
+WAAS_LATENCY = registry.histogram(
+    'waas_request_duration_seconds', 'WaaS provider calls, retries included, by endpoint and outcome',
+    ('method', 'endpoint', 'outcome'),
+)
+WALLET_TRANSACTIONS = registry.counter(
+    'wallet_transaction_writes_total', 'Wallet transaction rows written, by type and resulting status',
+    ('type', 'status'),
+)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def record_transaction_writes(transactions):
+    for transaction in transactions:
+        WALLET_TRANSACTIONS.inc(type=transaction.transaction_type, status=transaction.status)
@@ -0,0 +1,116 @@
+"""
+Per-request SQL instrumentation.
+
+QueryInstrumentationMiddleware times every statement a request runs
+(through a connection execute wrapper, so nothing is kept but counters,
+the statements that repeat and the few slowest ones). Each response gets a
+`Server-Timing` header with the query count and database time. Requests
+over the SQL_LOG_* thresholds are logged to the `core.sql` logger as one
+JSON object, with the duplicated statements (N+1 candidates) and the
+slowest ones.
+"""
+import heapq
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('core.sql')
+
+# Collapse IN lists and VALUES rows so "IN (%s, %s)" and "IN (%s)" match
+_PLACEHOLDER_LIST_RE = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_VALUES_ROWS_RE = re.compile(r'(\(\.\.\.\)\s*,\s*)+\(\.\.\.\)')
+
+
+def fingerprint(sql):
+    sql = _PLACEHOLDER_LIST_RE.sub('(...)', sql)
+    return _VALUES_ROWS_RE.sub('(...)', sql)
+
+
+class QueryStats:
+    """Counters for one request; also callable as a connection execute wrapper."""
+
+    def __init__(self, keep_slowest=3):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        self.keep_slowest = keep_slowest
+        self._slowest = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            self.statements[sql] += 1
+            if len(self._slowest) < self.keep_slowest:
+                heapq.heappush(self._slowest, (elapsed, self.count, sql))
+            elif elapsed > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, (elapsed, self.count, sql))
+
+    @property
+    def slowest(self):
+        """[(seconds, sql)], slowest first."""
+        return [(elapsed, sql) for elapsed, _, sql in sorted(self._slowest, reverse=True)]
+
+    def duplicates(self, minimum=2):
+        """{fingerprint: executions} for statements run at least `minimum` times."""
+        grouped = Counter()
+        for sql, count in self.statements.items():
+            grouped[fingerprint(sql)] += count
+        return {sql: count for sql, count in grouped.most_common() if count >= minimum}
+
+
+class QueryInstrumentationMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.SQL_INSTRUMENTATION_ENABLED:
+            return self.get_response(request)
+
+        stats = QueryStats(keep_slowest=settings.SQL_SLOWEST_STATEMENTS)
+        request.sql_stats = stats
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+
+        duplicates = stats.duplicates(minimum=settings.SQL_LOG_DUPLICATE_COUNT)
+        timing = (
+            f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries", '
+            f'app;dur={(total - stats.duration) * 1000:.1f}'
+        )
+        if response.has_header('Server-Timing'):
+            timing = f"{response['Server-Timing']}, {timing}"
+        response['Server-Timing'] = timing
+
+        slow = [(elapsed, sql) for elapsed, sql in stats.slowest if elapsed * 1000 >= settings.SQL_SLOW_QUERY_MS]
+        if (stats.count > settings.SQL_LOG_QUERY_COUNT
+                or stats.duration * 1000 > settings.SQL_LOG_DB_TIME_MS
+                or duplicates or slow):
+            match = request.resolver_match
+            logger.warning(json.dumps({
+                'event': 'sql_budget_exceeded',
+                'method': request.method,
+                'path': request.path,
+                'view': match.view_name if match else None,
+                'status': response.status_code,
+                'queries': stats.count,
+                'db_ms': round(stats.duration * 1000, 1),
+                'total_ms': round(total * 1000, 1),
+                'duplicates': [{'count': count, 'sql': sql[:500]} for sql, count in list(duplicates.items())[:5]],
+                'slowest': [{'ms': round(elapsed * 1000, 1), 'sql': sql[:500]} for elapsed, sql in stats.slowest],
+            }))
+        return response
@@ -0,0 +1,216 @@
+"""
+On-demand profiling of a single request, for staff.
+
+A staff user adds `?_profile=1` to a URL (or sends `X-Profile: 1`) and
+RequestProfilingMiddleware runs that one request under cProfile and
+tracemalloc. The SQL it runs and the templates it renders are timed too.
+The result is saved under REQUEST_PROFILE_DIR as `<id>.prof` (a pstats
+dump for snakeviz/pstats) and `<id>.json` (the summary: hottest functions,
+largest allocations, SQL and template timings). The response carries the
+id and the download URL in `X-Profile-Id` / `X-Profile-URL`.
+
+Requests without the flag only pay for the flag lookup. Template timing
+wraps Template.render while at least one profile is running, and only
+records for the profiled thread. tracemalloc is process-wide, so
+allocations from other threads running at the same time are included.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import FileResponse, Http404, JsonResponse
+from django.template.base import Template
+from django.urls import reverse
+
+from .middleware import QueryStats
+
+PROFILE_QUERY_PARAM = '_profile'
+PROFILE_HEADER = 'X-Profile'
+
+_local = threading.local()
+_lock = threading.Lock()
+_running = 0
+_started_tracemalloc = False
+_original_render = Template.render
+
+
+def _timed_render(self, context):
+    recorder = getattr(_local, 'templates', None)
+    if recorder is None:
+        return _original_render(self, context)
+    started = time.perf_counter()
+    try:
+        return _original_render(self, context)
+    finally:
+        name = (self.origin.template_name if self.origin else None) or self.name or '<string>'
+        entry = recorder[name]
+        entry[0] += 1
+        entry[1] += time.perf_counter() - started
+
+
+def _start_tracing():
+    """Install the template timer and tracemalloc for the first running profile."""
+    global _running, _started_tracemalloc
+    with _lock:
+        if _running == 0:
+            Template.render = _timed_render
+            # Leave tracing alone if it was already on (PYTHONTRACEMALLOC)
+            _started_tracemalloc = not tracemalloc.is_tracing()
+            if _started_tracemalloc:
+                tracemalloc.start()
+        _running += 1
+
+
+def _stop_tracing():
+    global _running
+    with _lock:
+        _running -= 1
+        if _running == 0:
+            Template.render = _original_render
+            if _started_tracemalloc:
+                tracemalloc.stop()
+
+
+def _staff_user(request):
+    """The session user, or the API token's user, if they are staff."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user if user.is_staff else None
+    from rest_framework.authentication import TokenAuthentication
+    from rest_framework.exceptions import AuthenticationFailed
+    try:
+        authenticated = TokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    if authenticated and authenticated[0].is_staff:
+        return authenticated[0]
+    return None
+
+
+def _profile_path(profile_id, extension):
+    # Ids are generated here, but they come back in the download URL
+    if not profile_id.isalnum():
+        raise Http404
+    return os.path.join(settings.REQUEST_PROFILE_DIR, f'{profile_id}.{extension}')
+
+
+def _prune(directory, keep):
+    profiles = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith('.json')),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in profiles[:max(len(profiles) - keep, 0)]:
+        for extension in ('json', 'prof'):
+            try:
+                os.remove(os.path.join(directory, f'{entry.name[:-5]}.{extension}'))
+            except FileNotFoundError:
+                pass
+
+
+class RequestProfilingMiddleware:
+    """Must come after AuthenticationMiddleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if (PROFILE_QUERY_PARAM not in request.GET and PROFILE_HEADER not in request.headers) \
+                or not settings.REQUEST_PROFILING_ENABLED:
+            return self.get_response(request)
+        user = _staff_user(request)
+        if user is None:
+            return self.get_response(request)
+        return self._profile(request, user)
+
+    def _profile(self, request, user):
+        stats = QueryStats(keep_slowest=settings.REQUEST_PROFILE_TOP)
+        templates = defaultdict(lambda: [0, 0.0])
+        profiler = cProfile.Profile()
+
+        _start_tracing()
+        _local.templates = templates
+        try:
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+            before = tracemalloc.take_snapshot()
+            started = time.perf_counter()
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = profiler.runcall(self.get_response, request)
+            total = time.perf_counter() - started
+            memory_after, memory_peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+        finally:
+            _local.templates = None
+            _stop_tracing()
+
+        profile_id = uuid.uuid4().hex
+        os.makedirs(settings.REQUEST_PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(_profile_path(profile_id, 'prof'))
+
+        top = settings.REQUEST_PROFILE_TOP
+        functions = io.StringIO()
+        pstats.Stats(profiler, stream=functions).sort_stats('cumulative').print_stats(top)
+        match = request.resolver_match
+        summary = {
+            'id': profile_id,
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'user': user.pk,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'sql': {
+                'queries': stats.count,
+                'db_ms': round(stats.duration * 1000, 1),
+                'duplicates': [{'count': count, 'sql': sql} for sql, count in stats.duplicates().items()][:top],
+                'slowest': [{'ms': round(elapsed * 1000, 1), 'sql': sql} for elapsed, sql in stats.slowest],
+            },
+            'templates': [
+                {'name': name, 'renders': renders, 'ms': round(seconds * 1000, 1)}
+                for name, (renders, seconds) in sorted(templates.items(), key=lambda item: -item[1][1])
+            ],
+            'memory': {
+                'allocated_kb': round((memory_after - memory_before) / 1024, 1),
+                'peak_kb': round((memory_peak - memory_before) / 1024, 1),
+                'top': [
+                    {'where': str(diff.traceback), 'size_kb': round(diff.size_diff / 1024, 1), 'count': diff.count_diff}
+                    for diff in after.compare_to(before, 'lineno')[:top]
+                ],
+            },
+            'functions': functions.getvalue(),
+        }
+        with open(_profile_path(profile_id, 'json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+        _prune(settings.REQUEST_PROFILE_DIR, settings.REQUEST_PROFILE_KEEP)
+
+        response['X-Profile-Id'] = profile_id
+        response['X-Profile-URL'] = reverse('request_profile', args=[profile_id])
+        return response
+
+
+def profile_download(request, profile_id):
+    """The saved summary (JSON), or the pstats dump with ?format=prof. Staff only."""
+    if _staff_user(request) is None:
+        raise Http404
+    if request.GET.get('format') == 'prof':
+        path = _profile_path(profile_id, 'prof')
+        if not os.path.exists(path):
+            raise Http404
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{profile_id}.prof')
+    try:
+        with open(_profile_path(profile_id, 'json')) as f:
+            return JsonResponse(json.load(f))
+    except FileNotFoundError:
+        raise Http404
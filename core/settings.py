@@ -1,4 +1,5 @@
 from pathlib import Path,os
+import tempfile
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -31,6 +32,7 @@ INSTALLED_APPS = [
     'rest_framework.authtoken',
     'corsheaders',
     'api_v1',
+    'core',  # management commands (benchmark)
     
     'allauth',
     'allauth.account',
@@ -48,13 +50,17 @@ AUTH_USER_MODEL = 'user.CustomUser'
 TAILWIND_APP_NAME = "theme"
 
 MIDDLEWARE = [
+    'core.tracing.TracingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.metrics.MetricsMiddleware',
+    'core.middleware.QueryInstrumentationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     "allauth.account.middleware.AccountMiddleware",
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.profiling.RequestProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     # Add the Allauth middleware here:
@@ -96,6 +102,27 @@ DATABASES ={
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Development and test settings (deployments run on Postgres, see
+        # core.deployment). Several local workers, or the concurrency tests
+        # in wallet.tests, write to this file at once, and the ledger
+        # serialises money movement by locking wallet rows with an UPDATE
+        # (wallet.ledger.lock_wallet).
+        'OPTIONS': {
+            # Seconds a writer waits for the database lock before failing
+            'timeout': 20,
+            # Take the write lock when a transaction starts: a deferred
+            # transaction that reads first fails with "database is locked"
+            # at once (the timeout does not apply) when another worker is
+            # writing, turning concurrent payments into 500s.
+            'transaction_mode': 'IMMEDIATE',
+            # Readers no longer block the writer (and vice versa)
+            'init_command': 'PRAGMA journal_mode=WAL;',
+        },
+        # Tests run on a file so wallet.tests can run concurrent workers;
+        # TEST_DATABASE_NAME=:memory: trades that test for speed
+        'TEST': {'NAME': os.environ.get(
+            'TEST_DATABASE_NAME', os.path.join(tempfile.gettempdir(), f'komunity-test-{os.getpid()}.sqlite3')
+        )},
     }
 }
 
@@ -144,6 +171,106 @@ LOGOUT_URL = 'account_logout'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploaded media is stored once per unique content (see chema.storage)
+STORAGES = {
+    'default': {
+        'BACKEND': 'chema.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+MEDIA_GC_GRACE_HOURS = 24
+
+# Resumable chunked uploads (large post videos)
+CHUNKED_UPLOAD_DIR = os.path.join(MEDIA_ROOT, 'uploads_partial')
+CHUNKED_UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024  # 2 GB
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = 16 * 1024 * 1024  # 16 MB
+CHUNKED_UPLOAD_EXPIRY_HOURS = 24
+
+# Media serving (chema.views.serve_media)
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24 * 30  # 30 days
+# Set to an internal nginx location (e.g. '/protected-media/') to hand the
+# file transfer to the front-end server via X-Accel-Redirect.
+MEDIA_ACCEL_REDIRECT_PREFIX = None
+
+# WaaS provider client (wallet.waas). Leave WAAS_BASE_URL empty to use the
+# in-process fake provider.
+WAAS_BASE_URL = os.environ.get('WAAS_BASE_URL', '')
+WAAS_API_KEY = os.environ.get('WAAS_API_KEY', '')
+WAAS_CONNECT_TIMEOUT = 2  # seconds
+WAAS_READ_TIMEOUT = 5  # seconds
+WAAS_MAX_RETRIES = 2
+WAAS_RETRY_BACKOFF = 0.2  # seconds, doubled per attempt (with jitter)
+WAAS_POOL_SIZE = 20
+WAAS_BREAKER_THRESHOLD = 5  # consecutive failures before failing fast
+WAAS_BREAKER_RESET_SECONDS = 30
+# 'sync' calls the provider inside the request; 'async' records a PENDING
+# intent and settles it later (wallet.settlement, manage.py settle_transactions)
+WAAS_SETTLEMENT_MODE = os.environ.get('WAAS_SETTLEMENT_MODE', 'sync')
+WAAS_WEBHOOK_SECRET = os.environ.get('WAAS_WEBHOOK_SECRET', '')
+WAAS_WEBHOOK_TOLERANCE_SECONDS = 300
+WAAS_POLL_AFTER_SECONDS = 60  # poll transactions no webhook has settled by then
+
+# Cache backend. Local memory (per process) unless CACHE_URL names a shared
+# one: redis://host:6379/0 (needs the redis package) or file:///path/to/dir
+CACHE_URL = os.environ.get('CACHE_URL', '')
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': CACHE_URL}}
+elif CACHE_URL.startswith('file://'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                          'LOCATION': CACHE_URL[len('file://'):]}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'komunity'}}
+CACHES['default']['KEY_PREFIX'] = 'komunity'
+
+# Version-keyed application cache (core.cache): group admins, campaign totals,
+# member choices, contacts, the group catalogue. Entries are never served stale; the timeout only bounds memory.
+APP_CACHE_TIMEOUT = 60 * 60
+
+# Per-request SQL instrumentation (core.middleware): Server-Timing header on
+# every response; requests over these thresholds are logged to 'core.sql'
+SQL_INSTRUMENTATION_ENABLED = True
+SQL_LOG_QUERY_COUNT = 50
+SQL_LOG_DB_TIME_MS = 200
+SQL_LOG_DUPLICATE_COUNT = 10  # the same statement run this often is likely an N+1
+SQL_SLOW_QUERY_MS = 100
+SQL_SLOWEST_STATEMENTS = 3
+
+# On-demand profiling of one request by a staff user (core.profiling):
+# ?_profile=1 or an X-Profile header. Several instances need a shared directory.
+REQUEST_PROFILING_ENABLED = True
+REQUEST_PROFILE_DIR = os.path.join(BASE_DIR, 'request_profiles')
+REQUEST_PROFILE_KEEP = 50  # older profiles are deleted
+REQUEST_PROFILE_TOP = 30  # functions, allocations and statements listed in the summary
+
+# Metrics registry and /metrics endpoint (core.metrics). With more than one
+# worker set METRICS_MULTIPROC_DIR, or each scrape sees a single worker;
+# use a directory emptied on every server start.
+METRICS_ENABLED = True
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')  # scrapers send "Authorization: Bearer <token>"
+METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR', '')
+METRICS_FLUSH_SECONDS = 5
+
+# Request tracing (core.tracing). Every response carries X-Trace-Id; sampled
+# requests (TRACING_SAMPLE_RATE, or an incoming sampled traceparent from a
+# caller sending "X-Tracing-Token: <TRACING_TOKEN>") record spans, exported
+# as Zipkin v2 JSON to TRACING_FILE and/or TRACING_COLLECTOR_URL
+# (e.g. http://zipkin:9411/api/v2/spans).
+TRACING_ENABLED = True
+TRACING_SAMPLE_RATE = float(os.environ.get('TRACING_SAMPLE_RATE', '0'))
+TRACING_FILE = os.environ.get('TRACING_FILE', '')
+TRACING_COLLECTOR_URL = os.environ.get('TRACING_COLLECTOR_URL', '')
+TRACING_TOKEN = os.environ.get('TRACING_TOKEN', '')
+TRACING_SERVICE_NAME = 'komunity'
+TRACING_MAX_SPANS = 1000  # per trace; further spans are counted, not kept
+
+# Idempotency-Key replay window for money-moving API calls (api_v1.idempotency)
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+# A key whose request never finished (worker killed mid-request) can be
+# claimed again after this long; keep it above the worker timeout
+IDEMPOTENCY_LEASE_SECONDS = 60
+
 CRISPY_ALLOWED_TEMPLATE_PACKS = "tailwind"
 CRISPY_TEMPLATE_PACK = 'tailwind'
 
@@ -0,0 +1,230 @@
+"""
+Query-budget testing support.
+
+`QueryBudgetTestCase` seeds a medium-sized dataset around one user ("me":
+admin of a group with members, posts, comments, campaigns, contributions,
+wallet history and notifications). `assert_budget` requests a route, checks
+its query count and response time against the pinned budget, then grows
+every collection the route could iterate over and requests it again: the
+count must not change. A budget therefore holds for any page or group size,
+and an N+1 in a view or serializer fails the test.
+
+The dataset itself (seed_dataset, grow_dataset) is also what
+`manage.py benchmark` (core.benchmark) runs its journeys against.
+"""
+import os
+import shutil
+import tempfile
+import time
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from chema.models import Comment, Dependent, Group, GroupMembership, Post, Reply
+from condolence.models import Contribution, Deceased
+from user.models import CustomUser, DeviceToken, Notification
+from wallet.models import Transaction
+
+# Every list is grown past the largest page size (StandardPagination: 50)
+GROWTH = 55
+DEFAULT_MAX_MS = 500
+
+
+def make_group(**fields):
+    """Create a Group without Group.save, which picks a cover image from STATIC_ROOT."""
+    return Group.objects.bulk_create([Group(**fields)])[0]
+
+
+def seed_dataset(data, size=5):
+    """
+    Seed the dataset onto `data` (any object: a test class, a namespace):
+    me, profile, group, other_group, deceased_profile, campaign, then
+    grow_dataset(data, size) and the picked post, comment, reply, member
+    and contribution.
+    """
+    data.me = CustomUser.objects.create_user(email='me@budget.test', is_active=True)
+    data.profile = data.me.profile
+    data.profile.first_name, data.profile.surname = 'Budget', 'Owner'
+    data.profile.save()
+
+    data.group = make_group(name='Budget group', creator=data.me, admin=data.profile,
+                            external_wallet_id='group_wallet_budget')
+    data.other_group = make_group(name='Other group', external_wallet_id='group_wallet_other')
+    data.group.admins.add(data.me)
+    GroupMembership.objects.bulk_create([
+        GroupMembership(group=data.group, member=data.profile, status='active', role='admin',
+                        is_admin=True, is_active=True),
+        GroupMembership(group=data.other_group, member=data.profile, status='active'),
+    ])
+
+    data.deceased_profile = CustomUser.objects.create_user(email='late@budget.test').profile
+    GroupMembership.objects.create(group=data.group, member=data.deceased_profile, status='active',
+                                   is_deceased=True)
+    data.campaign = Deceased.objects.create(
+        deceased=data.deceased_profile, group=data.group, group_admin=data.profile, beneficiary=data.profile
+    )
+    Transaction.objects.create(wallet=data.me.wallet, transaction_type='TOP_UP', amount=Decimal('500.00'),
+                               status='COMPLETED')
+    grow_dataset(data, size)
+
+    data.post = Post.objects.filter(group=data.group).order_by('pk').first()
+    data.comment = Comment.objects.filter(post=data.post).order_by('pk').first()
+    data.reply = Reply.objects.filter(comment=data.comment).order_by('pk').first()
+    data.member = GroupMembership.objects.filter(group=data.group, role='member').order_by('pk').first()
+    data.contribution = Contribution.objects.filter(deceased_member=data.campaign).order_by('pk').first()
+
+
+def grow_dataset(data, count=GROWTH):
+    """Add `count` more of everything hanging off the seeded user and group."""
+    start = CustomUser.objects.count()
+    users = [
+        CustomUser.objects.create_user(email=f'member{start + i}@budget.test', is_active=True)
+        for i in range(count)
+    ]
+    profiles = [user.profile for user in users]
+    GroupMembership.objects.bulk_create(
+        [GroupMembership(group=data.group, member=profile, status='active') for profile in profiles]
+        + [GroupMembership(group=data.other_group, member=profile, status='active') for profile in profiles]
+    )
+    groups = Group.objects.bulk_create([
+        Group(name=f'Group {start + i}', external_wallet_id=f'group_wallet_{start + i}') for i in range(count)
+    ])
+    GroupMembership.objects.bulk_create([
+        GroupMembership(group=group, member=data.profile, status='active') for group in groups
+    ])
+    Deceased.objects.bulk_create([
+        Deceased(deceased=profiles[0], group=data.group, group_admin=data.profile, beneficiary=data.profile)
+    ])
+    posts = Post.objects.bulk_create([
+        Post(group=data.group, author=profile, content=f'Post by {profile.pk}') for profile in profiles
+    ] + [Post(group=data.group, author=data.profile, content=f'Update {start + i}') for i in range(count)])
+    for post in posts[:count]:
+        post.likes.add(data.profile)
+    comments = Comment.objects.bulk_create(
+        [Comment(post=post, author=profile, content='Comment') for post, profile in zip(posts, profiles)]
+        + [Comment(post=posts[count], author=profile, content='Comment') for profile in profiles]
+    )
+    Reply.objects.bulk_create([Reply(comment=comment, author=data.profile, content='Reply') for comment in comments])
+    Dependent.objects.bulk_create([
+        Dependent(guardian=data.profile, group=data.group, name=f'Dependent {start + i}',
+                  date_of_birth=date(2010, 1, 1), relationship='child')
+        for i in range(count)
+    ])
+
+    transfers = Transaction.objects.bulk_create([
+        Transaction(wallet=user.wallet, transaction_type='TOP_UP', amount=Decimal('100.00'), status='COMPLETED')
+        for user in users
+    ] + [
+        Transaction(wallet=user.wallet, transaction_type='TRANSFER', amount=Decimal('20.00'), status='COMPLETED',
+                    destination_group=data.group, deceased_contribution=data.campaign)
+        for user in users
+    ])[count:]
+    Contribution.objects.bulk_create([
+        Contribution(group=data.group, deceased_member=data.campaign, contributing_member=profile,
+                     amount=Decimal('20.00'), payment_method='wallet', transaction=transfer)
+        for profile, transfer in zip(profiles, transfers)
+    ])
+    Transaction.objects.bulk_create([
+        Transaction(wallet=data.me.wallet, transaction_type='P2P_SENT', amount=Decimal('1.00'),
+                    status='COMPLETED', recipient_wallet=user.wallet)
+        for user in users
+    ])
+    Notification.objects.bulk_create([
+        Notification(recipient=data.me, title='Notice', message=f'Notice {start + i}') for i in range(count)
+    ])
+    DeviceToken.objects.bulk_create([
+        DeviceToken(user=data.me, token=f'token-{start + i}', platform='android') for i in range(count)
+    ])
+
+
+class TemporaryMediaMixin:
+    """
+    Point MEDIA_ROOT and CHUNKED_UPLOAD_DIR at a fresh directory for the
+    test class and remove it afterwards, so uploads never land in the checkout.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp(prefix='komunity-media-')
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(
+            MEDIA_ROOT=media_root, CHUNKED_UPLOAD_DIR=os.path.join(media_root, 'uploads_partial')
+        )
+        media_settings.enable()
+        cls.addClassCleanup(media_settings.disable)
+        super().setUpClass()
+
+
+class QueryBudgetTestCase(TemporaryMediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset(cls)
+
+    def setUp(self):
+        # A fresh in-process WaaS provider per test: rolled-back transaction ids
+        # are reused, and the provider would replay earlier idempotent answers
+        patcher = mock.patch('wallet.waas._client', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def grow(self, count=GROWTH):
+        grow_dataset(self, count)
+
+    def api_client(self):
+        client = APIClient()
+        client.force_authenticate(self.me)
+        return client
+
+    def html_client(self):
+        client = Client()
+        client.force_login(self.me)
+        session = client.session
+        session['active_group_id'] = self.group.id
+        session.save()
+        return client
+
+    def _request(self, client, method, url, data, extra):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            # Run what the request deferred to commit (sync change events) and count it
+            with self.captureOnCommitCallbacks(execute=True):
+                response = getattr(client, method.lower())(url, data, **extra)
+            elapsed = (time.perf_counter() - started) * 1000
+        return response, len(queries), elapsed, queries
+
+    def assert_budget(self, url, max_queries, method='GET', data=None, client=None, max_ms=DEFAULT_MAX_MS,
+                      status=None, scales=True, headers=None):
+        """
+        Request `url` and assert it runs at most `max_queries` queries within
+        `max_ms`. With `scales`, repeat after grow() and assert the same count.
+        API requests send `data` as JSON; `headers` are passed as WSGI environ
+        keys (HTTP_HX_REQUEST=...).
+        """
+        extra = dict(headers or {})
+        if client is None:
+            client = self.api_client()
+            extra.setdefault('format', 'json')
+        response, count, elapsed, queries = self._request(client, method, url, data, extra)
+        if status is not None:
+            self.assertEqual(response.status_code, status, f"{method} {url}")
+        else:
+            self.assertLess(response.status_code, 500, f"{method} {url}")
+        sql = '\n'.join(query['sql'] for query in queries.captured_queries)
+        self.assertLessEqual(count, max_queries, f"{method} {url} ran {count} queries:\n{sql}")
+        self.assertLessEqual(elapsed, max_ms, f"{method} {url} took {elapsed:.0f}ms")
+
+        if scales:
+            self.grow()
+            _, grown, _, queries = self._request(client, method, url, data, extra)
+            sql = '\n'.join(query['sql'] for query in queries.captured_queries)
+            self.assertEqual(grown, count, f"{method} {url} went from {count} to {grown} queries "
+                                           f"as the data grew:\n{sql}")
+        return response
@@ -0,0 +1,302 @@
+"""
+Lightweight request tracing.
+
+TracingMiddleware gives every request a trace id (taken from an incoming
+W3C `traceparent` header, or new) and returns it in `X-Trace-Id` and
+`traceparent`. A sampled request is recorded as a tree of timed spans:
+the request itself, every SQL statement, every template render, and the
+spans opened with `span()` / `traced()` around cache lookups, wallet
+debits, push dispatch and WaaS calls. WaaS HTTP calls carry the
+traceparent onwards.
+
+Requests are sampled at TRACING_SAMPLE_RATE, or when the incoming
+traceparent says so and the caller sends TRACING_TOKEN in `X-Tracing-Token`
+(otherwise any client could force full recording and export). Other
+callers' trace ids are still continued. A finished trace is exported in Zipkin v2 JSON: as
+one line per trace to TRACING_FILE, and/or POSTed to
+TRACING_COLLECTOR_URL (Zipkin, Jaeger, or an OpenTelemetry collector's
+zipkin receiver) by a background thread. Outside a sampled request,
+`span()` costs one context variable lookup.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Template
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+TRACING_TOKEN_HEADER = 'X-Tracing-Token'
+# Statement text kept on a db span
+MAX_STATEMENT_LENGTH = 1000
+
+_current = contextvars.ContextVar('current_span', default=None)
+
+
+def _new_id(nbytes):
+    return os.urandom(nbytes).hex()
+
+
+class Trace:
+    """The spans of one request, in the order they finished."""
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.root = None
+        self.spans = []
+        self.dropped = 0
+
+    def add(self, finished):
+        # The root finishes last: keep a slot for it so a capped trace still has its parent
+        if finished is self.root or len(self.spans) < settings.TRACING_MAX_SPANS - 1:
+            self.spans.append(finished)
+        else:
+            self.dropped += 1
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'kind', 'attributes', 'started', '_start', 'duration')
+
+    def __init__(self, trace, name, parent_id=None, kind=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+        self.trace.add(self)
+
+    def to_zipkin(self):
+        data = {
+            'traceId': self.trace.trace_id,
+            'id': self.span_id,
+            'name': self.name,
+            'timestamp': int(self.started * 1_000_000),
+            'duration': max(int(self.duration * 1_000_000), 1),
+            'localEndpoint': {'serviceName': settings.TRACING_SERVICE_NAME},
+            'tags': {key: str(value) for key, value in self.attributes.items() if value is not None},
+        }
+        if self.parent_id:
+            data['parentId'] = self.parent_id
+        if self.kind:
+            data['kind'] = self.kind
+        return data
+
+
+class _NullSpan:
+    """What span() yields outside a sampled request."""
+
+    def set(self, **attributes):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+@contextmanager
+def span(name, kind=None, **attributes):
+    """Time the block as a child of the current span; yields the span (or NULL_SPAN)."""
+    parent = _current.get()
+    if parent is None:
+        yield NULL_SPAN
+        return
+    child = Span(parent.trace, name, parent_id=parent.span_id, kind=kind, attributes=attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as exc:
+        child.attributes['error'] = f'{type(exc).__name__}: {exc}'
+        raise
+    finally:
+        _current.reset(token)
+        child.finish()
+
+
+def traced(name):
+    """Decorator form of span()."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def current_traceparent():
+    """The traceparent header for an outgoing call, or None outside a sampled request."""
+    current = _current.get()
+    if current is None:
+        return None
+    return f'00-{current.trace.trace_id}-{current.span_id}-01'
+
+
+# --- SQL and templates ---
+
+def _trace_query(execute, sql, params, many, context):
+    with span('db.query', kind='CLIENT', **{'db.statement': sql[:MAX_STATEMENT_LENGTH], 'db.many': many or None}):
+        return execute(sql, params, many, context)
+
+
+_original_render = Template._render
+
+
+def _traced_render(self, context):
+    if _current.get() is None:
+        return _original_render(self, context)
+    name = (self.origin.template_name if self.origin else None) or self.name or '<string>'
+    with span('template.render', template=name):
+        return _original_render(self, context)
+
+
+# _render rather than render: it also covers {% extends %} parents, and
+# core.profiling swaps render itself while a profile runs
+Template._render = _traced_render
+
+
+# --- Export ---
+
+class _Exporter:
+    """Appends traces to TRACING_FILE and queues them for TRACING_COLLECTOR_URL."""
+
+    def __init__(self):
+        self.file_lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=1000)
+        self.thread = None
+        self.thread_lock = threading.Lock()
+
+    def export(self, spans):
+        if settings.TRACING_FILE:
+            line = json.dumps(spans)
+            with self.file_lock, open(settings.TRACING_FILE, 'a') as f:
+                f.write(line + '\n')
+        if settings.TRACING_COLLECTOR_URL:
+            self._ensure_thread()
+            try:
+                self.queue.put_nowait(spans)
+            except queue.Full:
+                logger.warning('Trace export queue full; dropping a trace')
+
+    def _ensure_thread(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.thread_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        import requests
+        session = requests.Session()
+        while True:
+            batch = [self.queue.get()]
+            # Whatever else is waiting goes in the same POST
+            while len(batch) < 50:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                session.post(settings.TRACING_COLLECTOR_URL, json=[s for spans in batch for s in spans], timeout=5)
+            except requests.RequestException as exc:
+                logger.warning('Trace export to %s failed: %s', settings.TRACING_COLLECTOR_URL, exc)
+
+
+exporter = _Exporter()
+
+
+# --- Middleware ---
+
+def _incoming(request):
+    """
+    (trace_id, parent span id, sampled) from a valid traceparent header, else
+    (None, None, False). The sampled flag only counts from trusted callers.
+    """
+    match = TRACEPARENT_RE.match(request.headers.get('traceparent', ''))
+    if match is None or match.group(1) == '0' * 32:
+        return None, None, False
+    sampled = bool(int(match.group(3), 16) & 1) and _trusted(request)
+    return match.group(1), match.group(2), sampled
+
+
+def _trusted(request):
+    token = settings.TRACING_TOKEN
+    return bool(token) and request.headers.get(TRACING_TOKEN_HEADER) == token
+
+
+class TracingMiddleware:
+    """Put it first so the request span covers the other middleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.TRACING_ENABLED:
+            return self.get_response(request)
+        trace_id, parent_id, sampled = _incoming(request)
+        trace_id = trace_id or _new_id(16)
+        sampled = sampled or random.random() < settings.TRACING_SAMPLE_RATE
+        if not sampled:
+            response = self.get_response(request)
+            response['X-Trace-Id'] = trace_id
+            return response
+
+        trace = Trace(trace_id)
+        root = trace.root = Span(trace, request.method, parent_id=parent_id, kind='SERVER',
+                                 attributes={'http.method': request.method, 'http.path': request.path})
+        token = _current.set(root)
+        try:
+            with _wrap_connections():
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        match = request.resolver_match
+        root.name = f'{request.method} {match.view_name if match else "<unresolved>"}'
+        user = getattr(request, 'user', None)
+        root.set(**{
+            'http.status_code': response.status_code,
+            'user.id': user.pk if user is not None and user.is_authenticated else None,
+        })
+        root.finish()
+        if trace.dropped:
+            root.set(dropped_spans=trace.dropped)
+        exporter.export([finished.to_zipkin() for finished in trace.spans])
+
+        response['X-Trace-Id'] = trace_id
+        response['traceparent'] = f'00-{trace_id}-{root.span_id}-01'
+        return response
+
+
+@contextmanager
+def _wrap_connections():
+    wrappers = [connection.execute_wrapper(_trace_query) for connection in connections.all()]
+    for wrapper in wrappers:
+        wrapper.__enter__()
+    try:
+        yield
+    finally:
+        for wrapper in reversed(wrappers):
+            wrapper.__exit__(None, None, None)
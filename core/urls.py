@@ -1,15 +1,22 @@
 
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf.urls.static import static
 from django.conf import settings
 from django.views.generic.base import RedirectView
+from chema.views import serve_media
+from core.metrics import metrics_view
+from core.profiling import profile_download
 
 urlpatterns = [
     path('favicon.ico', RedirectView.as_view(url=settings.STATIC_URL + 'images/favicon.png')),
     path('admin/', admin.site.urls),
+    # Uploaded media: Range requests, conditional GET and group permission checks
+    re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), serve_media, name='serve_media'),
     path('accounts/', include('allauth.urls')),
     path("__reload__/", include("django_browser_reload.urls")),
+    path('_profiles/<str:profile_id>/', profile_download, name='request_profile'),
+    path('metrics', metrics_view, name='metrics'),
     path('', include('chema.urls')),
     path('', include('user.urls')),
     path('', include('condolence.urls')),
@@ -20,5 +27,4 @@ urlpatterns = [
 ]
 
 if settings.DEBUG:
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
@@ -5,45 +5,83 @@ except ImportError:
     PushMessage = None
     print("Warning: exponent_server_sdk not found or failed to import. Push notifications will be disabled.")
 from django.conf import settings
+
+from core.metrics import PUSH_NOTIFICATIONS
+from core.tracing import span, traced
+
 from .models import DeviceToken, Notification
 
 def send_push_notification(user, title, message, data=None, notification_type=None):
     """
     Send push notification to a user's devices and store it in DB.
     """
+    send_push_notifications([user], title, message, data=data, notification_type=notification_type)
+
+
+@traced('push.send')
+def send_push_notifications(users, title, message, data=None, notification_type=None):
+    """
+    send_push_notification for several users at once: one INSERT for the
+    stored notifications, one query for the device tokens and one push
+    request per PushClient.max_message_count tokens, however many users
+    there are. Malformed tokens are deactivated instead of sent.
+    """
     if data is None:
         data = {}
+    users = list(users)
+    if not users:
+        return
 
-    # Store notification in DB
-    Notification.objects.create(
-        recipient=user,
-        title=title,
-        message=message,
-        data=data,
-        notification_type=notification_type
-    )
+    # Store notifications in DB
+    Notification.objects.bulk_create([
+        Notification(
+            recipient=user,
+            title=title,
+            message=message,
+            data=data,
+            notification_type=notification_type
+        )
+        for user in users
+    ])
 
     # Get active tokens
-    tokens = DeviceToken.objects.filter(user=user, is_active=True).values_list('token', flat=True)
+    tokens = list(
+        DeviceToken.objects.filter(user__in=users, is_active=True).values_list('pk', 'token')
+    )
     
     if not tokens:
         return
 
     if not PushClient:
         print("PushClient not available. Skipping notification.")
+        PUSH_NOTIFICATIONS.inc(len(tokens), result='skipped')
         return
 
-    try:
-        response = PushClient().publish_multiple([
-            PushMessage(to=token,
-                        title=title,
-                        body=message,
-                        data=data)
-            for token in tokens
-        ])
-    except Exception as exc:
-        # Check if "exc" has message
-        print(f"Error sending push notification: {exc}")
-        
-        # Here we could handle invalid tokens (DeviceNotRegistered)
-        # But for now basic try/except is okay.
+    # One malformed token makes PushMessage.get_payload raise for the whole
+    # request, so drop (and deactivate) those before building the messages.
+    invalid = [pk for pk, token in tokens if not PushClient.is_exponent_push_token(token)]
+    if invalid:
+        DeviceToken.objects.filter(pk__in=invalid).update(is_active=False)
+        PUSH_NOTIFICATIONS.inc(len(invalid), result='invalid')
+    tokens = [token for _, token in tokens if PushClient.is_exponent_push_token(token)]
+
+    client = PushClient()
+    for start in range(0, len(tokens), client.max_message_count):
+        chunk = tokens[start:start + client.max_message_count]
+        try:
+            with span('push.publish', kind='CLIENT', tokens=len(chunk)):
+                response = client.publish_multiple([
+                    PushMessage(to=token,
+                                title=title,
+                                body=message,
+                                data=data)
+                    for token in chunk
+                ])
+        except Exception as exc:
+            # A failed request only loses its own chunk
+            print(f"Error sending push notification: {exc}")
+            PUSH_NOTIFICATIONS.inc(len(chunk), result='failed')
+        else:
+            sent = sum(1 for ticket in response if ticket.is_success())
+            PUSH_NOTIFICATIONS.inc(sent, result='sent')
+            PUSH_NOTIFICATIONS.inc(len(response) - sent, result='failed')
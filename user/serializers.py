@@ -12,6 +12,13 @@ class ProfileSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['full_name', 'is_complete']
 
+class ProfileBriefSerializer(serializers.ModelSerializer):
+    """Name and picture only, for nesting in list rows."""
+    class Meta:
+        model = Profile
+        fields = ['id', 'full_name', 'profile_picture']
+        read_only_fields = fields
+
 class UserSerializer(serializers.ModelSerializer):
     profile = ProfileSerializer(read_only=True)
 
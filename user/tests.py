@@ -1,3 +1,79 @@
-from django.test import TestCase
+"""
+Query budgets for the user HTML routes (see core.testing) and batched push
+notifications.
 
-# Create your tests here.
+Pages are checked at two dataset sizes and must run the same number of
+queries at both. Form posts run once.
+"""
+from unittest import mock
+
+from django.test import Client, TestCase
+
+from core.testing import QueryBudgetTestCase
+
+from .models import CustomUser, DeviceToken, Notification
+from .notifications import PushClient, send_push_notifications
+
+
+class PageBudgetTests(QueryBudgetTestCase):
+
+    def get(self, url, max_queries, client=None, status=200):
+        return self.assert_budget(url, max_queries, client=client or self.html_client(), status=status)
+
+    def test_profile_create(self):
+        self.get('/profile/', 9)
+
+    def test_profile_edit_form(self):
+        self.get('/profile/edit/', 10)
+
+    def test_profile_view(self):
+        self.get('/profile/view/', 10)
+
+    def test_welcome(self):
+        self.get('/welcome/', 9)
+
+    def test_signup_form(self):
+        self.get('/signup/', 1, client=Client())
+
+    def test_verification_sent(self):
+        self.get('/verification-sent/', 1, client=Client())
+
+    def test_verify_email_unknown_token(self):
+        self.get('/verify-email/unknown/', 1, client=Client(), status=404)
+
+    def test_password_reset_form(self):
+        self.get('/password-reset/', 3, client=Client())
+
+
+class FormBudgetTests(QueryBudgetTestCase):
+
+    def test_profile_edit(self):
+        self.assert_budget('/profile/edit/', 7, method='POST', client=self.html_client(), status=302, scales=False,
+                           data={'first_name': 'Budget', 'surname': 'Owner', 'bio': 'Edited'})
+
+    def test_signup(self):
+        self.assert_budget('/signup/', 10, method='POST', client=Client(), status=302, scales=False, data={
+            'email': 'signup@budget.test', 'password1': 'a-long-budget-password', 'password2': 'a-long-budget-password',
+        })
+
+
+class PushNotificationTests(TestCase):
+
+    def setUp(self):
+        self.users = [CustomUser.objects.create_user(email=f'push{i}@push.test') for i in range(3)]
+        DeviceToken.objects.bulk_create([
+            DeviceToken(user=self.users[0], token='ExponentPushToken[first]', platform='ios'),
+            DeviceToken(user=self.users[1], token='not-an-expo-token', platform='android'),
+            DeviceToken(user=self.users[2], token='ExponentPushToken[third]', platform='android'),
+        ])
+
+    @mock.patch.object(PushClient, 'DEFAULT_MAX_MESSAGE_COUNT', 1)
+    @mock.patch.object(PushClient, 'publish_multiple')
+    def test_a_bad_token_or_chunk_only_loses_its_own_push(self, publish):
+        publish.side_effect = [ConnectionError('push service down'), [mock.Mock(is_success=lambda: True)]]
+        send_push_notifications(self.users, 'Title', 'Body')
+
+        sent = [[message.to for message in call.args[0]] for call in publish.call_args_list]
+        self.assertEqual(sorted(sent), [['ExponentPushToken[first]'], ['ExponentPushToken[third]']])
+        self.assertFalse(DeviceToken.objects.get(token='not-an-expo-token').is_active)
+        self.assertEqual(Notification.objects.filter(title='Title').count(), 3)
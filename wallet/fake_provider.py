@@ -0,0 +1,218 @@
+"""
+A local stand-in for the WaaS provider.
+
+`FakeProvider` implements the provider API in memory. It backs the WaaS
+client when no WAAS_BASE_URL is configured (development) and can be served
+over HTTP with `FakeProviderServer` (tests, `manage.py run_fake_waas`) to
+exercise timeouts, retries and the circuit breaker with injected latency
+and failures.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from decimal import Decimal
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+VOUCHERS = {
+    '12345': Decimal('100.00'),
+    '50': Decimal('50.00'),
+}
+
+BALANCE_PATH_RE = re.compile(r'^/v1/wallets/(?P<wallet_id>[^/]+)/balance$')
+TRANSACTION_PATH_RE = re.compile(r'^/v1/transactions/(?P<reference>[^/]+)$')
+
+
+class FakeProvider:
+    """
+    In-memory provider. `latency` (seconds) and `failure_rate` (0..1, answered
+    with HTTP 503) apply to every request when served over HTTP.
+
+    With `settle_async` redemptions and transfers are accepted as PENDING and
+    only reach their final status on `settle()`, which returns the webhook
+    events (`deliver_webhooks()` posts them, signed, to a URL).
+    """
+
+    def __init__(self, latency=0, failure_rate=0, vouchers=None, settle_async=False):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.vouchers = dict(VOUCHERS if vouchers is None else vouchers)
+        self.settle_async = settle_async
+        self.requests = []
+        self.transactions = {}
+        self._outcomes = {}
+        self._idempotent = {}
+        self._lock = threading.Lock()
+
+    def handle(self, method, path, body=None, idempotency_key=None):
+        """Return (status, payload) for one API call."""
+        with self._lock:
+            self.requests.append((method, path))
+            if idempotency_key and idempotency_key in self._idempotent:
+                return self._idempotent[idempotency_key]
+
+        result = self._dispatch(method, path, body or {})
+        if idempotency_key and result[0] < 500:
+            with self._lock:
+                self._idempotent[idempotency_key] = result
+        return result
+
+    def _record(self, body, status, amount, error=None):
+        """Store a transaction; in async mode its outcome waits for settle()."""
+        reference = f"waas_{uuid.uuid4().hex[:16]}"
+        outcome = {
+            'reference': reference,
+            'client_reference': body.get('client_reference'),
+            'status': status,
+            'amount': str(amount) if amount is not None else None,
+        }
+        if error:
+            outcome['error'] = error
+        with self._lock:
+            if self.settle_async:
+                self._outcomes[reference] = outcome
+                self.transactions[reference] = {**outcome, 'status': 'PENDING', 'amount': None}
+                self.transactions[reference].pop('error', None)
+            else:
+                self.transactions[reference] = outcome
+            return dict(self.transactions[reference])
+
+    def _dispatch(self, method, path, body):
+        if method == 'POST' and path == '/v1/vouchers/redeem':
+            amount = self.vouchers.get(str(body.get('pin')))
+            if amount is None:
+                if not self.settle_async:
+                    return 422, {'error': 'Invalid PIN'}
+                return 202, self._record(body, 'FAILED', None, error='Invalid PIN')
+            return (202 if self.settle_async else 200), self._record(body, 'COMPLETED', amount)
+
+        if method == 'POST' and path == '/v1/transfers':
+            amount = Decimal(str(body.get('amount', 0)))
+            if amount <= 0:
+                return 422, {'error': 'Invalid amount'}
+            return (202 if self.settle_async else 200), self._record(body, 'COMPLETED', amount)
+
+        match = BALANCE_PATH_RE.match(path)
+        if method == 'GET' and match:
+            return 200, {'wallet_id': match.group('wallet_id'), 'balance': '150.00'}
+
+        url = urlsplit(path)
+        if method == 'GET' and url.path == '/v1/statements':
+            query = parse_qs(url.query)
+            cursor = int(query.get('cursor', ['0'])[0])
+            limit = int(query.get('limit', ['1000'])[0])
+            with self._lock:
+                lines = list(self.transactions.values())[cursor:cursor + limit]
+            next_cursor = cursor + len(lines) if len(lines) == limit else None
+            return 200, {'lines': lines, 'next_cursor': next_cursor}
+
+        match = TRANSACTION_PATH_RE.match(path)
+        if method == 'GET' and match:
+            with self._lock:
+                transaction = self.transactions.get(match.group('reference'))
+            if transaction is None:
+                return 404, {'error': 'Unknown transaction'}
+            return 200, transaction
+
+        return 404, {'error': 'Not found'}
+
+    def settle(self, failed=()):
+        """
+        Give every pending transaction its final status (references listed in
+        `failed` fail instead). Returns the webhook events.
+        """
+        events = []
+        with self._lock:
+            for reference, outcome in self._outcomes.items():
+                if reference in failed:
+                    outcome = {**outcome, 'status': 'FAILED', 'error': 'Declined'}
+                self.transactions[reference] = outcome
+                events.append({'id': f"evt_{uuid.uuid4().hex[:16]}", **outcome})
+            self._outcomes = {}
+        return events
+
+    def deliver_webhooks(self, url, secret, events=None):
+        """POST (signed) settlement events to our webhook endpoint."""
+        import requests
+        from .waas import sign_webhook
+
+        body = json.dumps({'events': self.settle() if events is None else events}).encode()
+        timestamp = str(int(time.time()))
+        return requests.post(url, data=body, timeout=5, headers={
+            'Content-Type': 'application/json',
+            'X-WaaS-Timestamp': timestamp,
+            'X-WaaS-Signature': sign_webhook(secret, timestamp, body),
+        })
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def _respond(self, method):
+        provider = self.server.provider
+        if provider.latency:
+            time.sleep(provider.latency)
+        if provider.failure_rate and random.random() < provider.failure_rate:
+            status, payload = 503, {'error': 'Service unavailable'}
+        else:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+            status, payload = provider.handle(method, self.path, body, self.headers.get('Idempotency-Key'))
+
+        data = json.dumps(payload).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up (timeout); that is the point of injected latency
+            pass
+
+    def do_GET(self):
+        self._respond('GET')
+
+    def do_POST(self):
+        self._respond('POST')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeProviderServer:
+    """
+    Serve a FakeProvider on a local port in a background thread:
+
+        with FakeProviderServer(latency=0.5) as server:
+            client = WaaSClient(base_url=server.url)
+    """
+
+    def __init__(self, provider=None, host='127.0.0.1', port=0, **provider_options):
+        self.provider = provider or FakeProvider(**provider_options)
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.provider = self.provider
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
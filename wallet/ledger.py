@@ -0,0 +1,126 @@
+"""
+Race-free debits.
+
+Every view that takes money out of a wallet or a campaign goes through
+`debit_wallet` / `disburse_campaign_funds`. Each locks the row the money
+comes from, re-reads the balance under that lock and writes the debit in
+the same short transaction, so concurrent requests queue on the lock
+instead of both passing a stale balance check.
+
+The lock is taken with an UPDATE of the row's version counter rather than
+SELECT ... FOR UPDATE: an UPDATE row-locks on every backend (FOR UPDATE is a
+no-op on SQLite) and the bump is needed for the ETags anyway. Callers that
+write more rows with the debit (a Contribution, the recipient's credit)
+wrap everything in their own transaction.atomic(); the lock is then held
+until that outer block commits.
+"""
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.db.models import DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from chema.models import Group
+from condolence.models import Contribution, Deceased
+from core.tracing import traced
+
+from .models import OUTGOING_TYPES, Transaction, Wallet
+
+
+class InsufficientFunds(Exception):
+    """The wallet or campaign balance does not cover the debit."""
+
+    def __init__(self, available):
+        super().__init__(f"Insufficient balance ({available} available)")
+        self.available = available
+
+
+class DuplicateContribution(Exception):
+    """The member already paid this campaign or has a transfer to it in flight."""
+
+
+def lock_wallet(wallet_id):
+    Wallet.objects.filter(pk=wallet_id).update(version=F('version') + 1)
+
+
+def available_balance(wallet_id):
+    """Completed balance less outgoing transfers still pending."""
+    return available_balances([wallet_id])[wallet_id]
+
+
+def available_balances(wallet_ids):
+    """available_balance of several wallets in one query: {wallet id: amount}."""
+    amount = DecimalField(max_digits=12, decimal_places=2)
+    pending = Coalesce(
+        Sum('transactions__amount',
+            filter=Q(transactions__transaction_type__in=OUTGOING_TYPES, transactions__status='PENDING')),
+        Value(0),
+        output_field=amount,
+    )
+    rows = Wallet.objects.filter(pk__in=wallet_ids).with_balance().annotate(pending=pending)
+    return {pk: balance - pending for pk, balance, pending in rows.values_list('pk', 'balance', 'pending')}
+
+
+@traced('ledger.debit_wallet')
+def debit_wallet(wallet, amount, transaction_type, status=Transaction.TransactionStatus.COMPLETED, **fields):
+    """
+    Record an outgoing `transaction_type` of `amount` from `wallet`, or raise
+    InsufficientFunds. Extra `fields` are passed to the Transaction.
+    """
+    amount = Decimal(str(amount))
+    if amount <= 0:
+        raise ValueError("Debit amount must be positive")
+    with db_transaction.atomic():
+        lock_wallet(wallet.pk)
+        available = available_balance(wallet.pk)
+        if available < amount:
+            raise InsufficientFunds(available)
+        return Transaction.objects.create(
+            wallet=wallet, transaction_type=transaction_type, amount=amount, status=status, **fields
+        )
+
+
+@traced('ledger.debit_for_campaign')
+def debit_for_campaign(wallet, profile, deceased, amount, status=Transaction.TransactionStatus.COMPLETED, **fields):
+    """
+    debit_wallet for a wallet contribution to `deceased`. Raises
+    DuplicateContribution if `profile` already contributed or has an
+    unsettled transfer to it; checked under the wallet lock, so two
+    concurrent requests cannot both pay.
+    """
+    with db_transaction.atomic():
+        lock_wallet(wallet.pk)
+        if Contribution.objects.filter(deceased_member=deceased, contributing_member=profile).exists() or (
+            wallet.transactions.filter(
+                transaction_type=Transaction.TransactionType.TRANSFER, deceased_contribution=deceased
+            ).exclude(status=Transaction.TransactionStatus.FAILED).exists()
+        ):
+            raise DuplicateContribution()
+        return debit_wallet(
+            wallet, amount, Transaction.TransactionType.TRANSFER, status=status,
+            deceased_contribution=deceased, **fields
+        )
+
+
+@traced('ledger.disburse_campaign_funds')
+def disburse_campaign_funds(deceased, beneficiary_wallet, amount=None, **fields):
+    """
+    Pay `amount` (default: everything available) of a campaign's balance
+    to the beneficiary's wallet, or raise InsufficientFunds. Disbursements
+    are serialized per group.
+    """
+    with db_transaction.atomic():
+        Group.objects.filter(pk=deceased.group_id).update(version=F('version') + 1)
+        available = Deceased.objects.with_totals().get(pk=deceased.pk).get_balance()
+        amount = available if amount is None else Decimal(str(amount))
+        if amount <= 0 or amount > available:
+            raise InsufficientFunds(available)
+        return Transaction.objects.create(
+            wallet=beneficiary_wallet,
+            transaction_type=Transaction.TransactionType.PAYOUT_RECEIVED,
+            amount=amount,
+            status=Transaction.TransactionStatus.COMPLETED,
+            destination_group_id=deceased.group_id,
+            deceased_contribution=deceased,
+            **fields
+        )
@@ -0,0 +1,57 @@
+import csv
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from wallet.reconciliation import RECONCILE_BATCH_SIZE, read_statement_file, reconcile, sweep_stale_pending
+from wallet.waas import get_client
+
+
+class Command(BaseCommand):
+    help = 'Reconciles transactions against a WaaS statement and resolves stale PENDING ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help='Statement export (.csv or JSON lines); default: the provider API')
+        parser.add_argument('--batch-size', type=int, default=RECONCILE_BATCH_SIZE)
+        parser.add_argument('--mismatches', help='Write every mismatch to this CSV file')
+        parser.add_argument('--sweep-after-minutes', type=int, default=None,
+                            help='Afterwards, ask the provider about transactions PENDING for longer than this')
+
+    def handle(self, *args, **options):
+        if options['file']:
+            lines = read_statement_file(options['file'])
+        else:
+            lines = get_client().iter_statement(page_size=options['batch_size'])
+
+        out = None
+        on_mismatch = None
+        if options['mismatches']:
+            out = open(options['mismatches'], 'w', newline='')
+            writer = csv.writer(out)
+            writer.writerow(['kind', 'transaction_id', 'line'])
+
+            def on_mismatch(kind, line, transaction_id):
+                writer.writerow([kind, transaction_id or '', json.dumps(line)])
+
+        try:
+            report = reconcile(lines, batch_size=options['batch_size'], on_mismatch=on_mismatch)
+        finally:
+            if out is not None:
+                out.close()
+
+        self.stdout.write(
+            f"{report['lines']} statement line(s), {report['matched']} matched, "
+            f"{report['resolved']} pending resolved"
+        )
+        for kind, count in report['mismatches'].items():
+            if count:
+                self.stdout.write(self.style.WARNING(f'{kind}: {count}'))
+        for sample in report['samples'][:20]:
+            self.stdout.write(f"  {sample['kind']} transaction={sample['transaction']} {json.dumps(sample['line'])}")
+
+        if options['sweep_after_minutes'] is not None:
+            cutoff = timezone.now() - timedelta(minutes=options['sweep_after_minutes'])
+            resolved = sweep_stale_pending(cutoff, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Resolved {resolved} stale pending transaction(s)'))
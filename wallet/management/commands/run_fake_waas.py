@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from wallet.fake_provider import FakeProviderServer
+
+
+class Command(BaseCommand):
+    help = 'Runs the fake WaaS provider locally (point WAAS_BASE_URL at it)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0, help='Seconds to wait before answering')
+        parser.add_argument('--failure-rate', type=float, default=0, help='Fraction of requests answered with 503')
+
+    def handle(self, *args, **options):
+        server = FakeProviderServer(port=options['port'], latency=options['latency'],
+                                    failure_rate=options['failure_rate']).start()
+        self.stdout.write(self.style.SUCCESS(f'Fake WaaS provider listening on {server.url}'))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.stop()
@@ -0,0 +1,29 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from wallet.settlement import SETTLEMENT_BATCH_SIZE, poll_pending, prune_webhook_events, submit_pending
+
+
+class Command(BaseCommand):
+    help = 'Submits pending wallet transactions to the WaaS provider and polls for their outcome'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SETTLEMENT_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help='Keep running, one pass every --interval seconds')
+        parser.add_argument('--interval', type=float, default=5)
+        parser.add_argument('--webhook-retention-days', type=int, default=30)
+
+    def handle(self, *args, **options):
+        while True:
+            submitted = submit_pending(batch_size=options['batch_size'])
+            settled = poll_pending(batch_size=options['batch_size'])
+            pruned = prune_webhook_events(timezone.now() - timedelta(days=options['webhook_retention_days']))
+            self.stdout.write(
+                f'Submitted {submitted}, settled {settled} by polling, pruned {pruned} webhook event(s)'
+            )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-19 05:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chema', '0015_groupmembership_levy_opt_in'),
+        ('condolence', '0005_levyrun'),
+        ('wallet', '0005_webhookevent'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='waas_reference_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['status', 'timestamp'], name='wallet_tran_status_75aa83_idx'),
+        ),
+    ]
@@ -1,11 +1,47 @@
 from django.db import models
+from django.db.models import F
 from django.conf import settings
 from chema.models import Group
 
+INCOMING_TYPES = ['TOP_UP', 'PAYOUT_RECEIVED', 'P2P_RECEIVED']
+OUTGOING_TYPES = ['TRANSFER', 'WITHDRAWAL', 'P2P_SENT']
+
+
+class WalletQuerySet(models.QuerySet):
+
+    def with_balance(self):
+        """Annotate `balance` (same rules as Wallet.get_balance) in the same query."""
+        from django.db.models import Case, DecimalField, Q, Sum, Value, When
+        from django.db.models.functions import Coalesce
+
+        amount = DecimalField(max_digits=12, decimal_places=2)
+        return self.annotate(balance=Coalesce(
+            Sum(
+                Case(
+                    When(Q(transactions__transaction_type__in=INCOMING_TYPES), then=F('transactions__amount')),
+                    When(Q(transactions__transaction_type__in=OUTGOING_TYPES), then=-F('transactions__amount')),
+                    default=Value(0),
+                    output_field=amount,
+                ),
+                filter=Q(transactions__status='COMPLETED'),
+            ),
+            Value(0),
+            output_field=amount,
+        ))
+
+
 class Wallet(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     external_wallet_id = models.CharField(max_length=100, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped on every ledger change for this wallet; used for ETags
+    version = models.PositiveBigIntegerField(default=0)
+
+    objects = WalletQuerySet.as_manager()
+
+    @classmethod
+    def bump_versions(cls, wallet_ids):
+        cls.objects.filter(pk__in=list(wallet_ids)).update(version=F('version') + 1)
 
     def __str__(self):
         return f"Wallet for {self.user.email}"
@@ -16,18 +52,44 @@ class Wallet(models.Model):
         
         # Calculate Incoming (Top-Ups + Payouts + Received Transfers)
         incoming = self.transactions.filter(
-            transaction_type__in=['TOP_UP', 'PAYOUT_RECEIVED', 'P2P_RECEIVED'],
+            transaction_type__in=INCOMING_TYPES,
             status='COMPLETED'
         ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
 
         # Calculate Outgoing (Transfers + Withdrawals + Sent Transfers)
         outgoing = self.transactions.filter(
-            transaction_type__in=['TRANSFER', 'WITHDRAWAL', 'P2P_SENT'],
+            transaction_type__in=OUTGOING_TYPES,
             status='COMPLETED'
         ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
 
         return incoming - outgoing
 
+    def get_pending_amount(self):
+        """Outgoing transfers recorded but not yet settled by the provider."""
+        from decimal import Decimal
+        from django.db.models import Sum
+
+        return self.transactions.filter(
+            transaction_type__in=OUTGOING_TYPES,
+            status='PENDING'
+        ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+
+class TransactionQuerySet(models.QuerySet):
+
+    def for_listing(self, user=None):
+        """
+        Load everything TransactionSerializer reads in a fixed number of
+        queries: both wallets' users and profiles, and the destination groups
+        (annotated for `user` with Group.objects.with_member_context).
+        """
+        from django.db.models import Prefetch
+
+        groups = Group.objects.all() if user is None else Group.objects.with_member_context(user)
+        return self.select_related(
+            'wallet__user__profile', 'recipient_wallet__user__profile'
+        ).prefetch_related(Prefetch('destination_group', queryset=groups))
+
+
 class Transaction(models.Model):
     class TransactionType(models.TextChoices):
         TOP_UP = 'TOP_UP', 'Top-Up'
@@ -55,9 +117,26 @@ class Transaction(models.Model):
     
     # IDs from the external systems for reconciliation
     voucher_reference = models.CharField(max_length=100, blank=True, null=True)
-    waas_reference_id = models.CharField(max_length=100, blank=True, null=True) # The ID from your WaaS provider
+    waas_reference_id = models.CharField(max_length=100, blank=True, null=True, db_index=True) # The ID from your WaaS provider
     
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    objects = TransactionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Stale PENDING sweeps and settlement polling
+            models.Index(fields=['status', 'timestamp']),
+        ]
+
     def __str__(self):
         return f"{self.transaction_type} of {self.amount} for {self.wallet.user.email} - {self.status}"
+
+
+class WebhookEvent(models.Model):
+    """Provider webhook events already processed (redeliveries are ignored)."""
+    event_id = models.CharField(max_length=100, unique=True)
+    received_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.event_id
@@ -0,0 +1,179 @@
+"""
+Reconciliation of our ledger against WaaS provider statements.
+
+A statement is any iterable of lines (dicts with `reference`, `status`,
+`amount` and optionally `client_reference`): a CSV or JSON-lines export read
+with `read_statement_file`, or the provider's paged statement API
+(WaaSClient.iter_statement). Lines are consumed in fixed-size batches and
+each batch is matched with one indexed lookup on
+Transaction.waas_reference_id (or our own id from the client reference), so
+memory stays bounded however long the statement is.
+
+PENDING rows the provider has settled are resolved through
+wallet.settlement.apply_settlements; everything else that disagrees is
+reported as a mismatch. `sweep_stale_pending` asks the provider about the
+PENDING rows left over (e.g. when the process died around the provider
+call) and only fails the ones the provider never accepted.
+"""
+import csv
+import json
+import logging
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db.models import Q
+
+from .models import Transaction
+from .settlement import PROVIDER_TYPES, apply_settlements, submit_transaction, parse_client_reference
+from .waas import WaaSError, WaaSUnavailable, get_client
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_BATCH_SIZE = 1000
+MISMATCH_SAMPLE_SIZE = 100
+
+MISSING_LOCALLY = 'missing_locally'
+STATUS_MISMATCH = 'status_mismatch'
+AMOUNT_MISMATCH = 'amount_mismatch'
+
+
+def read_statement_file(path):
+    """Yield statement lines from a .csv (with a header row) or JSON-lines file."""
+    with open(path, newline='') as handle:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(handle)
+        else:
+            for line in handle:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _batches(lines, size):
+    lines = iter(lines)
+    while True:
+        batch = list(islice(lines, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _amount(value):
+    try:
+        return Decimal(str(value)) if value not in (None, '') else None
+    except InvalidOperation:
+        return None
+
+
+def reconcile(lines, batch_size=RECONCILE_BATCH_SIZE, on_mismatch=None):
+    """
+    Match statement `lines` against our transactions. `on_mismatch(kind, line,
+    transaction_id)` is called for every mismatch; without it the first
+    MISMATCH_SAMPLE_SIZE are kept in the report. Returns a report dict.
+    """
+    report = {
+        'lines': 0,
+        'matched': 0,
+        'resolved': 0,
+        'mismatches': {MISSING_LOCALLY: 0, STATUS_MISMATCH: 0, AMOUNT_MISMATCH: 0},
+        'samples': [],
+    }
+
+    def mismatch(kind, line, transaction_id=None):
+        report['mismatches'][kind] += 1
+        if on_mismatch is not None:
+            on_mismatch(kind, line, transaction_id)
+        elif len(report['samples']) < MISMATCH_SAMPLE_SIZE:
+            report['samples'].append({'kind': kind, 'transaction': transaction_id, 'line': line})
+
+    for batch in _batches(lines, batch_size):
+        report['lines'] += len(batch)
+        references = {line.get('reference') for line in batch if line.get('reference')}
+        ids = {parse_client_reference(line.get('client_reference')) for line in batch} - {None}
+        rows = list(
+            Transaction.objects.filter(Q(waas_reference_id__in=references) | Q(pk__in=ids))
+            .values_list('pk', 'waas_reference_id', 'status', 'amount', 'transaction_type')
+        )
+        by_reference = {row[1]: row for row in rows if row[1]}
+        by_id = {row[0]: row for row in rows}
+
+        settlements = []
+        for line in batch:
+            row = by_reference.get(line.get('reference')) or by_id.get(
+                parse_client_reference(line.get('client_reference'))
+            )
+            if row is None:
+                mismatch(MISSING_LOCALLY, line)
+                continue
+            pk, _, status, amount, transaction_type = row
+            line_status = line.get('status')
+            line_amount = _amount(line.get('amount'))
+            report['matched'] += 1
+
+            if status == Transaction.TransactionStatus.PENDING:
+                if line_status in ('COMPLETED', 'FAILED'):
+                    settlements.append({
+                        'transaction_id': pk,
+                        'waas_ref': line.get('reference'),
+                        'status': line_status,
+                        'amount': line_amount,
+                    })
+            elif line_status != status:
+                mismatch(STATUS_MISMATCH, line, pk)
+            elif (status == Transaction.TransactionStatus.COMPLETED
+                  and line_amount is not None and line_amount != amount):
+                mismatch(AMOUNT_MISMATCH, line, pk)
+
+        report['resolved'] += apply_settlements(settlements)
+
+    return report
+
+
+def sweep_stale_pending(cutoff, batch_size=RECONCILE_BATCH_SIZE, client=None):
+    """
+    Resolve provider transactions still PENDING since before `cutoff`. Run
+    it after reconciling, so rows the statement settled are resolved first.
+
+    Nothing is failed on age alone: rows with a provider reference are looked
+    up, and rows without one are resubmitted under their original
+    Idempotency-Key, so the provider replays its outcome if it was reached
+    and only now carries out the intent if it was not. A row fails only when
+    the provider rejects or does not know it; one still PENDING there stays
+    PENDING for the webhook or a later sweep. Returns the number resolved.
+    """
+    client = client or get_client()
+    resolved = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            Transaction.objects.filter(
+                status=Transaction.TransactionStatus.PENDING,
+                transaction_type__in=PROVIDER_TYPES,
+                timestamp__lt=cutoff,
+                pk__gt=last_pk,
+            ).select_related('wallet', 'destination_group').order_by('pk')[:batch_size]
+        )
+        if not batch:
+            return resolved
+
+        results = []
+        for txn in batch:
+            try:
+                if txn.waas_reference_id:
+                    result = client.get_transaction(txn.waas_reference_id)
+                else:
+                    result = submit_transaction(client, txn)
+                    Transaction.objects.filter(pk=txn.pk).update(waas_reference_id=result['waas_ref'])
+            except WaaSUnavailable:
+                logger.warning("WaaS unavailable, stale pending sweep stopped at transaction %s", txn.pk)
+                return resolved + apply_settlements(results)
+            except WaaSError as exc:
+                if txn.waas_reference_id and exc.status != 404:
+                    logger.warning("Could not fetch WaaS transaction %s: %s", txn.waas_reference_id, exc.message)
+                    continue
+                results.append({'transaction_id': txn.pk, 'status': 'FAILED', 'error': exc.message})
+                continue
+            if result['status'] != 'PENDING':
+                results.append({'transaction_id': txn.pk, **result})
+
+        resolved += apply_settlements(results)
+        last_pk = batch[-1].pk
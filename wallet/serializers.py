@@ -36,12 +36,15 @@ class TransactionSerializer(serializers.ModelSerializer):
 
 class WalletSerializer(serializers.ModelSerializer):
     balance = serializers.DecimalField(source='get_balance', max_digits=10, decimal_places=2, read_only=True)
+    pending = serializers.DecimalField(source='get_pending_amount', max_digits=10, decimal_places=2, read_only=True)
     recent_transactions = serializers.SerializerMethodField()
 
     class Meta:
         model = Wallet
-        fields = ['id', 'user', 'external_wallet_id', 'balance', 'recent_transactions', 'created_at']
+        fields = ['id', 'user', 'external_wallet_id', 'balance', 'pending', 'recent_transactions', 'created_at']
 
     def get_recent_transactions(self, obj):
-        transactions = obj.transactions.all().order_by('-timestamp')[:5]
-        return TransactionSerializer(transactions, many=True).data
+        request = self.context.get('request')
+        user = request.user if request and request.user.is_authenticated else None
+        transactions = obj.transactions.for_listing(user).order_by('-timestamp')[:5]
+        return TransactionSerializer(transactions, many=True, context=self.context).data
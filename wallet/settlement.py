@@ -0,0 +1,247 @@
+"""
+Asynchronous settlement of provider-backed transactions.
+
+With WAAS_SETTLEMENT_MODE = 'async' the top-up and transfer views only
+record a PENDING Transaction (the intent) and return. The provider is
+called afterwards by `submit_pending` (manage.py settle_transactions), and
+the final outcome arrives either through the signed webhook
+(wallet.views.waas_webhook) or through `poll_pending` for providers that
+cannot call back. Both feed `apply_settlements`, which moves transactions
+out of PENDING in one batch and creates the linked Contribution records.
+
+Every step is idempotent: the provider sees an Idempotency-Key derived from
+the transaction id, and only rows still PENDING are ever settled, so
+duplicate webhooks, redeliveries and overlapping pollers are harmless.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from chema.models import Group
+from condolence.models import Contribution
+from core.metrics import record_transaction_writes
+
+from .models import Transaction, Wallet, WebhookEvent
+from .waas import WaaSError, WaaSUnavailable, get_client
+
+logger = logging.getLogger(__name__)
+
+SETTLEMENT_BATCH_SIZE = 200
+PROVIDER_TYPES = [Transaction.TransactionType.TOP_UP, Transaction.TransactionType.TRANSFER]
+
+
+def settlement_is_async():
+    return settings.WAAS_SETTLEMENT_MODE == 'async'
+
+
+def client_reference(transaction_id):
+    """Our id for a transaction as sent to (and echoed back by) the provider."""
+    return f"txn-{transaction_id}"
+
+
+def parse_client_reference(value):
+    if isinstance(value, str) and value.startswith('txn-') and value[4:].isdigit():
+        return int(value[4:])
+    return None
+
+
+def submit_transaction(client, txn):
+    """Send one recorded intent to the provider under its Idempotency-Key."""
+    reference = client_reference(txn.pk)
+    if txn.transaction_type == Transaction.TransactionType.TOP_UP:
+        return client.redeem_voucher(
+            txn.voucher_reference, txn.wallet.external_wallet_id,
+            idempotency_key=reference, client_reference=reference,
+        )
+    return client.transfer_funds(
+        txn.wallet.external_wallet_id, txn.destination_group.external_wallet_id, txn.amount,
+        idempotency_key=reference, client_reference=reference,
+    )
+
+
+def submit_pending(batch_size=SETTLEMENT_BATCH_SIZE, client=None):
+    """
+    Hand recorded intents (PENDING, not yet sent) to the provider. Outcomes
+    the provider already knows are applied straight away; the rest wait for
+    the webhook or poller. Returns the number of transactions submitted.
+    """
+    client = client or get_client()
+    pending = list(
+        Transaction.objects.filter(
+            status=Transaction.TransactionStatus.PENDING,
+            transaction_type__in=PROVIDER_TYPES,
+            waas_reference_id__isnull=True,
+        ).select_related('wallet', 'destination_group').order_by('pk')[:batch_size]
+    )
+
+    results = []
+    submitted = 0
+    for txn in pending:
+        try:
+            result = submit_transaction(client, txn)
+        except WaaSUnavailable:
+            # Leave the rest for the next run
+            logger.warning("WaaS unavailable, %s transaction(s) left pending", len(pending) - submitted)
+            break
+        except WaaSError as exc:
+            results.append({'transaction_id': txn.pk, 'status': 'FAILED', 'error': exc.message})
+        else:
+            Transaction.objects.filter(pk=txn.pk).update(waas_reference_id=result['waas_ref'])
+            if result['status'] != 'PENDING':
+                results.append({'transaction_id': txn.pk, **result})
+        submitted += 1
+
+    apply_settlements(results)
+    return submitted
+
+
+def poll_pending(batch_size=SETTLEMENT_BATCH_SIZE, older_than=None, client=None):
+    """
+    Ask the provider for the status of submitted transactions that have
+    not been settled by a webhook. Returns the number settled.
+    """
+    client = client or get_client()
+    older_than = settings.WAAS_POLL_AFTER_SECONDS if older_than is None else older_than
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    pending = list(
+        Transaction.objects.filter(
+            status=Transaction.TransactionStatus.PENDING,
+            transaction_type__in=PROVIDER_TYPES,
+            waas_reference_id__isnull=False,
+            timestamp__lte=cutoff,
+        ).order_by('pk').values_list('pk', 'waas_reference_id')[:batch_size]
+    )
+
+    results = []
+    for pk, reference in pending:
+        try:
+            result = client.get_transaction(reference)
+        except WaaSUnavailable:
+            break
+        except WaaSError as exc:
+            logger.warning("Could not fetch WaaS transaction %s: %s", reference, exc.message)
+            continue
+        if result['status'] != 'PENDING':
+            results.append({'transaction_id': pk, **result})
+
+    return apply_settlements(results)
+
+
+def apply_settlements(results):
+    """
+    Apply provider outcomes. Each result names the transaction (`transaction_id`
+    or `client_reference`, else `waas_ref`) and carries `status` COMPLETED or
+    FAILED, plus `amount` for voucher top-ups. Returns the number of
+    transactions that left PENDING.
+    """
+    by_id, by_ref = {}, {}
+    for result in results:
+        if result.get('status') not in ('COMPLETED', 'FAILED'):
+            continue
+        pk = result.get('transaction_id') or parse_client_reference(result.get('client_reference'))
+        if pk:
+            by_id[pk] = result
+        elif result.get('waas_ref'):
+            by_ref[result['waas_ref']] = result
+    if not (by_id or by_ref):
+        return 0
+
+    with db_transaction.atomic():
+        # Locking keeps a webhook and the poller from settling the same rows twice
+        pending = list(
+            Transaction.objects.select_for_update()
+            .filter(Q(pk__in=list(by_id)) | Q(waas_reference_id__in=list(by_ref)),
+                    status=Transaction.TransactionStatus.PENDING)
+        )
+
+        settled, contributions = [], []
+        for txn in pending:
+            result = by_id.get(txn.pk) or by_ref[txn.waas_reference_id]
+            if result.get('waas_ref') and not txn.waas_reference_id:
+                txn.waas_reference_id = result['waas_ref']
+            if result['status'] == 'COMPLETED':
+                txn.status = Transaction.TransactionStatus.COMPLETED
+                if txn.transaction_type == Transaction.TransactionType.TOP_UP and result.get('amount') is not None:
+                    txn.amount = result['amount']
+                if txn.transaction_type == Transaction.TransactionType.TRANSFER and txn.deceased_contribution_id:
+                    contributions.append(txn)
+            else:
+                txn.status = Transaction.TransactionStatus.FAILED
+            settled.append(txn)
+
+        if not settled:
+            return 0
+        Transaction.objects.bulk_update(settled, ['status', 'amount', 'waas_reference_id'])
+        _create_contributions(contributions)
+
+        # bulk_update skips the ledger signals
+        from api_v1.sync import record_transaction_changes
+        Wallet.bump_versions({txn.wallet_id for txn in settled})
+        Group.bump_versions({txn.destination_group_id for txn in settled if txn.destination_group_id})
+        record_transaction_changes(settled)
+        record_transaction_writes(settled)
+
+    return len(settled)
+
+
+def _create_contributions(transfers):
+    if not transfers:
+        return
+    profiles = dict(
+        Wallet.objects.filter(pk__in={t.wallet_id for t in transfers}).values_list('pk', 'user__profile')
+    )
+    Contribution.objects.bulk_create([
+        Contribution(
+            group_id=txn.destination_group_id,
+            deceased_member_id=txn.deceased_contribution_id,
+            contributing_member_id=profiles.get(txn.wallet_id),
+            amount=txn.amount,
+            payment_method='wallet',
+            transaction=txn,
+        )
+        for txn in transfers
+    ], ignore_conflicts=True)
+
+
+def record_webhook_events(events):
+    """
+    Store delivered event ids and return only the events not seen before,
+    so a redelivered webhook is acknowledged without being processed again.
+    """
+    events = [event for event in events if event.get('id')]
+    seen = set(
+        WebhookEvent.objects.filter(event_id__in=[e['id'] for e in events]).values_list('event_id', flat=True)
+    )
+    fresh = {e['id']: e for e in events if e['id'] not in seen}
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(event_id=event_id) for event_id in fresh], ignore_conflicts=True
+    )
+    return list(fresh.values())
+
+
+def process_webhook(payload):
+    """
+    Settle the transactions in a verified webhook body. Returns the number
+    settled. Events are marked as seen in the same transaction, so if
+    settling fails the provider's redelivery is processed again.
+    """
+    with db_transaction.atomic():
+        events = record_webhook_events(payload.get('events') or [])
+        return apply_settlements([
+            {
+                'client_reference': event.get('client_reference'),
+                'waas_ref': event.get('reference'),
+                'status': event.get('status'),
+                'amount': Decimal(str(event['amount'])) if event.get('amount') is not None else None,
+            }
+            for event in events
+        ])
+
+
+def prune_webhook_events(cutoff):
+    return WebhookEvent.objects.filter(received_at__lt=cutoff).delete()[0]
@@ -1,8 +1,9 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.conf import settings
-from .models import Wallet
+from .models import Transaction, Wallet
 from chema.models import Group
+from core.metrics import record_transaction_writes
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_user_wallet(sender, instance, created, **kwargs):
@@ -16,3 +17,16 @@ def create_group_wallet_id(sender, instance, created, **kwargs):
         instance.external_wallet_id = f"group_wallet_{instance.id}_{instance.name[:20].replace(' ', '_')}"
         # We use update to avoid triggering post_save again in an infinite loop
         Group.objects.filter(pk=instance.pk).update(external_wallet_id=instance.external_wallet_id)
+
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+def bump_ledger_versions(sender, instance, **kwargs):
+    Wallet.bump_versions([instance.wallet_id])
+    if instance.destination_group_id:
+        Group.bump_versions([instance.destination_group_id])
+
+
+@receiver(post_save, sender=Transaction)
+def count_transaction_write(sender, instance, **kwargs):
+    record_transaction_writes([instance])
@@ -0,0 +1,437 @@
+"""
+Concurrency stress test for the money-moving paths (wallet.ledger).
+
+Fires STRESS_OPERATIONS concurrent send_money, contribute_to_deceased,
+transfer_to_group and disburse_funds requests from STRESS_WORKERS threads,
+then checks the ledger invariants and prints throughput and latency
+percentiles. Run it after every change to the wallet hot path. It needs a
+database that separate connections can share: Postgres, or SQLite in a file,
+which is what the test settings use unless TEST_DATABASE_NAME=:memory:.
+
+Also here: query budgets for the wallet pages and the provider webhook.
+"""
+import json
+import os
+import queue
+import random
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.db import DatabaseError, connection
+from django.db.models import Count, Sum
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from chema.models import GroupMembership
+from condolence.models import Contribution, Deceased
+from core.testing import QueryBudgetTestCase, make_group
+from user.models import CustomUser, Profile
+
+from wallet.fake_provider import FakeProvider, FakeProviderServer
+from wallet.models import Transaction, Wallet, WebhookEvent
+from wallet.reconciliation import sweep_stale_pending
+from wallet.settlement import client_reference, submit_transaction
+from wallet.waas import AsyncWaaSClient, CircuitBreaker, WaaSClient, WaaSUnavailable, sign_webhook
+
+STRESS_WORKERS = int(os.environ.get('STRESS_WORKERS', 16))
+STRESS_OPERATIONS = int(os.environ.get('STRESS_OPERATIONS', 400))
+STRESS_MEMBERS = 40
+SEED_BALANCE = Decimal('100.00')
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class WalletConcurrencyTests(TransactionTestCase):
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('needs Postgres or a file-backed SQLite test database (unset TEST_DATABASE_NAME)')
+
+        self.admin = CustomUser.objects.create_user(email='admin@stress.test', is_active=True)
+        self.beneficiary = CustomUser.objects.create_user(email='beneficiary@stress.test', is_active=True)
+        self.members = [
+            CustomUser.objects.create_user(email=f'member{i}@stress.test', is_active=True)
+            for i in range(STRESS_MEMBERS)
+        ]
+        self.deceased = [
+            CustomUser.objects.create_user(email=f'deceased{i}@stress.test', is_active=True) for i in range(2)
+        ]
+        profiles = {user.pk: Profile.objects.get_or_create(user=user)[0]
+                    for user in [self.admin, self.beneficiary, *self.deceased, *self.members]}
+
+        self.group = make_group(name='Stress', creator=self.admin, external_wallet_id='group_wallet_stress')
+        GroupMembership.objects.bulk_create(
+            [GroupMembership(group=self.group, member=profiles[self.admin.pk], status='active',
+                             role='admin', is_admin=True)]
+            + [GroupMembership(group=self.group, member=profiles[user.pk], status='active') for user in self.members]
+        )
+        self.api_campaign = Deceased.objects.create(
+            deceased=profiles[self.deceased[0].pk], group=self.group, beneficiary=profiles[self.beneficiary.pk]
+        )
+        self.transfer_campaign = Deceased.objects.create(
+            deceased=profiles[self.deceased[1].pk], group=self.group, beneficiary=profiles[self.beneficiary.pk]
+        )
+        Transaction.objects.bulk_create([
+            Transaction(wallet=user.wallet, transaction_type='TOP_UP', amount=SEED_BALANCE, status='COMPLETED')
+            for user in self.members
+        ])
+        self.seeded_total = SEED_BALANCE * len(self.members)
+
+    def _operations(self):
+        rng = random.Random(42)
+        operations = []
+        for _ in range(STRESS_OPERATIONS):
+            member = rng.choice(self.members)
+            kind = rng.choices(['send_money', 'contribute', 'transfer', 'disburse'], weights=[5, 3, 3, 1])[0]
+            if kind == 'send_money':
+                recipient = rng.choice([user for user in self.members if user != member])
+                operations.append((kind, member, {'recipient_user_id': recipient.id,
+                                                  'amount': str(rng.randint(10, 60))}))
+            elif kind == 'contribute':
+                operations.append((kind, member, {'deceased_id': self.api_campaign.id, 'amount': '30'}))
+            elif kind == 'transfer':
+                operations.append((kind, member, {'deceased_id': self.transfer_campaign.id, 'amount': '30'}))
+            else:
+                operations.append((kind, self.admin, {'amount': str(rng.randint(10, 50))}))
+        return operations
+
+    def _perform(self, clients, kind, user, data):
+        if kind in ('send_money', 'contribute'):
+            client = clients.setdefault(('api', user.pk), APIClient())
+            client.force_authenticate(user)
+            action = 'send_money' if kind == 'send_money' else 'contribute_to_deceased'
+            return client.post(f'/api/v1/wallets/{action}/', data, format='json').status_code
+
+        if ('html', user.pk) not in clients:
+            clients[('html', user.pk)] = Client()
+            clients[('html', user.pk)].force_login(user)
+        client = clients[('html', user.pk)]
+        if kind == 'transfer':
+            return client.post(f'/transfer/{self.group.id}/', data).status_code
+        # Alternate between the API (whole balance) and the HTMX view (partial payout)
+        if int(data['amount']) % 2:
+            api = clients.setdefault(('api', user.pk), APIClient())
+            api.force_authenticate(user)
+            return api.post(f'/api/v1/deceased/{self.api_campaign.id}/disburse_funds/').status_code
+        return client.post(f'/disburse-funds/{self.transfer_campaign.id}/', data,
+                           HTTP_HX_REQUEST='true').status_code
+
+    def _run(self, operations):
+        pending = queue.Queue()
+        for operation in operations:
+            pending.put(operation)
+        results = []
+        lock = threading.Lock()
+
+        def worker():
+            clients = {}
+            try:
+                while True:
+                    try:
+                        kind, user, data = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    started = time.perf_counter()
+                    try:
+                        status = self._perform(clients, kind, user, data)
+                        error = None
+                    except Exception as exc:
+                        status, error = 500, repr(exc)
+                    with lock:
+                        results.append((kind, status, time.perf_counter() - started, error))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(STRESS_WORKERS)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, time.perf_counter() - started
+
+    def _report(self, results, elapsed):
+        print(f"\n{len(results)} operations on {STRESS_WORKERS} workers in {elapsed:.2f}s "
+              f"({len(results) / elapsed:.1f} ops/s)")
+        for kind in sorted({result[0] for result in results}):
+            latencies = [result[2] * 1000 for result in results if result[0] == kind]
+            statuses = sorted({result[1] for result in results if result[0] == kind})
+            print(f"  {kind:<12} n={len(latencies):<4} p50={percentile(latencies, 0.5):7.1f}ms "
+                  f"p95={percentile(latencies, 0.95):7.1f}ms p99={percentile(latencies, 0.99):7.1f}ms "
+                  f"statuses={statuses}")
+
+    def test_concurrent_money_movement_keeps_ledger_consistent(self):
+        results, elapsed = self._run(self._operations())
+        self._report(results, elapsed)
+
+        errors = [(kind, error) for kind, status, _, error in results if status >= 500]
+        self.assertEqual(errors, [])
+
+        # No wallet overdrawn, nothing left half-done
+        self.assertFalse(Wallet.objects.with_balance().filter(balance__lt=0).exists())
+        self.assertFalse(Transaction.objects.filter(status='PENDING').exists())
+
+        # One contribution (and one wallet payment) per member per campaign
+        self.assertFalse(
+            Contribution.objects.values('deceased_member', 'contributing_member')
+            .annotate(n=Count('id')).filter(n__gt=1).exists()
+        )
+        self.assertFalse(
+            Transaction.objects.filter(transaction_type='TRANSFER', status='COMPLETED')
+            .values('wallet', 'deceased_contribution').annotate(n=Count('id')).filter(n__gt=1).exists()
+        )
+
+        # Every completed campaign payment has its contribution, for the same amount
+        payments = Transaction.objects.filter(transaction_type='TRANSFER', status='COMPLETED')
+        self.assertEqual(Contribution.objects.filter(transaction__in=payments).count(), payments.count())
+        self.assertFalse(Contribution.objects.filter(transaction__isnull=True).exists())
+
+        # Campaigns never pay out more than they raised
+        for campaign in Deceased.objects.with_totals():
+            self.assertGreaterEqual(campaign.get_balance(), 0)
+
+        # Money is conserved: what left the wallets is held by the campaigns
+        wallets_total = sum(Wallet.objects.with_balance().values_list('balance', flat=True))
+        contributed = Contribution.objects.aggregate(total=Sum('amount'))['total'] or 0
+        paid_out = Transaction.objects.filter(
+            transaction_type='PAYOUT_RECEIVED', status='COMPLETED'
+        ).aggregate(total=Sum('amount'))['total'] or 0
+        self.assertEqual(wallets_total, self.seeded_total - contributed + paid_out)
+
+
+class WalletBudgetTests(QueryBudgetTestCase):
+    """Query budgets for the wallet HTMX routes (see core.testing)."""
+
+    HTMX = {'HTTP_HX_REQUEST': 'true'}
+
+    def get(self, url, max_queries, headers=None):
+        return self.assert_budget(url, max_queries, client=self.html_client(), headers=headers, status=200)
+
+    def submit(self, url, max_queries, data, status=200):
+        return self.assert_budget(url, max_queries, method='POST', data=data, client=self.html_client(),
+                                  headers=self.HTMX, status=status, scales=False)
+
+    def test_balance(self):
+        self.get('/balance/', 6, headers=self.HTMX)
+
+    def test_history(self):
+        self.get('/history/', 14)
+
+    def test_history_partial(self):
+        self.get('/history/', 11, headers=self.HTMX)
+
+    def test_group_history(self):
+        self.get(f'/history/group/{self.group.id}/', 15)
+
+    def test_top_up(self):
+        self.submit('/top-up/', 9, {'voucher_pin': 'VOUCHER-BUDGET'})
+
+    def test_transfer_to_group(self):
+        self.submit(f'/transfer/{self.group.id}/', 27, {'amount': '20.00', 'deceased_id': self.campaign.id})
+        self.assertTrue(Contribution.objects.filter(deceased_member=self.campaign,
+                                                    contributing_member=self.profile).exists())
+
+
+@override_settings(WAAS_WEBHOOK_SECRET='webhook-secret', WAAS_WEBHOOK_TOLERANCE_SECONDS=300)
+class WebhookTests(TestCase):
+
+    def setUp(self):
+        user = CustomUser.objects.create_user(email='webhook@wallet.test', is_active=True)
+        self.txn = Transaction.objects.create(
+            wallet=user.wallet, transaction_type='TOP_UP', amount=Decimal('0.00'), status='PENDING',
+            voucher_reference='VOUCHER-1', waas_reference_id='waas_top_up_1',
+        )
+        self.body = json.dumps({'events': [{
+            'id': 'evt-1', 'client_reference': client_reference(self.txn.pk), 'reference': 'waas_top_up_1',
+            'status': 'COMPLETED', 'amount': '50.00',
+        }]}).encode()
+
+    def deliver(self, body=None, timestamp=None, signature=None):
+        body = self.body if body is None else body
+        timestamp = str(int(time.time())) if timestamp is None else timestamp
+        signature = sign_webhook('webhook-secret', timestamp, body) if signature is None else signature
+        return self.client.post(reverse('waas_webhook'), body, content_type='application/json',
+                                HTTP_X_WAAS_TIMESTAMP=timestamp, HTTP_X_WAAS_SIGNATURE=signature)
+
+    def assertStatus(self, status):
+        self.txn.refresh_from_db()
+        self.assertEqual(self.txn.status, status)
+
+    def test_settles_a_signed_delivery(self):
+        response = self.deliver()
+        self.assertEqual(response.json(), {'settled': 1})
+        self.assertStatus('COMPLETED')
+        self.assertEqual(self.txn.amount, Decimal('50.00'))
+
+    def test_rejects_a_bad_signature(self):
+        self.assertEqual(self.deliver(signature='0' * 64).status_code, 403)
+        # Signed over a different body
+        self.assertEqual(self.deliver(signature=sign_webhook('webhook-secret', str(int(time.time())), b'{}'))
+                         .status_code, 403)
+        self.assertStatus('PENDING')
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_rejects_a_stale_timestamp(self):
+        self.assertEqual(self.deliver(timestamp=str(int(time.time()) - 301)).status_code, 403)
+        self.assertStatus('PENDING')
+
+    def test_redelivery_is_acknowledged_once(self):
+        self.deliver()
+        response = self.deliver()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'settled': 0})
+        self.assertEqual(WebhookEvent.objects.filter(event_id='evt-1').count(), 1)
+
+    def test_redelivery_after_a_failed_settlement_is_processed(self):
+        with mock.patch('wallet.settlement.apply_settlements', side_effect=DatabaseError('lost connection')):
+            with self.assertRaises(DatabaseError):
+                self.deliver()
+        self.assertStatus('PENDING')
+        self.assertFalse(WebhookEvent.objects.exists())
+
+        self.assertEqual(self.deliver().json(), {'settled': 1})
+        self.assertStatus('COMPLETED')
+
+
+class StalePendingSweepTests(TestCase):
+
+    def setUp(self):
+        user = CustomUser.objects.create_user(email='sweep@wallet.test', is_active=True)
+        self.wallet = user.wallet
+        self.provider = FakeProvider()
+        self.client = WaaSClient(base_url='', provider=self.provider, max_retries=0)
+        self.cutoff = timezone.now() + timedelta(minutes=1)
+
+    def top_up(self, pin):
+        return Transaction.objects.create(
+            wallet=self.wallet, transaction_type='TOP_UP', amount=Decimal('0.00'), status='PENDING',
+            voucher_reference=pin,
+        )
+
+    def test_settles_what_the_provider_completed(self):
+        txn = self.top_up('12345')
+        # Reached the provider, but the process died before the reference was stored
+        submit_transaction(self.client, txn)
+        self.assertEqual(sweep_stale_pending(self.cutoff, client=self.client), 1)
+        txn.refresh_from_db()
+        self.assertEqual((txn.status, txn.amount), ('COMPLETED', Decimal('100.00')))
+        self.assertEqual(len(self.provider.transactions), 1)
+
+    def test_looks_up_submitted_transactions(self):
+        self.provider.settle_async = True
+        txn = self.top_up('12345')
+        reference = submit_transaction(self.client, txn)['waas_ref']
+        Transaction.objects.filter(pk=txn.pk).update(waas_reference_id=reference)
+
+        self.assertEqual(sweep_stale_pending(self.cutoff, client=self.client), 0)
+        txn.refresh_from_db()
+        self.assertEqual(txn.status, 'PENDING')
+
+        self.provider.settle()
+        self.assertEqual(sweep_stale_pending(self.cutoff, client=self.client), 1)
+        txn.refresh_from_db()
+        self.assertEqual(txn.status, 'COMPLETED')
+
+    def test_fails_what_the_provider_rejects_or_does_not_know(self):
+        rejected = self.top_up('00000')
+        unknown = self.top_up('12345')
+        Transaction.objects.filter(pk=unknown.pk).update(waas_reference_id='waas_unknown')
+        self.assertEqual(sweep_stale_pending(self.cutoff, client=self.client), 2)
+        for txn in (rejected, unknown):
+            txn.refresh_from_db()
+            self.assertEqual(txn.status, 'FAILED')
+
+    def test_stops_while_the_provider_is_unavailable(self):
+        txn = self.top_up('12345')
+        with mock.patch.object(self.provider, 'handle', return_value=(503, {'error': 'Unavailable'})):
+            self.assertEqual(sweep_stale_pending(self.cutoff, client=self.client), 0)
+        txn.refresh_from_db()
+        self.assertEqual(txn.status, 'PENDING')
+
+
+class WaaSClientTests(SimpleTestCase):
+
+    def client_for(self, provider=None, base_url='', threshold=10, max_retries=2):
+        breaker = CircuitBreaker(threshold, reset_timeout=30)
+        return WaaSClient(base_url=base_url, provider=provider, max_retries=max_retries, backoff=0, breaker=breaker)
+
+    def reopen_window_elapsed(self, client):
+        client.breaker.opened_at -= client.breaker.reset_timeout + 1
+
+    def test_retries_until_the_provider_answers(self):
+        provider = FakeProvider()
+        client = self.client_for(provider)
+        answers = [(503, {}), (503, {}), (200, {'balance': '150.00'})]
+        with mock.patch.object(provider, 'handle', side_effect=answers) as handle:
+            self.assertEqual(client.get_balance('w1'), {'balance': Decimal('150.00')})
+        self.assertEqual(handle.call_count, 3)
+        self.assertFalse(client.breaker.is_open)
+
+    def test_gives_up_after_the_retries(self):
+        # Read timeouts over real HTTP
+        with FakeProviderServer(latency=0.2) as server:
+            client = self.client_for(base_url=server.url)
+            client.timeout = (1, 0.05)
+            with mock.patch.object(client.session, 'request', wraps=client.session.request) as sent:
+                with self.assertRaises(WaaSUnavailable):
+                    client.get_balance('w1')
+            client.close()
+        self.assertEqual(sent.call_count, 3)
+
+    def test_breaker_opens_and_fails_fast(self):
+        with FakeProviderServer(failure_rate=1) as server:
+            client = self.client_for(base_url=server.url, threshold=2, max_retries=0)
+            with mock.patch.object(client.session, 'request', wraps=client.session.request) as sent:
+                for _ in range(3):
+                    with self.assertRaises(WaaSUnavailable):
+                        client.get_balance('w1')
+            client.close()
+        self.assertTrue(client.breaker.is_open)
+        # The third call never reached the provider
+        self.assertEqual(sent.call_count, 2)
+
+    def test_half_open_trial_closes_the_breaker(self):
+        provider = FakeProvider()
+        client = self.client_for(provider, threshold=1, max_retries=0)
+        with mock.patch.object(provider, 'handle', return_value=(503, {})):
+            with self.assertRaises(WaaSUnavailable):
+                client.get_balance('w1')
+        self.assertTrue(client.breaker.is_open)
+        with self.assertRaises(WaaSUnavailable):
+            client.get_balance('w1')
+
+        self.reopen_window_elapsed(client)
+        self.assertEqual(client.get_balance('w1'), {'balance': Decimal('150.00')})
+        self.assertFalse(client.breaker.is_open)
+
+    def test_unexpected_error_in_the_trial_does_not_wedge_the_breaker(self):
+        provider = FakeProvider()
+        client = self.client_for(provider, threshold=1, max_retries=0)
+        with mock.patch.object(provider, 'handle', return_value=(503, {})):
+            with self.assertRaises(WaaSUnavailable):
+                client.get_balance('w1')
+
+        self.reopen_window_elapsed(client)
+        with mock.patch.object(provider, 'handle', side_effect=RuntimeError('bad response')):
+            with self.assertRaises(RuntimeError):
+                client.get_balance('w1')
+        self.assertTrue(client.breaker.is_open)
+
+        self.reopen_window_elapsed(client)
+        self.assertEqual(client.get_balance('w1'), {'balance': Decimal('150.00')})
+
+    def test_async_client_passes_the_client_reference(self):
+        client = AsyncWaaSClient(self.client_for(FakeProvider()))
+        result = async_to_sync(client.redeem_voucher)('12345', 'w1', client_reference='txn-7')
+        self.assertEqual((result['status'], result['client_reference']), ('COMPLETED', 'txn-7'))
+        result = async_to_sync(client.transfer_funds)('w1', 'w2', Decimal('5.00'), client_reference='txn-8')
+        self.assertEqual(result['client_reference'], 'txn-8')
@@ -7,4 +7,5 @@ urlpatterns = [
     path('balance/', views.get_wallet_balance_snippet, name='wallet_balance'),
     path('history/', views.transaction_history, name='wallet_history'),
     path('history/group/<int:group_id>/', views.group_transaction_history, name='group_wallet_history'),
+    path('webhooks/waas/', views.waas_webhook, name='waas_webhook'),
 ]
@@ -1,36 +1,46 @@
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.db import models
 from decimal import Decimal
+import json
 
+from .ledger import DuplicateContribution, InsufficientFunds, debit_for_campaign
 from .models import Wallet, Transaction
+from .settlement import client_reference, process_webhook, settlement_is_async
+from .waas import WaaSError, get_client, verify_webhook
 from chema.models import Group
 from condolence.models import Deceased, Contribution
 
-# --- Helper Stub Functions (Simulating External API) ---
+# --- Provider calls (see wallet.waas) ---
 
-def waas_api_redeem_voucher(voucher_pin, user_wallet_id):
-    # In a real app, this would call 1Voucher or Flutterwave
-    print(f"STUB: Redeeming {voucher_pin} for wallet {user_wallet_id}")
-    if voucher_pin == "12345":
-        return {'success': True, 'amount': Decimal('100.00'), 'waas_ref': 'waas_stub_ref_123'}
-    elif voucher_pin == "50":
-         return {'success': True, 'amount': Decimal('50.00'), 'waas_ref': 'waas_stub_ref_50'}
-    else:
-        return {'success': False, 'error': 'Invalid PIN'}
+def waas_api_redeem_voucher(voucher_pin, user_wallet_id, reference=None):
+    try:
+        result = get_client().redeem_voucher(
+            voucher_pin, user_wallet_id, idempotency_key=reference, client_reference=reference
+        )
+    except WaaSError as exc:
+        return {'success': False, 'error': exc.message}
+    return {'success': True, **result}
 
-def waas_api_transfer_funds(from_wallet_id, to_wallet_id, amount):
-    # In a real app, this would call the WaaS transfer endpoint
-    print(f"STUB: Transferring {amount} from {from_wallet_id} to {to_wallet_id}")
-    return {'success': True, 'waas_ref': 'waas_stub_transfer_999'}
+def waas_api_transfer_funds(from_wallet_id, to_wallet_id, amount, reference=None):
+    try:
+        result = get_client().transfer_funds(
+            from_wallet_id, to_wallet_id, amount, idempotency_key=reference, client_reference=reference
+        )
+    except WaaSError as exc:
+        return {'success': False, 'error': exc.message}
+    return {'success': True, **result}
 
 def waas_api_get_balance(wallet_id):
-    # In a real app, this would query the WaaS provider for the live balance
-    # For simulation, we'll calculate it from our internal ledger, assuming it's in sync
-    # OR just return a random/mock value. Let's start with a mock value for the UI.
-    return {'success': True, 'balance': Decimal('150.00')}
+    try:
+        result = get_client().get_balance(wallet_id)
+    except WaaSError as exc:
+        return {'success': False, 'error': exc.message}
+    return {'success': True, **result}
 
 
 # --- Views ---
@@ -53,8 +63,17 @@ def top_up_with_voucher(request):
         voucher_reference=voucher_pin
     )
 
+    if settlement_is_async():
+        # Settled later by wallet.settlement; the balance shows it once completed
+        triggers = {'update-balance': True, 'close-top-up-modal': True, 'update-history': True}
+        return HttpResponse("", status=202, headers={'HX-Trigger': json.dumps(triggers)})
+
     # 2. Call API
-    api_response = waas_api_redeem_voucher(voucher_pin, user_wallet.external_wallet_id)
+    # The client reference lets reconciliation find this row even if we never
+    # store the provider's reference (wallet.reconciliation)
+    api_response = waas_api_redeem_voucher(
+        voucher_pin, user_wallet.external_wallet_id, reference=client_reference(log_entry.pk)
+    )
 
     if api_response['success']:
         # 3. Update Log
@@ -65,7 +84,6 @@ def top_up_with_voucher(request):
         
         # 4. Return success signal to HTMX
         # The 'HX-Trigger' header tells the frontend to update the balance component
-        import json
         triggers = {'update-balance': True, 'close-top-up-modal': True, 'update-history': True}
         return HttpResponse("", status=200, headers={'HX-Trigger': json.dumps(triggers)})
     else:
@@ -86,6 +104,8 @@ def transfer_to_group(request, group_id):
         deceased_id = request.POST.get('deceased_id')
     except (ValueError, TypeError):
          return HttpResponse(f"<span class='text-red-500 text-sm'>Invalid amount</span>")
+    if amount <= 0:
+        return HttpResponse(f"<span class='text-red-500 text-sm'>Invalid amount</span>")
     
     # Validate deceased_id
     if not deceased_id:
@@ -101,22 +121,35 @@ def transfer_to_group(request, group_id):
         return HttpResponse(f"<span class='text-red-500 text-sm'>You have already contributed to this campaign.</span>")
 
     user_wallet = request.user.wallet
+
+    if settlement_is_async() and user_wallet.transactions.filter(
+        status=Transaction.TransactionStatus.PENDING, deceased_contribution=deceased
+    ).exists():
+        return HttpResponse(f"<span class='text-red-500 text-sm'>Your contribution to this campaign is still processing.</span>")
     
-    # 1. Log PENDING
-    log_entry = Transaction.objects.create(
-        wallet=user_wallet,
-        transaction_type=Transaction.TransactionType.TRANSFER,
-        amount=amount,
-        status=Transaction.TransactionStatus.PENDING,
-        destination_group=group,
-        deceased_contribution=deceased  # Link to deceased campaign
-    )
+    # 1. Log PENDING (reserves the amount; checked against the balance under a lock)
+    try:
+        log_entry = debit_for_campaign(
+            user_wallet, request.user.profile, deceased, amount,
+            status=Transaction.TransactionStatus.PENDING,
+            destination_group=group,
+        )
+    except InsufficientFunds:
+        return HttpResponse(f"<span class='text-red-500 text-sm'>Insufficient balance.</span>")
+    except DuplicateContribution:
+        return HttpResponse(f"<span class='text-red-500 text-sm'>You have already contributed to this campaign.</span>")
+
+    if settlement_is_async():
+        # The Contribution is created when the provider confirms the transfer
+        triggers = {'update-balance': True, 'close-transfer-modal': True, 'update-history': True}
+        return HttpResponse("", status=202, headers={'HX-Trigger': json.dumps(triggers)})
     
     # 2. Call API
     api_response = waas_api_transfer_funds(
         from_wallet_id=user_wallet.external_wallet_id,
         to_wallet_id=group.external_wallet_id,
-        amount=amount
+        amount=amount,
+        reference=client_reference(log_entry.pk)
     )
     
     if api_response['success']:
@@ -136,7 +169,6 @@ def transfer_to_group(request, group_id):
         )
         
         # 5. Return success
-        import json
         triggers = {
             'update-balance': True, 
             'close-transfer-modal': True,
@@ -159,7 +191,10 @@ def get_wallet_balance_snippet(request):
     user_wallet, created = Wallet.objects.get_or_create(user=request.user, defaults={'external_wallet_id': f"auto_{request.user.email}"})
     
     balance = user_wallet.get_balance()
-    
+    pending = user_wallet.get_pending_amount()
+    if pending:
+        return HttpResponse(f"R {balance} <span class='text-xs text-gray-500'>(R {pending:.2f} pending)</span>")
+
     return HttpResponse(f"R {balance}")
 
 @login_required
@@ -194,7 +229,9 @@ def group_transaction_history(request, group_id):
         return HttpResponse("Unauthorized", status=403)
     
     # All transactions where this group is the destination
-    transactions = Transaction.objects.filter(destination_group=group).order_by('-timestamp')
+    transactions = Transaction.objects.filter(destination_group=group).select_related(
+        'wallet__user__profile', 'deceased_contribution__beneficiary__user', 'deceased_contribution__deceased__user'
+    ).order_by('-timestamp')
     
     # Calculate group balance (Sum of transfers - Sum of payouts)
     from django.db.models import Sum
@@ -213,3 +250,28 @@ def group_transaction_history(request, group_id):
         return render(request, 'wallet/partials/group_transaction_list.html', context)
         
     return render(request, 'wallet/group_history.html', context)
+
+
+@csrf_exempt
+@require_POST
+def waas_webhook(request):
+    """
+    Settlement callbacks from the WaaS provider (see wallet.settlement).
+    The body is signed with WAAS_WEBHOOK_SECRET; events are processed once.
+    """
+    if not verify_webhook(
+        settings.WAAS_WEBHOOK_SECRET,
+        request.headers.get('X-WaaS-Timestamp'),
+        request.body,
+        request.headers.get('X-WaaS-Signature'),
+        settings.WAAS_WEBHOOK_TOLERANCE_SECONDS,
+    ):
+        return JsonResponse({'error': 'Invalid signature'}, status=403)
+
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+
+    settled = process_webhook(payload)
+    return JsonResponse({'settled': settled})
@@ -0,0 +1,305 @@
+"""
+Client for the WaaS (wallet-as-a-service) provider.
+
+One process-wide `WaaSClient` keeps a pooled keep-alive HTTP session with
+strict connect/read timeouts. Failed calls are retried with exponential
+backoff and full jitter (every write carries an Idempotency-Key, so retries
+are safe), and a circuit breaker fails fast while the provider is down so
+slow responses cannot tie up every worker. `AsyncWaaSClient` offers the same
+calls to async code.
+
+Without WAAS_BASE_URL the client talks to the in-memory FakeProvider
+(wallet.fake_provider) instead of the network.
+"""
+import hashlib
+import hmac
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from core.metrics import WAAS_LATENCY
+from core.tracing import current_traceparent, span
+
+from .fake_provider import FakeProvider
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+# Wallet ids and references in paths become one metrics label value
+_PATH_ID_RE = re.compile(r'/(wallets|transactions)/[^/]+')
+
+
+def metrics_endpoint(path):
+    return _PATH_ID_RE.sub(r'/\1/{id}', path.split('?', 1)[0])
+
+
+class WaaSError(Exception):
+    """The provider rejected the call (bad PIN, invalid amount, ...)."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class WaaSUnavailable(WaaSError):
+    """The provider timed out, kept failing, or the circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures; while open every call fails
+    immediately. After `reset_timeout` seconds one trial call is let through
+    (half-open) and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class WaaSClient:
+
+    def __init__(self, base_url=None, api_key=None, connect_timeout=None, read_timeout=None,
+                 max_retries=None, backoff=None, pool_size=None, breaker=None, provider=None):
+        self.base_url = (base_url if base_url is not None else settings.WAAS_BASE_URL or '').rstrip('/')
+        self.api_key = api_key if api_key is not None else settings.WAAS_API_KEY
+        self.timeout = (
+            connect_timeout if connect_timeout is not None else settings.WAAS_CONNECT_TIMEOUT,
+            read_timeout if read_timeout is not None else settings.WAAS_READ_TIMEOUT,
+        )
+        self.max_retries = max_retries if max_retries is not None else settings.WAAS_MAX_RETRIES
+        self.backoff = backoff if backoff is not None else settings.WAAS_RETRY_BACKOFF
+        self.breaker = breaker or CircuitBreaker(
+            settings.WAAS_BREAKER_THRESHOLD, settings.WAAS_BREAKER_RESET_SECONDS
+        )
+        # In-process provider when no URL is configured
+        self.provider = provider if provider is not None else (None if self.base_url else FakeProvider())
+
+        pool_size = pool_size or settings.WAAS_POOL_SIZE
+        self.session = requests.Session()
+        # Retries are handled here, not by urllib3, so the breaker sees every failure
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0, pool_block=False)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if self.api_key:
+            self.session.headers['Authorization'] = f"Bearer {self.api_key}"
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter: spreads retries from many workers over the window
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def _send(self, method, path, payload, idempotency_key):
+        if self.provider is not None:
+            return self.provider.handle(method, path, payload, idempotency_key)
+        headers = {'Idempotency-Key': idempotency_key} if idempotency_key else {}
+        traceparent = current_traceparent()
+        if traceparent:
+            headers['traceparent'] = traceparent
+        response = self.session.request(
+            method, self.base_url + path, json=payload, headers=headers, timeout=self.timeout
+        )
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        return response.status_code, body
+
+    def request(self, method, path, payload=None, idempotency_key=None):
+        """Perform one API call and return the JSON body, or raise WaaSError / WaaSUnavailable."""
+        endpoint = metrics_endpoint(path)
+        started = time.perf_counter()
+        outcome = 'ok'
+        with span('waas.request', kind='CLIENT', **{'http.method': method, 'waas.endpoint': endpoint}) as current:
+            try:
+                return self._request(method, path, payload, idempotency_key)
+            except WaaSUnavailable:
+                outcome = 'unavailable'
+                raise
+            except WaaSError:
+                outcome = 'rejected'
+                raise
+            finally:
+                WAAS_LATENCY.observe(time.perf_counter() - started, method=method, endpoint=endpoint, outcome=outcome)
+                current.set(outcome=outcome)
+
+    def _request(self, method, path, payload, idempotency_key):
+        if method != 'GET' and idempotency_key is None:
+            idempotency_key = uuid.uuid4().hex
+
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                raise WaaSUnavailable("Payment provider is unavailable, please try again shortly.")
+            try:
+                with span('waas.attempt', attempt=attempt) as current:
+                    status, body = self._send(method, path, payload, idempotency_key)
+                    current.set(**{'http.status_code': status})
+            except requests.RequestException as exc:
+                last_error = exc
+                self.breaker.record_failure()
+            except Exception:
+                # Anything else still ends a half-open trial
+                self.breaker.record_failure()
+                raise
+            else:
+                if status in RETRY_STATUSES or status >= 500:
+                    last_error = WaaSError(body.get('error') or f"Provider returned {status}", status=status)
+                    self.breaker.record_failure()
+                else:
+                    # A definite answer (even a rejection) means the provider is healthy
+                    self.breaker.record_success()
+                    if status >= 400:
+                        raise WaaSError(body.get('error') or f"Provider returned {status}", status=status)
+                    return body
+            if attempt < self.max_retries:
+                self._sleep_before_retry(attempt)
+
+        logger.warning("WaaS %s %s failed after %s attempt(s): %s", method, path, self.max_retries + 1, last_error)
+        raise WaaSUnavailable("Payment provider is unavailable, please try again shortly.")
+
+    @staticmethod
+    def _result(body):
+        amount = body.get('amount')
+        return {
+            'waas_ref': body['reference'],
+            'status': body.get('status', 'COMPLETED'),
+            'amount': Decimal(str(amount)) if amount is not None else None,
+            'client_reference': body.get('client_reference'),
+            'error': body.get('error'),
+        }
+
+    def redeem_voucher(self, pin, wallet_id, idempotency_key=None, client_reference=None):
+        body = self.request('POST', '/v1/vouchers/redeem', {
+            'pin': pin,
+            'wallet_id': wallet_id,
+            'client_reference': client_reference,
+        }, idempotency_key)
+        return self._result(body)
+
+    def transfer_funds(self, from_wallet_id, to_wallet_id, amount, idempotency_key=None, client_reference=None):
+        body = self.request('POST', '/v1/transfers', {
+            'from_wallet': from_wallet_id,
+            'to_wallet': to_wallet_id,
+            'amount': str(amount),
+            'client_reference': client_reference,
+        }, idempotency_key)
+        return self._result(body)
+
+    def get_transaction(self, reference):
+        """Current status of a submitted transaction (settlement poller)."""
+        return self._result(self.request('GET', f'/v1/transactions/{reference}'))
+
+    def get_balance(self, wallet_id):
+        body = self.request('GET', f'/v1/wallets/{wallet_id}/balance')
+        return {'balance': Decimal(str(body['balance']))}
+
+    def iter_statement(self, page_size=1000):
+        """Yield every statement line, fetching one page at a time."""
+        cursor = 0
+        while cursor is not None:
+            body = self.request('GET', f'/v1/statements?cursor={cursor}&limit={page_size}')
+            yield from body.get('lines', [])
+            cursor = body.get('next_cursor')
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncWaaSClient:
+    """
+    Async facade over a WaaSClient. Calls run in a worker thread so the
+    pooled session, timeouts, retries and breaker are shared with sync code.
+    """
+
+    def __init__(self, client=None):
+        self.client = client or get_client()
+
+    async def redeem_voucher(self, pin, wallet_id, idempotency_key=None, client_reference=None):
+        return await sync_to_async(self.client.redeem_voucher, thread_sensitive=False)(
+            pin, wallet_id, idempotency_key=idempotency_key, client_reference=client_reference
+        )
+
+    async def transfer_funds(self, from_wallet_id, to_wallet_id, amount, idempotency_key=None, client_reference=None):
+        return await sync_to_async(self.client.transfer_funds, thread_sensitive=False)(
+            from_wallet_id, to_wallet_id, amount, idempotency_key=idempotency_key, client_reference=client_reference
+        )
+
+    async def get_transaction(self, reference):
+        return await sync_to_async(self.client.get_transaction, thread_sensitive=False)(reference)
+
+    async def get_balance(self, wallet_id):
+        return await sync_to_async(self.client.get_balance, thread_sensitive=False)(wallet_id)
+
+
+def sign_webhook(secret, timestamp, body):
+    """HMAC-SHA256 over `<timestamp>.<raw body>`, as sent in X-WaaS-Signature."""
+    message = timestamp.encode() + b'.' + body
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify_webhook(secret, timestamp, body, signature, tolerance):
+    if not (secret and timestamp and signature):
+        return False
+    try:
+        if abs(time.time() - int(timestamp)) > tolerance:
+            # Stale or replayed delivery
+            return False
+    except ValueError:
+        return False
+    return hmac.compare_digest(sign_webhook(secret, timestamp, body), signature)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The process-wide client (one connection pool and breaker per process)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = WaaSClient()
+    return _client